@@ -0,0 +1,233 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""A per-worker, in-memory index of aggregate membership.
+
+For every aggregate the index holds a frozenset of the ids of its member
+resource providers. The member_of filter of ``GET /resource_providers`` is
+then the union of a few sets, which costs in proportion to the number of
+members rather than to the number of resource providers, instead of a join
+of placement_aggregates and resource_provider_aggregates in every query.
+
+While the index is in use (``[placement]/member_of_index``), every change
+to the associations increments the "aggregates" row of the
+catalog_versions table in the same transaction. A worker which makes a
+change tells the index the version it moved the catalog to; when no other
+worker changed anything in between only the resource provider concerned is
+reloaded. Otherwise, and whenever a check of the version in the database,
+made at most once every ``[placement]/aggregate_index_check_interval``
+seconds, finds it has moved on, the index is rebuilt.
+"""
+
+import collections
+import threading
+import time
+
+from oslo_log import log as logging
+import sqlalchemy as sa
+
+from placement import conf
+from placement import db
+from placement.db import models
+
+
+CONF = conf.CONF
+LOG = logging.getLogger(__name__)
+
+_AGG_TBL = models.PlacementAggregate.__table__
+_RP_AGG_TBL = models.ResourceProviderAggregate.__table__
+_CATALOG_TBL = models.CatalogVersion.__table__
+# The name of the catalog_versions row of the aggregate associations.
+CATALOG = 'aggregates'
+# The most resource provider ids a member_of filter is turned into. Larger
+# memberships are left to the database to join.
+MAX_IDS = 1000
+_INDEX = None
+
+
+def enabled():
+    """Return whether the aggregate index is used, so the changes of every
+    worker must be counted in the aggregates catalog version.
+    """
+    return CONF.placement.member_of_index
+
+
+def _get_version(conn):
+    sel = sa.select([_CATALOG_TBL.c.version]).where(
+        _CATALOG_TBL.c.name == CATALOG)
+    return conn.execute(sel).scalar()
+
+
+@db.main_context_manager.reader
+def _get_version_from_db(ctx):
+    return _get_version(ctx.session.connection())
+
+
+@db.main_context_manager.reader
+def _load_from_db(ctx, rp_ids=None):
+    """Load aggregate associations.
+
+    :param rp_ids: If not None, only load the associations of these
+                   resource provider ids.
+    :returns: A tuple of the version of the aggregates catalog and a dict,
+              keyed by resource provider id, of sets of aggregate uuids.
+              The version is read first so the associations are never
+              older than it.
+    """
+    conn = ctx.session.connection()
+    version = _get_version(conn)
+    agg_join = sa.join(_RP_AGG_TBL, _AGG_TBL,
+                       _RP_AGG_TBL.c.aggregate_id == _AGG_TBL.c.id)
+    sel = sa.select([_RP_AGG_TBL.c.resource_provider_id,
+                     _AGG_TBL.c.uuid]).select_from(agg_join)
+    if rp_ids is not None:
+        sel = sel.where(_RP_AGG_TBL.c.resource_provider_id.in_(rp_ids))
+    aggregates = collections.defaultdict(set)
+    for row in conn.execute(sel):
+        aggregates[row['resource_provider_id']].add(row['uuid'])
+    return version, dict(aggregates)
+
+
+class AggregateIndex(object):
+    """The resource provider ids of the members of every aggregate, keyed by
+    aggregate uuid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Changes made by this worker as (version, resource provider id),
+        # queued under a lock of their own, so that a writer never waits
+        # for a rebuild, and applied on the next lookup.
+        self._changes_lock = threading.Lock()
+        self._changes = []
+        self._rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        self._members = {}
+        self._aggregates = {}
+        self._dirty = set()
+        self._version = None
+        self._built = False
+        self._next_check = 0
+
+    def clear(self):
+        """Forget everything so the next lookup rebuilds the index."""
+        with self._lock:
+            self._reset()
+
+    def mark_dirty(self, rp_id, version):
+        """Record that the aggregates of the resource provider with id rp_id
+        were changed, in this worker, by the transaction which moved the
+        aggregates catalog to version.
+        """
+        with self._changes_lock:
+            self._changes.append((version, rp_id))
+
+    def _apply_changes(self):
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+        for version, rp_id in sorted(changes):
+            if version is None or self._version is None:
+                self._next_check = 0
+            elif version == self._version + 1:
+                self._dirty.add(rp_id)
+                self._version = version
+            elif version > self._version:
+                # Another worker changed something in between.
+                self._next_check = 0
+
+    def _rebuild(self, ctx):
+        self._dirty = set()
+        self._rebuilding = True
+        try:
+            self._version, self._aggregates = _load_from_db(ctx)
+        finally:
+            self._rebuilding = False
+        members = collections.defaultdict(set)
+        for rp_id, agg_uuids in self._aggregates.items():
+            for agg_uuid in agg_uuids:
+                members[agg_uuid].add(rp_id)
+        self._members = {agg_uuid: frozenset(rp_ids)
+                         for agg_uuid, rp_ids in members.items()}
+        self._built = True
+        LOG.debug('Rebuilt aggregate index with %d aggregates at version %s',
+                  len(self._members), self._version)
+
+    def _reload(self, ctx):
+        dirty, self._dirty = self._dirty, set()
+        _version, aggregates = _load_from_db(ctx, dirty)
+        # The members of each aggregate which gained or lost any of the
+        # dirty resource providers are replaced once.
+        removed = collections.defaultdict(set)
+        added = collections.defaultdict(set)
+        for rp_id in dirty:
+            for agg_uuid in self._aggregates.pop(rp_id, set()):
+                removed[agg_uuid].add(rp_id)
+        for rp_id, agg_uuids in aggregates.items():
+            self._aggregates[rp_id] = agg_uuids
+            for agg_uuid in agg_uuids:
+                added[agg_uuid].add(rp_id)
+        for agg_uuid in set(removed) | set(added):
+            members = ((self._members.get(agg_uuid, frozenset()) -
+                        removed[agg_uuid]) | added[agg_uuid])
+            if members:
+                self._members[agg_uuid] = members
+            else:
+                self._members.pop(agg_uuid, None)
+
+    def get_members(self, ctx, agg_uuids):
+        """Return the frozenset of the ids of the resource providers
+        associated with any of agg_uuids, or None if the index cannot
+        currently be used.
+        """
+        # NOTE(cdent): While another thread rebuilds the index the caller
+        # is better off joining in the database than waiting.
+        if self._rebuilding:
+            return None
+        with self._lock:
+            self._apply_changes()
+            now = time.time()
+            if not self._built:
+                self._rebuild(ctx)
+            elif now >= self._next_check:
+                if _get_version_from_db(ctx) != self._version:
+                    self._rebuild(ctx)
+            if now >= self._next_check:
+                self._next_check = (
+                    now + CONF.placement.aggregate_index_check_interval)
+            if self._dirty:
+                self._reload(ctx)
+            return frozenset().union(*(
+                self._members.get(agg_uuid, frozenset())
+                for agg_uuid in agg_uuids))
+
+
+def get_index():
+    """Return the aggregate index of this worker, creating it if needed."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = AggregateIndex()
+    return _INDEX
+
+
+def mark_dirty(rp_id, version):
+    """Mark the aggregates of one resource provider as changed in this
+    worker's index.
+    """
+    if _INDEX is not None:
+        _INDEX.mark_dirty(rp_id, version)
+
+
+def clear():
+    """Empty this worker's index, forcing a rebuild on next use."""
+    if _INDEX is not None:
+        _INDEX.clear()
@@ -0,0 +1,126 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Middleware accounting for the SQL statements run by each request."""
+
+import threading
+
+from placement.api import handler
+from placement import conf
+from placement.db import accounting
+
+
+CONF = conf.CONF
+# The WSGI environment key of the `accounting.SqlStats` of a request.
+SQL_STATS_ENVIRON = 'placement.sql_stats'
+STATEMENTS_HEADER = 'placement-sql-statements'
+ROWS_HEADER = 'placement-sql-rows'
+TIME_HEADER = 'placement-sql-time-ms'
+
+# Totals of the SQL statements run, keyed by "METHOD /route/{template}".
+_ROUTE_STATS = {}
+_ROUTE_STATS_LOCK = threading.Lock()
+
+
+def _route_key(environ):
+    return '%s %s' % (environ['REQUEST_METHOD'],
+                      environ.get(handler.ROUTE_ENVIRON, '-'))
+
+
+def _record(environ, stats):
+    key = _route_key(environ)
+    with _ROUTE_STATS_LOCK:
+        totals = _ROUTE_STATS.get(key)
+        if totals is None:
+            totals = _ROUTE_STATS[key] = {
+                'requests': 0, 'statements': 0, 'rows': 0, 'seconds': 0.0,
+                'max_statements': 0}
+        totals['requests'] += 1
+        totals['statements'] += stats.statements
+        totals['rows'] += stats.rows
+        totals['seconds'] += stats.seconds
+        totals['max_statements'] = max(totals['max_statements'],
+                                       stats.statements)
+
+
+def get_route_stats():
+    """Returns a dict, keyed by request method and route template, of the
+    number of requests made to each route since this process started and
+    the statements run, rows reported and seconds spent in the database
+    for them in total, along with the most statements run by any one.
+    """
+    with _ROUTE_STATS_LOCK:
+        return dict((key, dict(totals))
+                    for key, totals in _ROUTE_STATS.items())
+
+
+def reset_route_stats():
+    """Forget the totals of every route."""
+    with _ROUTE_STATS_LOCK:
+        _ROUTE_STATS.clear()
+
+
+class _ClosingIterator(object):
+    """Call a function once the server is done with a response body, which
+    may be generated, and so run statements, after the headers are sent.
+    """
+
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.callback()
+
+
+class SqlAccounting(object):
+    """WSGI Middleware which counts the SQL statements each request runs.
+
+    The counts are added to the per-route totals returned by
+    `get_route_stats`, are available to the request log and, when
+    [placement]/sql_accounting_headers is true, are sent in response
+    headers. Statements run while a streamed body is generated are only
+    in the totals.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        stats = accounting.start()
+        environ[SQL_STATS_ENVIRON] = stats
+        headers_wanted = CONF.placement.sql_accounting_headers
+
+        def replacement_start_response(status, headers, exc_info=None):
+            if headers_wanted:
+                headers = list(headers) + [
+                    (STATEMENTS_HEADER, str(stats.statements)),
+                    (ROWS_HEADER, str(stats.rows)),
+                    (TIME_HEADER, '%.3f' % (stats.seconds * 1000))]
+            return start_response(status, headers, exc_info)
+
+        def finish():
+            accounting.stop()
+            _record(environ, stats)
+
+        try:
+            app_iter = self.application(environ, replacement_start_response)
+        except Exception:
+            finish()
+            raise
+        return _ClosingIterator(app_iter, finish)
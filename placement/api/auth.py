@@ -19,6 +19,7 @@ import webob.dec
 import webob.exc
 
 from placement import conf
+from placement import objects
 
 
 CONF = conf.CONF
@@ -58,7 +59,13 @@ class NoAuthMiddleware(Middleware):
 
 @enginefacade.transaction_context_provider
 class RequestContext(context.RequestContext):
-    pass
+
+    def __init__(self, *args, **kwargs):
+        super(RequestContext, self).__init__(*args, **kwargs)
+        # Resource providers loaded while an API request is handled, so that
+        # each is read from the database at most once. Only the contexts of
+        # API requests have one; see PlacementKeystoneContext.
+        self.provider_map = None
 
 
 def get_admin_context():
@@ -79,5 +86,6 @@ class PlacementKeystoneContext(Middleware):
             LOG.debug("Neither X_USER_ID nor X_USER found in request")
             return webob.exc.HTTPUnauthorized()
 
+        ctx.provider_map = objects.ProviderIdentityMap()
         req.environ['placement.context'] = ctx
         return self.application
@@ -16,9 +16,13 @@ import oslo_middleware
 from oslo_middleware import cors
 
 # from nova.api import openstack as common_api
+from placement.api import accounting
 from placement.api import auth
 from placement.api import handler
+from placement.api import metrics
 from placement.api import microversion
+from placement.api import periodic
+from placement.api import profiler
 from placement.api import requestlog
 
 
@@ -51,6 +55,9 @@ def deploy(conf, project_name):
     microversion_middleware = microversion.MicroversionMiddleware
     # fault_wrap = common_api.FaultWrapper
     request_log = requestlog.RequestLog
+    sql_accounting = accounting.SqlAccounting
+    metrics_middleware = metrics.Metrics
+    profiler_middleware = profiler.Profiler
 
     application = handler.PlacementHandler()
 
@@ -64,6 +71,9 @@ def deploy(conf, project_name):
     # authentication information.
     for middleware in (microversion_middleware,
                        # fault_wrap,
+                       profiler_middleware,
+                       sql_accounting,
+                       metrics_middleware,
                        request_log,
                        context_middleware,
                        auth_middleware,
@@ -78,4 +88,5 @@ def deploy(conf, project_name):
 
 def loadapp(config, project_name=NAME):
     application = deploy(config, project_name)
+    periodic.start(config)
     return application
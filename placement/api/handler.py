@@ -30,10 +30,13 @@ from oslo_log import log as logging
 
 from placement.api.handlers import aggregate
 from placement.api.handlers import allocation
+from placement.api.handlers import capacity
 from placement.api.handlers import inventory
+from placement.api.handlers import metrics
 from placement.api.handlers import resource_class
 from placement.api.handlers import resource_provider
 from placement.api.handlers import root
+from placement.api.handlers import trait
 from placement.api.handlers import usage
 from placement.api import util
 from placement import exception
@@ -42,6 +45,9 @@ from placement.api import policy
 
 LOG = logging.getLogger(__name__)
 
+# The WSGI environment key of the template of the route a request matched.
+ROUTE_ENVIRON = 'placement.route'
+
 # URLs and Handlers
 # NOTE(cdent): When adding URLs here, do not use regex patterns in
 # the path parameters (e.g. {uuid:[0-9a-zA-Z-]+}) as that will lead
@@ -97,11 +103,36 @@ ROUTE_DECLARATIONS = {
     '/resource_providers/{uuid}/allocations': {
         'GET': allocation.list_for_resource_provider,
     },
+    '/resource_providers/{uuid}/traits': {
+        'GET': trait.list_traits_for_resource_provider,
+        'PUT': trait.update_traits_for_resource_provider,
+        'DELETE': trait.delete_traits_for_resource_provider
+    },
+    '/metrics': {
+        'GET': metrics.get_metrics
+    },
+    '/capacity': {
+        'GET': capacity.get_capacity
+    },
+    '/inventories': {
+        'PUT': inventory.set_inventories_for_providers
+    },
+    '/allocations': {
+        'POST': allocation.set_allocations_for_consumers,
+    },
     '/allocations/{consumer_uuid}': {
         'GET': allocation.list_for_consumer,
         'PUT': allocation.set_allocations,
         'DELETE': allocation.delete_allocations,
     },
+    '/traits': {
+        'GET': trait.list_traits,
+    },
+    '/traits/{name}': {
+        'GET': trait.get_trait,
+        'PUT': trait.put_trait,
+        'DELETE': trait.delete_trait,
+    },
 }
 
 
@@ -112,13 +143,16 @@ def dispatch(environ, start_response, mapper):
     If there is a matching route, but no matching handler
     for the given method, raise a 405.
     """
-    result = mapper.match(environ=environ)
-    if result is None:
+    match = mapper.routematch(environ=environ)
+    if match is None:
         raise webob.exc.HTTPNotFound(
             json_formatter=util.json_error_formatter)
+    result, route = match
     # We can't reach this code without action being present.
     handler = result.pop('action')
     environ['wsgiorg.routing_args'] = ((), result)
+    # The route template, for accounting done per route.
+    environ[ROUTE_ENVIRON] = route.routepath
     return handler(environ, start_response)
 
 
@@ -50,7 +50,7 @@ def get_aggregates(req):
     If the resource provider does not exist return a 404.
 
     On success return a 200 with an application/json body containing a
-    list of aggregate uuids.
+    list of aggregate uuids, or a 304 if the client already has it.
     """
     microversion.raise_404_if_not_version(req, (1, 1))
     context = req.environ['placement.context']
@@ -59,6 +59,12 @@ def get_aggregates(req):
         context, uuid)
     aggregate_uuids = resource_provider.get_aggregates()
 
+    # Setting aggregates does not increment the generation of the
+    # resource provider so the tag is made from the aggregates.
+    etag = util.make_etag(req, 'aggregates', *sorted(aggregate_uuids))
+    if util.check_not_modified(req, etag):
+        return req.response
+
     return _send_aggregates(req.response, aggregate_uuids)
 
 
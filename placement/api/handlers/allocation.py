@@ -12,6 +12,9 @@
 """Placement API handlers for setting and deleting allocations."""
 
 import collections
+import copy
+import itertools
+import operator
 
 import jsonschema
 from oslo_log import log as logging
@@ -19,6 +22,7 @@ from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 import webob
 
+from placement.api import microversion
 from placement.api import util
 from placement.api import wsgi_wrapper
 from placement import exception
@@ -69,6 +73,48 @@ ALLOCATION_SCHEMA = {
     "additionalProperties": False
 }
 
+# Represents the allowed query string parameters to the
+# GET /resource_providers/{uuid}/allocations API call. Microversion 1.6 adds
+# a limit on the number of consumers and an opaque marker identifying the
+# last consumer of the previous page.
+GET_RP_ALLOCATIONS_SCHEMA_V1_6 = {
+    "type": "object",
+    "properties": {
+        "limit": {
+            "type": "string",
+            "pattern": "^[1-9][0-9]*$"
+        },
+        "marker": {
+            "type": "string"
+        }
+    },
+    "additionalProperties": False
+}
+
+# Represents the allowed format of the body of POST /allocations, a map of
+# consumer uuid to the list of allocations of that consumer in the same
+# format as is used by PUT /allocations/{consumer_uuid}.
+BULK_ALLOCATION_SCHEMA_V1_5 = {
+    "type": "object",
+    "properties": {
+        "allocations": {
+            "type": "object",
+            "patternProperties": {
+                "^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$":
+                    copy.deepcopy(
+                        ALLOCATION_SCHEMA["properties"]["allocations"])
+            },
+            "minProperties": 1,
+            "additionalProperties": False
+        },
+        "partial": {
+            "type": "boolean"
+        }
+    },
+    "required": ["allocations"],
+    "additionalProperties": False
+}
+
 
 def _allocations_dict(allocations, key_fetcher, resource_provider=None):
     """Turn allocations into a dict of resources keyed by key_fetcher."""
@@ -110,6 +156,28 @@ def _extract_allocations(body, schema):
     return data
 
 
+def _resource_providers_by_uuid(context, allocation_lists):
+    """Load, with one query, every resource provider referred to in the
+    supplied lists of allocations and return them in a dict keyed by uuid,
+    in the form made by `util.normalize_uuid`.
+
+    If the allocations refer to resource providers that do not exist,
+    raise a 400 naming all of them.
+    """
+    uuids = set(util.normalize_uuid(allocation['resource_provider']['uuid'])
+                for allocation_data in allocation_lists
+                for allocation in allocation_data)
+    try:
+        resource_providers = objects.ResourceProviderList.get_by_uuids(
+            context, uuids)
+    except exception.ResourceProviderNotFound as exc:
+        raise webob.exc.HTTPBadRequest(
+            _("Allocation for resource provider '%(rp_uuid)s' "
+              "that does not exist.") %
+            {'rp_uuid': ', '.join(exc.uuids)})
+    return dict((rp.uuid, rp) for rp in resource_providers)
+
+
 def _serialize_allocations_for_consumer(allocations):
     """Turn a list of allocations into a dict by resource provider uuid.
 
@@ -134,9 +202,11 @@ def _serialize_allocations_for_consumer(allocations):
                              lambda x: x.resource_provider.uuid)
 
 
-def _serialize_allocations_for_resource_provider(allocations,
-                                                 resource_provider):
-    """Turn a list of allocations into a dict by consumer id.
+def _stream_allocations_by_consumer(allocations):
+    """Turn an iterator of (consumer id, resource class, amount) tuples, in
+    which the allocations of each consumer are consecutive, into one of
+    (consumer id, data) pairs which stream as the allocations of a resource
+    provider:
 
     {'resource_provider_generation': GENERATION,
      'allocations':
@@ -154,8 +224,11 @@ def _serialize_allocations_for_resource_provider(allocations,
        }
     }
     """
-    return _allocations_dict(allocations, lambda x: x.consumer_id,
-                             resource_provider=resource_provider)
+    for consumer_id, consumer_allocations in itertools.groupby(
+            allocations, key=operator.itemgetter(0)):
+        resources = dict((resource_class, used) for _consumer_id,
+                         resource_class, used in consumer_allocations)
+        yield consumer_id, {'resources': resources}
 
 
 @wsgi_wrapper.PlacementWsgify
@@ -183,14 +256,26 @@ def list_for_consumer(req):
 @wsgi_wrapper.PlacementWsgify
 @util.check_accept('application/json')
 def list_for_resource_provider(req):
-    """List allocations associated with a resource provider."""
-    # TODO(cdent): On a shared resource provider (for example a
-    # giant disk farm) this list could get very long. At the moment
-    # we have no facility for limiting the output. Given that we are
-    # using a dict of dicts for the output we are potentially limiting
-    # ourselves in terms of sorting and filtering.
+    """List allocations associated with a resource provider.
+
+    On a shared resource provider (for example a giant disk farm) this
+    list can get very long so from microversion 1.6 it may be paginated,
+    by consumer, with the limit and marker query parameters.
+    """
     context = req.environ['placement.context']
     uuid = util.wsgi_path_item(req.environ, 'uuid')
+    want_version = req.environ[microversion.MICROVERSION_ENVIRON]
+
+    limit = marker = None
+    if want_version >= (1, 6):
+        try:
+            jsonschema.validate(dict(req.GET),
+                                GET_RP_ALLOCATIONS_SCHEMA_V1_6)
+        except jsonschema.ValidationError as exc:
+            raise webob.exc.HTTPBadRequest(
+                _('Invalid query string parameters: %(exc)s') %
+                {'exc': exc})
+        limit, marker = util.extract_pagination(req)
 
     # confirm existence of resource provider so we get a reasonable
     # 404 instead of empty list
@@ -202,15 +287,31 @@ def list_for_resource_provider(req):
             _("Resource provider '%(rp_uuid)s' not found: %(error)s") %
             {'rp_uuid': uuid, 'error': exc})
 
-    allocations = objects.AllocationList.get_all_by_resource_provider_uuid(
-        context, uuid)
-
-    allocations_json = jsonutils.dumps(
-        _serialize_allocations_for_resource_provider(
-            allocations, resource_provider))
-
+    consumer_ids = None
+    if limit is not None or marker is not None:
+        # Ask for one more consumer than the limit to learn whether there
+        # is a next page.
+        consumers = (
+            objects.AllocationList.get_consumers_by_resource_provider(
+                context, resource_provider, limit=limit and limit + 1,
+                marker=marker))
+        if limit is not None and len(consumers) > limit:
+            consumers = consumers[:limit]
+            req.response.headers['link'] = util.next_page_link(
+                req, consumers[-1][1])
+        consumer_ids = [consumer_id for consumer_id, _key in consumers]
+
+    # The allocations of a large shared resource provider can be very
+    # many so they are streamed to the client as they are read from the
+    # database.
+    allocations = objects.AllocationList.iter_by_resource_provider(
+        context, resource_provider, consumer_ids=consumer_ids)
     req.response.status = 200
-    req.response.body = encodeutils.to_utf8(allocations_json)
+    req.response.app_iter = util.stream_json(
+        'allocations',
+        _stream_allocations_by_consumer(allocations),
+        pairs=True,
+        extra={'resource_provider_generation': resource_provider.generation})
     req.response.content_type = 'application/json'
     return req.response
 
@@ -225,33 +326,23 @@ def set_allocations(req):
 
     # If the body includes an allocation for a resource provider
     # that does not exist, raise a 400.
-    allocation_objects = []
+    resource_providers = _resource_providers_by_uuid(
+        context, [allocation_data])
+    allocations = []
     for allocation in allocation_data:
-        resource_provider_uuid = allocation['resource_provider']['uuid']
-
-        try:
-            resource_provider = objects.ResourceProvider.get_by_uuid(
-                context, resource_provider_uuid)
-        except exception.NotFound:
-            raise webob.exc.HTTPBadRequest(
-                _("Allocation for resource provider '%(rp_uuid)s' "
-                  "that does not exist.") %
-                {'rp_uuid': resource_provider_uuid})
+        resource_provider_uuid = util.normalize_uuid(
+            allocation['resource_provider']['uuid'])
+        resource_provider = resource_providers[resource_provider_uuid]
 
         resources = allocation['resources']
         for resource_class in resources:
-            allocation = objects.Allocation(
-                resource_provider=resource_provider,
-                consumer_id=consumer_uuid,
-                resource_class=resource_class,
-                used=resources[resource_class])
-            allocation_objects.append(allocation)
-
-    allocations = objects.AllocationList(context, objects=allocation_objects)
+            allocations.append((resource_provider, consumer_uuid,
+                                resource_class, resources[resource_class]))
 
     try:
-        allocations.create_all()
-        LOG.debug("Successfully wrote allocations %s", allocations)
+        objects.AllocationList.create_all_from_tuples(context, allocations)
+        LOG.debug("Successfully wrote %d allocations for consumer %s",
+                  len(allocations), consumer_uuid)
     # InvalidInventory is a parent for several exceptions that
     # indicate either that Inventory is not present, or that
     # capacity limits have been exceeded.
@@ -275,6 +366,77 @@ def set_allocations(req):
     return req.response
 
 
+@wsgi_wrapper.PlacementWsgify
+@microversion.version_handler(1.5)
+@util.require_content('application/json')
+def set_allocations_for_consumers(req):
+    """POST to write the allocations of many consumers at once.
+
+    The allocations of every consumer replace its existing allocations, as
+    with PUT /allocations/{consumer_uuid}, and are all written in the same
+    transaction. By default if the allocations of any one consumer cannot
+    be made none are written. If "partial" is true in the body, the
+    allocations of those consumers which can be made are written and a
+    200 response lists which consumers were accepted and why the others
+    were rejected.
+    """
+    context = req.environ['placement.context']
+    data = _extract_allocations(req.body, BULK_ALLOCATION_SCHEMA_V1_5)
+    partial = data.get('partial', False)
+
+    # Each resource provider is loaded once however many consumers
+    # allocate from it, so that its generation is checked and
+    # incremented once for the whole request.
+    consumers = util.normalize_uuid_keys(data['allocations'])
+    resource_providers = _resource_providers_by_uuid(
+        context, consumers.values())
+    allocations = []
+    for consumer_uuid, allocation_data in consumers.items():
+        for allocation in allocation_data:
+            resource_provider = resource_providers[util.normalize_uuid(
+                allocation['resource_provider']['uuid'])]
+
+            resources = allocation['resources']
+            for resource_class in resources:
+                allocations.append((resource_provider, consumer_uuid,
+                                    resource_class, resources[resource_class]))
+
+    try:
+        failures = objects.AllocationList.create_all_from_tuples(
+            context, allocations, partial=partial)
+        LOG.debug("Successfully wrote %d allocations for %d consumers",
+                  len(allocations), len(consumers))
+    except exception.NotFound as exc:
+        raise webob.exc.HTTPBadRequest(
+            _("Unable to allocate inventory: %(error)s") % {'error': exc})
+    except exception.InvalidInventory as exc:
+        LOG.exception(_LE("Bad inventory"))
+        raise webob.exc.HTTPConflict(
+            _('Unable to allocate inventory: %(error)s') % {'error': exc})
+    except exception.ConcurrentUpdateDetected as exc:
+        LOG.exception(_LE("Concurrent Update"))
+        raise webob.exc.HTTPConflict(
+            _('Inventory changed while attempting to allocate: %(error)s') %
+            {'error': exc})
+
+    if not partial:
+        req.response.status = 204
+        req.response.content_type = None
+        return req.response
+
+    result = {
+        'accepted': sorted(set(consumers) - set(failures)),
+        'rejected': dict(
+            (consumer_uuid, _('Unable to allocate inventory: %(error)s') %
+             {'error': exc})
+            for consumer_uuid, exc in failures.items()),
+    }
+    req.response.status = 200
+    req.response.body = encodeutils.to_utf8(jsonutils.dumps(result))
+    req.response.content_type = 'application/json'
+    return req.response
+
+
 @wsgi_wrapper.PlacementWsgify
 def delete_allocations(req):
     context = req.environ['placement.context']
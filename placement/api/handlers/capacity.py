@@ -0,0 +1,106 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Placement API handlers for the capacity summary of the cloud."""
+
+import jsonschema
+from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+from oslo_utils import uuidutils
+import webob
+
+from placement.api import microversion
+from placement.api import util
+from placement import exception
+from placement.i18n import _
+from placement import objects
+
+
+GET_CAPACITY_SCHEMA_1_9 = {
+    "type": "object",
+    "properties": {
+        "member_of": {
+            "type": "string"
+        },
+        "resource_class": {
+            "type": "string"
+        }
+    },
+    "additionalProperties": False
+}
+
+
+def _serialize_capacity(capacities):
+    return {'capacity': dict(
+        (capacity.resource_class, {
+            'total': capacity.total,
+            'reserved': capacity.reserved,
+            'capacity': capacity.capacity,
+            'used': capacity.used,
+            'free': capacity.free,
+        }) for capacity in capacities)}
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.9)
+@util.check_accept('application/json')
+def get_capacity(req):
+    """GET a summary of the inventory and usage of each resource class
+    across every resource provider.
+
+    The resource providers may be limited to the members of any of a list
+    of aggregates, with member_of as in GET /resource_providers, and the
+    resource classes to a comma separated list given as resource_class.
+
+    On success return a 200 with an application/json body giving the
+    total, reserved, capacity (total less reserved, multiplied by the
+    allocation ratio), used and free amounts of each resource class.
+    """
+    context = req.environ['placement.context']
+    try:
+        jsonschema.validate(dict(req.GET), GET_CAPACITY_SCHEMA_1_9)
+    except jsonschema.ValidationError as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Invalid query string parameters: %(exc)s') %
+            {'exc': exc},
+            json_formatter=util.json_error_formatter)
+
+    member_of = None
+    if 'member_of' in req.GET:
+        member_of = req.GET['member_of']
+        if member_of.startswith('in:'):
+            member_of = member_of[3:].split(',')
+        else:
+            member_of = [member_of]
+        for aggr_uuid in member_of:
+            if not uuidutils.is_uuid_like(aggr_uuid):
+                raise webob.exc.HTTPBadRequest(
+                    _('Invalid uuid value: %(uuid)s') % {'uuid': aggr_uuid},
+                    json_formatter=util.json_error_formatter)
+
+    resource_classes = None
+    if 'resource_class' in req.GET:
+        resource_classes = req.GET['resource_class'].split(',')
+
+    try:
+        capacities = objects.CapacityList.get_all(
+            context, member_of=member_of, resource_classes=resource_classes)
+    except exception.ResourceClassNotFound as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Invalid resource class in resource_class parameter: '
+              '%(error)s') % {'error': exc},
+            json_formatter=util.json_error_formatter)
+
+    req.response.status = 200
+    req.response.body = encodeutils.to_utf8(
+        jsonutils.dumps(_serialize_capacity(capacities)))
+    req.response.content_type = 'application/json'
+    return req.response
@@ -18,6 +18,7 @@ from oslo_serialization import jsonutils
 from oslo_utils import encodeutils
 import webob
 
+from placement.api import microversion
 from placement.api import util
 from placement import db
 from placement import exception
@@ -90,6 +91,25 @@ PUT_INVENTORY_SCHEMA = {
     ],
     "additionalProperties": False
 }
+# Represents the allowed format of the body of PUT /inventories, a map of
+# resource provider uuid to the inventories of that resource provider in the
+# same format as is used by PUT /resource_providers/{uuid}/inventories.
+BULK_INVENTORY_SCHEMA_V1_8 = {
+    "type": "object",
+    "properties": {
+        "resource_providers": {
+            "type": "object",
+            "patternProperties": {
+                "^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$":
+                    copy.deepcopy(PUT_INVENTORY_SCHEMA)
+            },
+            "minProperties": 1,
+            "additionalProperties": False
+        }
+    },
+    "required": ["resource_providers"],
+    "additionalProperties": False
+}
 
 # NOTE(cdent): We keep our own representation of inventory defaults
 # and output fields, separate from the versioned object to avoid
@@ -121,10 +141,8 @@ def _extract_inventory(body, schema):
     return inventory_data
 
 
-def _extract_inventories(body, schema):
-    """Extract and validate multiple inventories from JSON body."""
-    data = util.extract_json(body, schema)
-
+def _add_inventory_defaults(data):
+    """Fill in the defaults of the inventories of one resource provider."""
     inventories = {}
     for res_class, raw_inventory in data['inventories'].items():
         inventory_data = copy.copy(INVENTORY_DEFAULTS)
@@ -135,6 +153,12 @@ def _extract_inventories(body, schema):
     return data
 
 
+def _extract_inventories(body, schema):
+    """Extract and validate multiple inventories from JSON body."""
+    data = util.extract_json(body, schema)
+    return _add_inventory_defaults(data)
+
+
 def _make_inventory_object(resource_provider, resource_class, **data):
     """Single place to catch malformed Inventories."""
     # TODO(cdent): Some of the validation checks that are done here
@@ -279,7 +303,7 @@ def get_inventories(req):
     """GET a list of inventories.
 
     On success return a 200 with an application/json body representing
-    a collection of inventories.
+    a collection of inventories, or a 304 if the client already has it.
     """
     context = req.environ['placement.context']
     uuid = util.wsgi_path_item(req.environ, 'uuid')
@@ -292,8 +316,16 @@ def get_inventories(req):
              {'uuid': uuid, 'error': exc},
              json_formatter=util.json_error_formatter)
 
-    inventories = objects.InventoryList.get_all_by_resource_provider_uuid(
-        context, resource_provider.uuid)
+    # Every change to inventory increments the generation, so it is all
+    # that is needed to answer a conditional request. The id distinguishes
+    # the resource provider from an earlier one with the same uuid.
+    etag = util.make_etag(req, 'inventories', resource_provider.id,
+                          resource_provider.generation)
+    if util.check_not_modified(req, etag):
+        return req.response
+
+    inventories = objects.InventoryList.get_all_by_resource_provider(
+        context, resource_provider)
 
     return _send_inventories(req.response, resource_provider, inventories)
 
@@ -312,8 +344,8 @@ def get_inventory(req):
 
     resource_provider = objects.ResourceProvider.get_by_uuid(
         context, uuid)
-    inventory = objects.InventoryList.get_all_by_resource_provider_uuid(
-        context, resource_provider.uuid).find(resource_class)
+    inventory = objects.InventoryList.get_all_by_resource_provider(
+        context, resource_provider).find(resource_class)
 
     if not inventory:
         raise webob.exc.HTTPNotFound(
@@ -389,6 +421,85 @@ def set_inventories(req):
     return _send_inventories(req.response, resource_provider, inventories)
 
 
+def _conflict_detail(uuid, exc):
+    """Explain why the inventories of one resource provider were not set
+    by set_inventories_for_providers.
+    """
+    if isinstance(exc, exception.ResourceProviderNotFound):
+        return _('No resource provider with uuid %(uuid)s found') % {
+            'uuid': uuid}
+    if isinstance(exc, exception.InventoryInUse):
+        return _('Unable to delete inventory in use for resource provider '
+                 '%(uuid)s: %(error)s') % {'uuid': uuid, 'error': exc}
+    return _('resource provider generation conflict')
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.8)
+@util.require_content('application/json')
+def set_inventories_for_providers(req):
+    """PUT to set all inventory for many resource providers at once.
+
+    The inventories of each resource provider replace its existing
+    inventories, as with PUT /resource_providers/{uuid}/inventories, but
+    the resource providers are written together in as few transactions
+    as [placement]/inventory_bulk_chunk_size allows.
+
+    If any inventory has settings which are invalid or an unknown resource
+    class, return a 400 and write nothing. Otherwise return a 200 with the
+    new generation of every resource provider whose inventories were set
+    and, under "conflicts", why the others, which do not exist, have a
+    different generation or have inventory to be deleted in use, were not.
+    """
+    context = req.environ['placement.context']
+    data = util.extract_json(req.body, BULK_INVENTORY_SCHEMA_V1_8)
+
+    inventories = {}
+    rp_datas = util.normalize_uuid_keys(data['resource_providers'])
+    for uuid, rp_data in rp_datas.items():
+        rp_data = _add_inventory_defaults(rp_data)
+        # The resource provider is only needed to identify the inventory,
+        # it is not read here.
+        resource_provider = objects.ResourceProvider(context, uuid=uuid)
+        inv_list = [
+            _make_inventory_object(resource_provider, res_class,
+                                   **inventory_data)
+            for res_class, inventory_data in rp_data['inventories'].items()]
+        inventories[uuid] = (rp_data['resource_provider_generation'],
+                             objects.InventoryList(objects=inv_list))
+
+    try:
+        generations, conflicts = objects.InventoryList.set_all_for_providers(
+            context, inventories)
+    except exception.ResourceClassNotFound as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Unknown resource class in inventory: %(error)s') %
+            {'error': exc},
+            json_formatter=util.json_error_formatter)
+    except exception.InvalidInventoryCapacity as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Unable to update inventory: %(error)s') % {'error': exc},
+            json_formatter=util.json_error_formatter)
+    except exception.ConcurrentUpdateDetected as exc:
+        raise webob.exc.HTTPConflict(
+            _('update conflict: %(error)s') % {'error': exc},
+            json_formatter=util.json_error_formatter)
+
+    result = {
+        'resource_providers': dict(
+            (uuid, {'resource_provider_generation': generations[uuid]})
+            for uuid in inventories if uuid not in conflicts),
+        'conflicts': dict(
+            (uuid, {'resource_provider_generation': generations.get(uuid),
+                    'detail': _conflict_detail(uuid, exc)})
+            for uuid, exc in conflicts.items()),
+    }
+    req.response.status = 200
+    req.response.body = encodeutils.to_utf8(jsonutils.dumps(result))
+    req.response.content_type = 'application/json'
+    return req.response
+
+
 @webob.dec.wsgify
 @util.require_content('application/json')
 def update_inventory(req):
@@ -0,0 +1,31 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Handler for the request metrics of the Placement API."""
+
+from oslo_utils import encodeutils
+import webob
+
+from placement.api import metrics
+
+
+@webob.dec.wsgify
+def get_metrics(req):
+    """GET the request metrics of the service in the Prometheus text format.
+
+    Like the root of the API this is not versioned, so that it may be
+    scraped without an OpenStack-API-Version header.
+    """
+    req.response.status = 200
+    req.response.body = encodeutils.to_utf8(
+        metrics.render(metrics.collect()))
+    req.response.headers['content-type'] = metrics.CONTENT_TYPE
+    return req.response
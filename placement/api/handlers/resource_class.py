@@ -55,14 +55,6 @@ def _serialize_resource_class(environ, rc):
     return data
 
 
-def _serialize_resource_classes(environ, rcs):
-    output = []
-    for rc in rcs:
-        data = _serialize_resource_class(environ, rc)
-        output.append(data)
-    return {"resource_classes": output}
-
-
 @webob.dec.wsgify
 @microversion.version_handler(1.2)
 @util.require_content('application/json')
@@ -156,12 +148,12 @@ def list_resource_classes(req):
     a collection of resource classes.
     """
     context = req.environ['placement.context']
-    rcs = objects.ResourceClassList.get_all(context)
+    rcs = objects.ResourceClassList.iter_all(context)
 
     response = req.response
-    response.body = encodeutils.to_utf8(jsonutils.dumps(
-        _serialize_resource_classes(req.environ, rcs))
-    )
+    response.app_iter = util.stream_json(
+        'resource_classes',
+        (_serialize_resource_class(req.environ, rc) for rc in rcs))
     response.content_type = 'application/json'
     return response
 
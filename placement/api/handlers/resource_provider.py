@@ -81,6 +81,28 @@ GET_RPS_SCHEMA_1_4['properties']['resources'] = {
     "type": "string"
 }
 
+# Placement API microversion 1.6 adds support for paginating the list of
+# resource providers with a limit on the number of results and an opaque
+# marker identifying the last resource provider of the previous page.
+GET_RPS_SCHEMA_1_6 = copy.deepcopy(GET_RPS_SCHEMA_1_4)
+GET_RPS_SCHEMA_1_6['properties']['limit'] = {
+    "type": "string",
+    "pattern": "^[1-9][0-9]*$"
+}
+GET_RPS_SCHEMA_1_6['properties']['marker'] = {
+    "type": "string"
+}
+
+# Placement API microversion 1.7 adds support for requesting resource providers
+# which have, and do not have, some set of traits. The query string is a
+# comma-delimited set of trait names, those which are forbidden prefixed with
+# "!". The validation of the string is left up to the helper code in the
+# _normalize_traits_qs_param() function below.
+GET_RPS_SCHEMA_1_7 = copy.deepcopy(GET_RPS_SCHEMA_1_6)
+GET_RPS_SCHEMA_1_7['properties']['required'] = {
+    "type": "string"
+}
+
 
 def _normalize_resources_qs_param(qs):
     """Given a query string parameter for resources, validate it meets the
@@ -141,6 +163,50 @@ def _normalize_resources_qs_param(qs):
     return result
 
 
+def _normalize_traits_qs_param(qs):
+    """Given a query string parameter for required traits, validate it meets
+    the expected format and return a tuple of the lists of the names of the
+    required and the forbidden traits.
+
+    The expected format of the required parameter looks like so:
+
+        $TRAIT_NAME,!$TRAIT_NAME
+
+    So, if the user was looking for resource providers which have an SSD
+    and do not have a GPU they could use the following query string:
+
+        ?required=STORAGE_DISK_SSD,!CUSTOM_GPU
+
+    The returned value would be:
+
+        (['STORAGE_DISK_SSD'], ['CUSTOM_GPU'])
+
+    :param qs: The value of the 'required' query string parameter
+    :raises `webob.exc.HTTPBadRequest` if the parameter's value isn't in the
+            expected format or names a trait as both required and forbidden.
+    """
+    required = []
+    forbidden = []
+    for name in qs.split(','):
+        name = name.strip()
+        if name.startswith('!'):
+            forbidden.append(name[1:])
+        else:
+            required.append(name)
+    if '' in required or '' in forbidden:
+        msg = _('Badly formed required parameter. Expected required '
+                'query string parameter in form: '
+                '?required=$TRAIT_NAME,!$TRAIT_NAME. Got: %s.')
+        msg = msg % qs
+        raise webob.exc.HTTPBadRequest(msg)
+    conflicting = set(required) & set(forbidden)
+    if conflicting:
+        raise webob.exc.HTTPBadRequest(
+            _('Traits both required and forbidden: %(traits)s') %
+            {'traits': ', '.join(sorted(conflicting))})
+    return required, forbidden
+
+
 def _serialize_links(environ, resource_provider):
     url = util.resource_provider_url(environ, resource_provider)
     links = [{'rel': 'self', 'href': url}]
@@ -159,14 +225,6 @@ def _serialize_provider(environ, resource_provider):
     return data
 
 
-def _serialize_providers(environ, resource_providers):
-    output = []
-    for provider in resource_providers:
-        provider_data = _serialize_provider(environ, provider)
-        output.append(provider_data)
-    return {"resource_providers": output}
-
-
 @wsgi_wrapper.PlacementWsgify
 @util.require_content('application/json')
 def create_resource_provider(req):
@@ -230,7 +288,7 @@ def get_resource_provider(req):
     """Get a single resource provider.
 
     On success return a 200 with an application/json body representing
-    the resource provider.
+    the resource provider, or a 304 if the client already has it.
     """
     uuid = util.wsgi_path_item(req.environ, 'uuid')
     # The containing application will catch a not found here.
@@ -239,6 +297,13 @@ def get_resource_provider(req):
     resource_provider = objects.ResourceProvider.get_by_uuid(
         context, uuid)
 
+    # The name can be changed without incrementing the generation.
+    etag = util.make_etag(req, 'resource_provider',
+                          resource_provider.generation,
+                          resource_provider.name)
+    if util.check_not_modified(req, etag):
+        return req.response
+
     req.response.body = encodeutils.to_utf8(jsonutils.dumps(
         _serialize_provider(req.environ, resource_provider)))
     req.response.content_type = 'application/json'
@@ -261,6 +326,10 @@ def list_resource_providers(req):
         schema = GET_RPS_SCHEMA_1_3
     if want_version >= (1, 4):
         schema = GET_RPS_SCHEMA_1_4
+    if want_version >= (1, 6):
+        schema = GET_RPS_SCHEMA_1_6
+    if want_version >= (1, 7):
+        schema = GET_RPS_SCHEMA_1_7
     try:
         jsonschema.validate(dict(req.GET), schema,
                             format_checker=jsonschema.FormatChecker())
@@ -293,17 +362,40 @@ def list_resource_providers(req):
     if 'resources' in req.GET:
         resources = _normalize_resources_qs_param(req.GET['resources'])
         filters['resources'] = resources
+    if 'required' in req.GET:
+        required, forbidden = _normalize_traits_qs_param(req.GET['required'])
+        filters['required'] = required
+        filters['forbidden'] = forbidden
+    limit, marker = util.extract_pagination(req)
     try:
-        resource_providers = objects.ResourceProviderList.get_all_by_filters(
-            context, filters)
+        # Ask for one more than the limit to learn whether there is a
+        # next page.
+        resource_providers = objects.ResourceProviderList.iter_all_by_filters(
+            context, filters, limit=limit and limit + 1, marker=marker)
     except exception.ResourceClassNotFound as exc:
         raise webob.exc.HTTPBadRequest(
             _('Invalid resource class in resources parameter: %(error)s') %
             {'error': exc})
+    except exception.TraitNotFound as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('No such trait(s): %(traits)s') %
+            {'traits': ', '.join(exc.names)})
 
     response = req.response
-    response.body = encodeutils.to_utf8(
-        jsonutils.dumps(_serialize_providers(req.environ, resource_providers)))
+    if limit is not None:
+        # A page is bounded by the limit so it can be read up front to
+        # decide on the link to the next one.
+        resource_providers = list(resource_providers)
+        if len(resource_providers) > limit:
+            resource_providers = resource_providers[:limit]
+            response.headers['link'] = util.next_page_link(
+                req, resource_providers[-1].id)
+    # The list of all resource providers can be very large so it is
+    # streamed to the client as it is read from the database.
+    response.app_iter = util.stream_json(
+        'resource_providers',
+        (_serialize_provider(req.environ, provider)
+         for provider in resource_providers))
     response.content_type = 'application/json'
     return response
 
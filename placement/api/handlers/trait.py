@@ -0,0 +1,317 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Traits handlers for Placement API."""
+
+import copy
+
+import jsonschema
+from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
+import webob
+
+from placement.api import microversion
+from placement.api import util
+from placement import exception
+from placement.i18n import _
+from placement import objects
+
+
+TRAIT = {
+    "type": "string",
+    "minLength": 1,
+    "maxLength": 255,
+}
+
+CUSTOM_TRAIT = copy.deepcopy(TRAIT)
+CUSTOM_TRAIT.update({"pattern": "^CUSTOM_[A-Z0-9_]+$"})
+
+PUT_TRAITS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "traits": {
+            "type": "array",
+            "items": TRAIT,
+            "uniqueItems": True
+        },
+        "resource_provider_generation": {
+            "type": "integer"
+        }
+    },
+    "required": [
+        "traits",
+        "resource_provider_generation"
+    ],
+    "additionalProperties": False
+}
+
+LIST_TRAIT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {
+            "type": "string"
+        },
+        "associated": {
+            "type": "string",
+            "enum": ["true", "false"]
+        }
+    },
+    "additionalProperties": False
+}
+
+
+def _normalize_traits_qs_param(qs):
+    """Turn the value of the name query string parameter of GET /traits,
+    either "in:$NAME,$NAME" or "startswith:$PREFIX", into TraitList filters.
+
+    :raises `webob.exc.HTTPBadRequest` if the value is not in either form.
+    """
+    try:
+        op, value = qs.split(':', 1)
+    except ValueError:
+        op = value = None
+    if op == 'in' and value:
+        return {'name_in': value.split(',')}
+    if op == 'startswith' and value:
+        return {'prefix': value}
+    msg = _('Badly formatted name parameter. Expected name query string '
+            'parameter in form: '
+            '?name=[in|startswith]:[name1,name2|prefix]. Got: "%s"') % qs
+    raise webob.exc.HTTPBadRequest(
+        msg, json_formatter=util.json_error_formatter)
+
+
+def _serialize_traits(traits):
+    return {'traits': [trait.name for trait in traits]}
+
+
+def _serialize_provider_traits(resource_provider, traits):
+    data = _serialize_traits(traits)
+    data['resource_provider_generation'] = resource_provider.generation
+    return data
+
+
+def _send_provider_traits(response, resource_provider, traits):
+    response.status = 200
+    response.body = encodeutils.to_utf8(jsonutils.dumps(
+        _serialize_provider_traits(resource_provider, traits)))
+    response.content_type = 'application/json'
+    return response
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+def put_trait(req):
+    """PUT to create a custom trait.
+
+    Return a 201 if the trait was created or a 204 if it already existed,
+    with an empty body and a location header pointing to the trait.
+    """
+    context = req.environ['placement.context']
+    name = util.wsgi_path_item(req.environ, 'name')
+
+    try:
+        jsonschema.validate(name, CUSTOM_TRAIT)
+    except jsonschema.ValidationError:
+        raise webob.exc.HTTPBadRequest(
+            _('The trait is invalid. A valid trait must be no longer than '
+              '255 characters, start with the prefix "CUSTOM_" and use '
+              'following characters: "A"-"Z", "0"-"9" and "_"'),
+            json_formatter=util.json_error_formatter)
+
+    trait = objects.Trait(context, name=name)
+    try:
+        trait.create()
+        req.response.status = 201
+    except exception.TraitExists:
+        req.response.status = 204
+
+    req.response.content_type = None
+    req.response.location = util.trait_url(req.environ, trait)
+    return req.response
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+def get_trait(req):
+    """GET to find out whether a trait exists.
+
+    Return a 204 with an empty body if it does.
+    """
+    context = req.environ['placement.context']
+    name = util.wsgi_path_item(req.environ, 'name')
+    # The containing application will catch a not found here.
+    objects.Trait.get_by_name(context, name)
+
+    req.response.status = 204
+    req.response.content_type = None
+    return req.response
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+def delete_trait(req):
+    """DELETE to destroy a custom trait.
+
+    On success return a 204 and an empty body.
+    """
+    context = req.environ['placement.context']
+    name = util.wsgi_path_item(req.environ, 'name')
+    # The containing application will catch a not found here.
+    trait = objects.Trait.get_by_name(context, name)
+    try:
+        trait.destroy()
+    except exception.TraitCannotDeleteStandard as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Cannot delete standard trait %(name)s: %(error)s') %
+            {'name': name, 'error': exc},
+            json_formatter=util.json_error_formatter)
+    except exception.TraitInUse as exc:
+        raise webob.exc.HTTPConflict(
+            _('Unable to delete trait %(name)s: %(error)s') %
+            {'name': name, 'error': exc},
+            json_formatter=util.json_error_formatter)
+
+    req.response.status = 204
+    req.response.content_type = None
+    return req.response
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+@util.check_accept('application/json')
+def list_traits(req):
+    """GET a list of traits, optionally filtered by name and by whether they
+    are associated with any resource provider.
+
+    On success return a 200 and an application/json body representing
+    a collection of trait names.
+    """
+    context = req.environ['placement.context']
+    try:
+        jsonschema.validate(dict(req.GET), LIST_TRAIT_SCHEMA)
+    except jsonschema.ValidationError as exc:
+        raise webob.exc.HTTPBadRequest(
+            _('Invalid query string parameters: %(exc)s') %
+            {'exc': exc},
+            json_formatter=util.json_error_formatter)
+
+    filters = {}
+    if 'name' in req.GET:
+        filters = _normalize_traits_qs_param(req.GET['name'])
+    if 'associated' in req.GET:
+        filters['associated'] = req.GET['associated'] == 'true'
+
+    traits = objects.TraitList.get_all(context, filters)
+    req.response.status = 200
+    req.response.body = encodeutils.to_utf8(
+        jsonutils.dumps(_serialize_traits(traits)))
+    req.response.content_type = 'application/json'
+    return req.response
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+@util.check_accept('application/json')
+def list_traits_for_resource_provider(req):
+    """GET the traits associated with a resource provider.
+
+    If the resource provider does not exist return a 404.
+
+    On success return a 200 with an application/json body containing the
+    trait names and the generation of the resource provider, or a 304 if
+    the client already has it.
+    """
+    context = req.environ['placement.context']
+    uuid = util.wsgi_path_item(req.environ, 'uuid')
+    # The containing application will catch a not found here.
+    resource_provider = objects.ResourceProvider.get_by_uuid(context, uuid)
+
+    # Setting the traits increments the generation of the resource
+    # provider, so the tag need not be made from the traits.
+    etag = util.make_etag(req, 'traits', resource_provider.id,
+                          resource_provider.generation)
+    if util.check_not_modified(req, etag):
+        return req.response
+
+    traits = resource_provider.get_traits()
+    return _send_provider_traits(req.response, resource_provider, traits)
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+@util.require_content('application/json')
+def update_traits_for_resource_provider(req):
+    """PUT to replace the traits associated with a resource provider.
+
+    The body includes the generation of the resource provider the client
+    last saw; if it has changed since, return a 409.
+
+    On success return a 200 with the same body as
+    `list_traits_for_resource_provider`.
+    """
+    context = req.environ['placement.context']
+    uuid = util.wsgi_path_item(req.environ, 'uuid')
+    data = util.extract_json(req.body, PUT_TRAITS_SCHEMA)
+    # The containing application will catch a not found here.
+    resource_provider = objects.ResourceProvider.get_by_uuid(context, uuid)
+
+    if resource_provider.generation != data['resource_provider_generation']:
+        raise webob.exc.HTTPConflict(
+            _("Resource provider's generation already changed. Please update "
+              "the generation and try again."),
+            json_formatter=util.json_error_formatter)
+
+    names = data['traits']
+    if names:
+        traits = objects.TraitList.get_all(context, {'name_in': names})
+    else:
+        traits = objects.TraitList(context, objects=[])
+    missing = set(names) - set(trait.name for trait in traits)
+    if missing:
+        raise webob.exc.HTTPBadRequest(
+            _('No such trait(s): %(traits)s') %
+            {'traits': ', '.join(sorted(missing))},
+            json_formatter=util.json_error_formatter)
+
+    try:
+        resource_provider.set_traits(traits)
+    except exception.ConcurrentUpdateDetected:
+        raise webob.exc.HTTPConflict(
+            _("Resource provider's generation already changed. Please update "
+              "the generation and try again."),
+            json_formatter=util.json_error_formatter)
+
+    return _send_provider_traits(req.response, resource_provider, traits)
+
+
+@webob.dec.wsgify
+@microversion.version_handler(1.7)
+def delete_traits_for_resource_provider(req):
+    """DELETE every trait association of a resource provider.
+
+    On success return a 204 and an empty body.
+    """
+    context = req.environ['placement.context']
+    uuid = util.wsgi_path_item(req.environ, 'uuid')
+    # The containing application will catch a not found here.
+    resource_provider = objects.ResourceProvider.get_by_uuid(context, uuid)
+    try:
+        resource_provider.set_traits(objects.TraitList(context, objects=[]))
+    except exception.ConcurrentUpdateDetected:
+        raise webob.exc.HTTPConflict(
+            _("Resource provider's generation already changed. Please update "
+              "the generation and try again."),
+            json_formatter=util.json_error_formatter)
+
+    req.response.status = 204
+    req.response.content_type = None
+    return req.response
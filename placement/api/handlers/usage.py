@@ -21,10 +21,10 @@ from placement.i18n import _
 from placement import objects
 
 
-def _serialize_usages(resource_provider, usage):
+def _serialize_usages(generation, usage):
     usage_dict = {resource.resource_class: resource.usage
                   for resource in usage}
-    return {'resource_provider_generation': resource_provider.generation,
+    return {'resource_provider_generation': generation,
             'usages': usage_dict}
 
 
@@ -36,30 +36,35 @@ def list_usages(req):
     If the resource provider does not exist return a 404.
 
     On success return a 200 with an application/json representation of
-    the usage dictionary.
+    the usage dictionary, or a 304 if the client already has it.
     """
     context = req.environ['placement.context']
     uuid = util.wsgi_path_item(req.environ, 'uuid')
 
-    # Resource provider object needed for two things: If it is
-    # NotFound we'll get a 404 here, which needs to happen because
-    # get_all_by_resource_provider_uuid can return an empty list.
-    # It is also needed for the generation, used in the outgoing
-    # representation.
+    # The version is looked up first for two reasons: If the resource
+    # provider is NotFound we'll get a 404 here, which needs to happen
+    # because get_all_by_resource_provider_id can return an empty list.
+    # It is also all that is needed to answer a conditional request and
+    # includes the generation used in the outgoing representation.
     try:
-        resource_provider = objects.ResourceProvider.get_by_uuid(
-            context, uuid)
+        rp_id, generation, used = (
+            objects.UsageList.get_version_by_resource_provider_uuid(
+                context, uuid))
     except exception.NotFound as exc:
         raise webob.exc.HTTPNotFound(
             _("No resource provider with uuid %(uuid)s found: %(error)s") %
              {'uuid': uuid, 'error': exc},
              json_formatter=util.json_error_formatter)
 
-    usage = objects.UsageList.get_all_by_resource_provider_uuid(
-        context, uuid)
+    etag = util.make_etag(req, 'usages', rp_id, generation, used)
+    if util.check_not_modified(req, etag):
+        return req.response
+
+    usage = objects.UsageList.get_all_by_resource_provider_id(
+        context, rp_id)
 
     response = req.response
     response.body = encodeutils.to_utf8(jsonutils.dumps(
-        _serialize_usages(resource_provider, usage)))
+        _serialize_usages(generation, usage)))
     req.response.content_type = 'application/json'
     return req.response
@@ -0,0 +1,382 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Request metrics of the Placement API, in Prometheus text format.
+
+The `Metrics` middleware records the latency, status, response size and
+database time of every request in a per-process `Registry`, keyed by the
+request method and the template of the route it matched in
+``handler.ROUTE_DECLARATIONS``, and counts requests by microversion.
+
+When [placement]/metrics_dir is set each worker process also writes a
+snapshot of its registry to a file in that directory every
+[placement]/metrics_flush_interval seconds, and ``GET /metrics`` served by
+any worker reports the sum of the snapshots of every worker. The file of a
+worker is named for its pid and a random token, so that a later process
+with the same pid does not take over the counters of an earlier one. Files
+which have not been written for `EXPIRE_INTERVALS` flush intervals, left by
+workers which have exited, are removed rather than summed.
+"""
+
+import bisect
+import binascii
+import glob
+import os
+import tempfile
+import threading
+import time
+
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from placement.api import accounting
+from placement.api import handler
+from placement.api import microversion
+from placement import conf
+from placement.i18n import _LW
+from placement import objects
+
+
+CONF = conf.CONF
+LOG = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# The upper bounds, in seconds, of the buckets of the latency histograms.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The flush intervals after which the file of a worker which has stopped
+# writing it is removed.
+EXPIRE_INTERVALS = 3
+_FILE_PREFIX = 'placement-metrics-'
+
+
+class Registry(object):
+    """The request metrics of one process.
+
+    Requests are recorded under a "METHOD route" key. A snapshot of the
+    registry is a dict of plain counters which may be serialized to JSON
+    and summed with the snapshots of other processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # key: [count in each bucket..., count in +Inf, sum of seconds]
+            self._latency = {}
+            self._status = {}
+            self._bytes = {}
+            self._db_seconds = {}
+            self._db_statements = {}
+            self._microversion = {}
+
+    def record(self, key, status, seconds, size, version, sql_stats):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        status_key = '%s %s' % (key, status)
+        with self._lock:
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            latency[bucket] += 1
+            latency[-1] += seconds
+            self._status[status_key] = self._status.get(status_key, 0) + 1
+            self._bytes[key] = self._bytes.get(key, 0) + size
+            self._microversion[version] = (
+                self._microversion.get(version, 0) + 1)
+            if sql_stats is not None:
+                self._db_seconds[key] = (
+                    self._db_seconds.get(key, 0.0) + sql_stats.seconds)
+                self._db_statements[key] = (
+                    self._db_statements.get(key, 0) + sql_stats.statements)
+
+    def snapshot(self):
+        """Return a copy of the metrics of this process."""
+        with self._lock:
+            snapshot = {
+                'latency': dict((key, list(value))
+                                for key, value in self._latency.items()),
+                'status': dict(self._status),
+                'bytes': dict(self._bytes),
+                'db_seconds': dict(self._db_seconds),
+                'db_statements': dict(self._db_statements),
+                'microversion': dict(self._microversion),
+            }
+        snapshot['allocation_retries'] = objects.get_allocation_retry_counts()
+        return snapshot
+
+
+def merge(snapshots):
+    """Return the sum of a list of registry snapshots."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, values in snapshot.items():
+            totals = merged.setdefault(name, {})
+            for key, value in values.items():
+                if isinstance(value, list):
+                    total = totals.get(key)
+                    if total is None:
+                        totals[key] = list(value)
+                    else:
+                        totals[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+    return merged
+
+
+def _labels(key, **extra):
+    method, route = key.split(' ', 1)
+    labels = [('method', method), ('route', route)]
+    labels.extend(sorted(extra.items()))
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+
+
+def _family(lines, name, kind, help_text):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, kind))
+
+
+def render(snapshot):
+    """Return a registry snapshot in the Prometheus text format."""
+    lines = []
+    name = 'placement_request_duration_seconds'
+    _family(lines, name, 'histogram',
+            'Time taken to respond to requests, by route.')
+    for key, latency in sorted(snapshot.get('latency', {}).items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), latency[:-1]):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                name, _labels(key, le=str(bound)), cumulative))
+        lines.append('%s_sum%s %r' % (name, _labels(key), latency[-1]))
+        lines.append('%s_count%s %d' % (name, _labels(key), cumulative))
+
+    name = 'placement_requests_total'
+    _family(lines, name, 'counter', 'Requests, by route and status code.')
+    for status_key, count in sorted(snapshot.get('status', {}).items()):
+        key, status = status_key.rsplit(' ', 1)
+        lines.append('%s%s %d' % (name, _labels(key, status=status), count))
+
+    for name, kind, metric, help_text, fmt in (
+            ('placement_response_bytes_total', 'counter', 'bytes',
+             'Bytes in response bodies, by route.', '%d'),
+            ('placement_db_seconds_total', 'counter', 'db_seconds',
+             'Seconds spent waiting for the database, by route.', '%r'),
+            ('placement_db_statements_total', 'counter', 'db_statements',
+             'SQL statements run, by route.', '%d')):
+        _family(lines, name, kind, help_text)
+        for key, value in sorted(snapshot.get(metric, {}).items()):
+            lines.append(('%s%s ' + fmt) % (name, _labels(key), value))
+
+    name = 'placement_requests_by_microversion_total'
+    _family(lines, name, 'counter', 'Requests, by microversion.')
+    for version, count in sorted(snapshot.get('microversion', {}).items()):
+        lines.append('%s{microversion="%s"} %d' % (name, version, count))
+
+    retries = snapshot.get('allocation_retries', {})
+    name = 'placement_allocation_conflict_retries_total'
+    _family(lines, name, 'counter',
+            'Allocation writes retried after a generation conflict.')
+    lines.append('%s %d' % (name, retries.get('retries', 0)))
+    name = 'placement_allocation_conflicts_total'
+    _family(lines, name, 'counter',
+            'Generation conflicts reported to the caller after the '
+            'allocation write retries ran out.')
+    lines.append('%s %d' % (name, retries.get('exhausted', 0)))
+    return '\n'.join(lines) + '\n'
+
+
+_REGISTRY = Registry()
+_LAST_FLUSH = [0.0]
+_FLUSH_LOCK = threading.Lock()
+_FLUSHER_LOCK = threading.Lock()
+# The pid of the process, the token in the name of its file and its flusher
+# thread, all replaced in a process forked after they were set.
+_WORKER = {'pid': None, 'token': None, 'flusher': None}
+
+
+def get_registry():
+    """Return the `Registry` of this process."""
+    return _REGISTRY
+
+
+def _worker():
+    pid = os.getpid()
+    if _WORKER['pid'] != pid:
+        _WORKER.update(pid=pid, flusher=None,
+                       token=binascii.hexlify(os.urandom(4)).decode('ascii'))
+    return _WORKER
+
+
+def _snapshot_path(metrics_dir):
+    worker = _worker()
+    return os.path.join(metrics_dir, '%s%d-%s.json' % (
+        _FILE_PREFIX, worker['pid'], worker['token']))
+
+
+def _interval():
+    # The flusher thread wakes at least once a second whatever the
+    # configured interval, so that an interval of 0 does not make it spin.
+    return max(CONF.placement.metrics_flush_interval, 1.0)
+
+
+def flush(metrics_dir):
+    """Write the snapshot of the registry of this process to metrics_dir,
+    replacing the last one it wrote.
+    """
+    data = jsonutils.dumps(_REGISTRY.snapshot())
+    fd, tmp_path = tempfile.mkstemp(dir=metrics_dir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(data)
+        os.rename(tmp_path, _snapshot_path(metrics_dir))
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _maybe_flush(metrics_dir):
+    now = time.time()
+    if now - _LAST_FLUSH[0] < CONF.placement.metrics_flush_interval:
+        return
+    # Only one thread of the process writes the file at a time; the others
+    # carry on without waiting.
+    if not _FLUSH_LOCK.acquire(False):
+        return
+    try:
+        _LAST_FLUSH[0] = now
+        flush(metrics_dir)
+    except (IOError, OSError) as exc:
+        LOG.warning(_LW('Unable to write metrics to %(dir)s: %(error)s'),
+                    {'dir': metrics_dir, 'error': exc})
+    finally:
+        _FLUSH_LOCK.release()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(_interval())
+        metrics_dir = CONF.placement.metrics_dir
+        if metrics_dir:
+            _maybe_flush(metrics_dir)
+
+
+def _ensure_flusher():
+    """Start the thread which keeps the file of this process fresh while
+    it serves no requests, so that it is not taken for that of a worker
+    which has exited.
+    """
+    worker = _worker()
+    if worker['flusher'] is None:
+        with _FLUSHER_LOCK:
+            if worker['flusher'] is None:
+                flusher = threading.Thread(target=_flush_periodically)
+                flusher.daemon = True
+                flusher.start()
+                worker['flusher'] = flusher
+
+
+def _read_snapshot(path, expire_before):
+    """Return the snapshot in path, or None if it cannot be read or has
+    expired, in which case it is removed.
+    """
+    try:
+        if os.stat(path).st_mtime < expire_before:
+            os.unlink(path)
+            return None
+        with open(path) as snapshot_file:
+            return jsonutils.loads(snapshot_file.read())
+    except (IOError, OSError, ValueError) as exc:
+        LOG.warning(_LW('Unable to read metrics from %(path)s: '
+                        '%(error)s'), {'path': path, 'error': exc})
+        return None
+
+
+def collect():
+    """Return the snapshot of the metrics to report: that of this process
+    or, when [placement]/metrics_dir is set, the sum of those of every
+    process which has written one there.
+    """
+    snapshot = _REGISTRY.snapshot()
+    metrics_dir = CONF.placement.metrics_dir
+    if not metrics_dir:
+        return snapshot
+    snapshots = [snapshot]
+    own_path = _snapshot_path(metrics_dir)
+    expire_before = time.time() - EXPIRE_INTERVALS * _interval()
+    for path in glob.glob(os.path.join(metrics_dir, _FILE_PREFIX + '*')):
+        if path == own_path:
+            continue
+        other = _read_snapshot(path, expire_before)
+        if other is not None:
+            snapshots.append(other)
+    return merge(snapshots)
+
+
+class _TimingIterator(object):
+    """Count the bytes of a response body and call a function with the
+    count once the server is done with it.
+    """
+
+    def __init__(self, app_iter, callback):
+        self.app_iter = app_iter
+        self.callback = callback
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self.callback(self.size)
+
+
+class Metrics(object):
+    """WSGI Middleware which records the metrics of each request in the
+    registry of the process.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        started = time.time()
+        status = ['500']
+
+        def replacement_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        def finish(size):
+            key = '%s %s' % (environ['REQUEST_METHOD'],
+                             environ.get(handler.ROUTE_ENVIRON, '-'))
+            version = environ.get(microversion.MICROVERSION_ENVIRON)
+            _REGISTRY.record(key, status[0], time.time() - started, size,
+                             str(version) if version else '-',
+                             environ.get(accounting.SQL_STATS_ENVIRON))
+            metrics_dir = CONF.placement.metrics_dir
+            if metrics_dir:
+                _ensure_flusher()
+                _maybe_flush(metrics_dir)
+
+        try:
+            app_iter = self.application(environ, replacement_start_response)
+        except Exception:
+            finish(0)
+            raise
+        return _TimingIterator(app_iter, finish)
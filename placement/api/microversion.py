@@ -40,6 +40,15 @@ VERSIONS = [
     '1.3',  # Adds 'member_of' query parameter to get resource providers
             # that are members of any of the listed aggregates
     '1.4',  # Adds resources query string parameter in GET /resource_providers
+    '1.5',  # Adds POST /allocations to write allocations of many consumers
+    '1.6',  # Adds limit and marker pagination to GET /resource_providers and
+            # GET /resource_providers/{uuid}/allocations
+    '1.7',  # Adds /traits and /resource_providers/{uuid}/traits resource
+            # endpoints and the required query parameter of
+            # GET /resource_providers
+    '1.8',  # Adds PUT /inventories to set the inventories of many resource
+            # providers at once
+    '1.9',  # Adds GET /capacity to summarize capacity by resource class
 ]
 
 
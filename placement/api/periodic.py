@@ -0,0 +1,71 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Background tasks run in each Placement API worker."""
+
+import random
+import threading
+
+from oslo_log import log as logging
+
+from placement.api import auth
+from placement.i18n import _LE
+from placement import objects
+
+
+LOG = logging.getLogger(__name__)
+_AGGREGATE_PURGE = None
+
+
+class AggregatePurgeTask(threading.Thread):
+    """Periodically purge the placement aggregates no longer associated with
+    any resource provider.
+    """
+
+    def __init__(self, interval):
+        super(AggregatePurgeTask, self).__init__(name='aggregate-purge')
+        self.daemon = True
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        # NOTE(cdent): Start at a random point in the first interval so
+        # that the workers of a deployment do not all purge at once.
+        wait = random.uniform(0, self.interval)
+        while not self._stopped.wait(wait):
+            try:
+                objects.purge_orphaned_aggregates(auth.get_admin_context())
+            except Exception:
+                LOG.exception(_LE('Failed to purge orphaned placement '
+                                  'aggregates'))
+            wait = self.interval
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start(conf):
+    """Start the background tasks enabled in conf, if they are not already
+    running in this process.
+    """
+    global _AGGREGATE_PURGE
+    interval = conf.placement.aggregate_purge_interval
+    if interval and _AGGREGATE_PURGE is None:
+        _AGGREGATE_PURGE = AggregatePurgeTask(interval)
+        _AGGREGATE_PURGE.start()
+
+
+def stop():
+    """Stop the background tasks of this process."""
+    global _AGGREGATE_PURGE
+    if _AGGREGATE_PURGE is not None:
+        _AGGREGATE_PURGE.stop()
+        _AGGREGATE_PURGE = None
@@ -0,0 +1,259 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Middleware which profiles some requests on demand.
+
+When [placement]/profile_dir is set, a request is profiled if an admin asks
+for it with the ``placement-profile`` header, or otherwise with a chance of
+[placement]/profile_sample_rate. The profile, which covers the generation of
+a streamed response body as well as the call of the application, is written
+to profile_dir in a file named for the request id: ``<request id>.pstats``,
+from cProfile, or ``<request id>.folded``, collapsed stacks for flame graph
+tools from a sampling profiler, as chosen by [placement]/profile_mode. The
+name of the file is sent back in the ``placement-profile`` header.
+
+Only one request at a time is profiled with cProfile; a request which would
+be profiled while another is goes unprofiled. A profiler which fails is
+logged and the request carries on without it.
+"""
+
+import collections
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+
+from oslo_log import log as logging
+from oslo_middleware import request_id
+
+from placement.api import policy
+from placement import conf
+from placement.i18n import _LW
+
+
+CONF = conf.CONF
+LOG = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'placement-profile'
+_PROFILE_ENVIRON = 'HTTP_PLACEMENT_PROFILE'
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class _Profile(object):
+    """A profile of one request. enable and disable never raise: a
+    profiler which fails is logged and stops, leaving the request alone.
+    """
+
+    suffix = None
+
+    def __init__(self):
+        self.failed = False
+
+    def start(self):
+        """Return whether the request may be profiled now."""
+        return True
+
+    def finish(self):
+        """Release whatever start took."""
+
+    def _call(self, method):
+        if self.failed:
+            return
+        try:
+            method()
+        except Exception as exc:
+            self.failed = True
+            LOG.warning(_LW('Unable to profile request: %s'), exc)
+
+    def enable(self):
+        self._call(self._enable)
+
+    def disable(self):
+        self._call(self._disable)
+
+
+class _CProfile(_Profile):
+    """Profile every call made by the thread with cProfile.
+
+    Since Python 3.12 only one cProfile profiler may be enabled at a time in
+    a process, so requests which arrive while another is being profiled
+    are not profiled.
+    """
+
+    suffix = '.pstats'
+    _lock = threading.Lock()
+
+    def __init__(self):
+        super(_CProfile, self).__init__()
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        return self._lock.acquire(False)
+
+    def finish(self):
+        self._lock.release()
+
+    def _enable(self):
+        self.profile.enable()
+
+    def _disable(self):
+        self.profile.disable()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+class _SamplingProfile(_Profile):
+    """Sample the stack of the thread every
+    [placement]/profile_sampling_interval seconds from another thread,
+    which costs the profiled thread far less than cProfile.
+    """
+
+    suffix = '.folded'
+
+    def __init__(self):
+        super(_SamplingProfile, self).__init__()
+        self.thread_id = threading.current_thread().ident
+        self.interval = CONF.placement.profile_sampling_interval
+        self.samples = collections.Counter()
+        self.active = False
+        self.done = threading.Event()
+        self.sampler = None
+
+    def _sample(self):
+        while not self.done.wait(self.interval):
+            if not self.active:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (code.co_filename, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def _enable(self):
+        self.active = True
+        if self.sampler is None:
+            self.sampler = threading.Thread(target=self._sample)
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def _disable(self):
+        self.active = False
+
+    def write(self, path):
+        self.done.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        with open(path, 'w') as folded:
+            for stack, count in sorted(self.samples.items()):
+                folded.write('%s %d\n' % (stack, count))
+
+
+_PROFILES = {
+    'cprofile': _CProfile,
+    'sampling': _SamplingProfile,
+}
+
+
+class _ProfilingIterator(object):
+    """Profile the generation of each chunk of a response body and write the
+    profile once the server is done with it.
+    """
+
+    def __init__(self, app_iter, profile, path):
+        self.app_iter = app_iter
+        self.profile = profile
+        self.path = path
+
+    def __iter__(self):
+        chunks = iter(self.app_iter)
+        while True:
+            self.profile.enable()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                self.profile.disable()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            _write(self.profile, self.path)
+
+
+def _write(profile, path):
+    """Write the profile, unless it failed, and release it."""
+    try:
+        if not profile.failed:
+            profile.write(path)
+    except (IOError, OSError) as exc:
+        LOG.warning(_LW('Unable to write profile to %(path)s: %(error)s'),
+                    {'path': path, 'error': exc})
+    finally:
+        profile.finish()
+
+
+class Profiler(object):
+    """WSGI Middleware which profiles the requests asked for by an admin
+    and a sample of the others.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    @staticmethod
+    def _wanted(environ):
+        if environ.get(_PROFILE_ENVIRON):
+            context = environ.get('placement.context')
+            return bool(context is not None and
+                        policy.placement_authorize(context, 'placement'))
+        rate = CONF.placement.profile_sample_rate
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, environ, start_response):
+        profile_dir = CONF.placement.profile_dir
+        if not profile_dir or not self._wanted(environ):
+            return self.application(environ, start_response)
+
+        profile = _PROFILES[CONF.placement.profile_mode]()
+        if not profile.start():
+            return self.application(environ, start_response)
+        profile.enable()
+        if profile.failed:
+            profile.finish()
+            return self.application(environ, start_response)
+
+        name = _UNSAFE.sub('_', environ.get(request_id.ENV_REQUEST_ID) or
+                           'request-%d' % random.getrandbits(32))
+        filename = name + profile.suffix
+        path = os.path.join(profile_dir, filename)
+
+        def replacement_start_response(status, headers, exc_info=None):
+            headers = list(headers) + [(PROFILE_HEADER, filename)]
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self.application(environ, replacement_start_response)
+        except Exception:
+            profile.disable()
+            _write(profile, path)
+            raise
+        profile.disable()
+        return _ProfilingIterator(app_iter, profile, path)
@@ -14,6 +14,7 @@
 
 from oslo_log import log as logging
 
+from placement.api import accounting
 from placement.api import microversion
 
 LOG = logging.getLogger(__name__)
@@ -27,7 +28,9 @@ class RequestLog(object):
 
     format = ('%(REMOTE_ADDR)s "%(REQUEST_METHOD)s %(REQUEST_URI)s" '
               'status: %(status)s len: %(bytes)s '
-              'microversion: %(microversion)s')
+              'microversion: %(microversion)s '
+              'sql: %(sql_statements)s rows: %(sql_rows)s '
+              'db: %(sql_time)s')
 
     def __init__(self, application):
         self.application = application
@@ -70,6 +73,13 @@ class RequestLog(object):
         """
         if size is None:
             size = '-'
+        stats = environ.get(accounting.SQL_STATS_ENVIRON)
+        if stats is None:
+            sql_statements = sql_rows = sql_time = '-'
+        else:
+            sql_statements = stats.statements
+            sql_rows = stats.rows
+            sql_time = '%.1fms' % (stats.seconds * 1000)
         log_format = {
                 'REMOTE_ADDR': environ.get('REMOTE_ADDR', '-'),
                 'REQUEST_METHOD': environ['REQUEST_METHOD'],
@@ -78,5 +88,8 @@ class RequestLog(object):
                 'bytes': size,
                 'microversion': environ.get(
                     microversion.MICROVERSION_ENVIRON, '-'),
+                'sql_statements': sql_statements,
+                'sql_rows': sql_rows,
+                'sql_time': sql_time,
         }
         LOG.info(self.format, log_format)
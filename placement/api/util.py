@@ -11,12 +11,18 @@
 #    under the License.
 """Utility methods for placement API."""
 
+import base64
 import functools
+import hashlib
+import uuid as uuid_lib
 
 import jsonschema
 from oslo_middleware import request_id
 from oslo_serialization import jsonutils
+from oslo_utils import encodeutils
 from oslo_utils import uuidutils
+import six
+from six.moves.urllib import parse as urlparse
 import webob
 
 # NOTE(cdent): avoid cyclical import conflict between util and
@@ -24,6 +30,10 @@ import webob
 import placement.api.microversion
 from placement.i18n import _
 
+# The size, in characters, that streamed JSON is buffered to before it is
+# handed to the WSGI server.
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 # NOTE(cdent): This registers a FormatChecker on the jsonschema
 # module. Do not delete this code! Although it appears that nothing
@@ -58,6 +68,44 @@ def check_accept(*types):
     return decorator
 
 
+def check_not_modified(req, etag):
+    """Set etag as the ETag of the response to req and return True if the
+    client already holds the representation it identifies.
+
+    When True is returned the response has been turned into a 304 and the
+    caller should return it without doing any further work.
+    """
+    req.response.etag = etag
+    if etag in req.if_none_match:
+        req.response.status = 304
+        req.response.content_type = None
+        return True
+    return False
+
+
+def decode_marker(marker):
+    """Turn a marker made by `encode_marker` back into an integer key.
+
+    :raises `webob.exc.HTTPBadRequest` if the marker is not valid.
+    """
+    try:
+        padding = '=' * (-len(marker) % 4)
+        return int(base64.urlsafe_b64decode(
+            encodeutils.to_utf8(marker + padding)))
+    except (TypeError, ValueError):
+        raise webob.exc.HTTPBadRequest(
+            _('Invalid marker: %(marker)s') % {'marker': marker},
+            json_formatter=json_error_formatter)
+
+
+def encode_marker(key):
+    """Make an opaque marker, for use in a query string, of the integer
+    key of the last item of a page of results.
+    """
+    marker = base64.urlsafe_b64encode(encodeutils.to_utf8(str(key)))
+    return encodeutils.safe_decode(marker).rstrip('=')
+
+
 def extract_json(body, schema):
     """Extract JSON from a body and validate with the provided schema."""
     try:
@@ -76,6 +124,44 @@ def extract_json(body, schema):
     return data
 
 
+def normalize_uuid(value):
+    """Return a uuid, in any of the forms accepted by `uuid.UUID`, in the
+    lower case, dashed form used by the database.
+    """
+    return str(uuid_lib.UUID(value))
+
+
+def normalize_uuid_keys(data):
+    """Return a copy of a dict keyed by uuids with every key passed
+    through `normalize_uuid`.
+
+    Raise a 400 if two keys are the same uuid.
+    """
+    normalized = {}
+    for key, value in data.items():
+        uuid = normalize_uuid(key)
+        if uuid in normalized:
+            raise webob.exc.HTTPBadRequest(
+                _('Duplicate uuid %(uuid)s') % {'uuid': uuid},
+                json_formatter=json_error_formatter)
+        normalized[uuid] = value
+    return normalized
+
+
+def extract_pagination(req):
+    """Return the limit and marker, decoded to an integer key, of the
+    paginated listing requested by req. Either is None if not provided.
+    The query string must already have been validated.
+    """
+    limit = req.GET.get('limit')
+    if limit is not None:
+        limit = int(limit)
+    marker = req.GET.get('marker')
+    if marker is not None:
+        marker = decode_marker(marker)
+    return limit, marker
+
+
 def inventory_url(environ, resource_provider, resource_class=None):
     url = '%s/inventories' % resource_provider_url(environ, resource_provider)
     if resource_class:
@@ -115,6 +201,35 @@ def json_error_formatter(body, status, title, environ):
     return {'errors': [error_dict]}
 
 
+def make_etag(req, *parts):
+    """Make an entity tag from parts, which together must change whenever
+    the representation of the resource being requested does.
+
+    The microversion of the request is included because the same resource
+    may be represented differently at different microversions.
+    """
+    version = req.environ[placement.api.microversion.MICROVERSION_ENVIRON]
+    key = '/'.join(six.text_type(part) for part in (version,) + parts)
+    return hashlib.sha1(encodeutils.to_utf8(key)).hexdigest()
+
+
+def next_page_link(req, key):
+    """Produce the value of a Link header pointing at the page of results
+    which follows the one, ending with the item whose key is key, that was
+    requested by req.
+
+    If SCRIPT_NAME is present, it is the mount point of the placement
+    WSGI app.
+    """
+    params = [(name, value) for name, value in req.GET.items()
+              if name != 'marker']
+    params.append(('marker', encode_marker(key)))
+    url = '%s%s?%s' % (req.environ.get('SCRIPT_NAME', ''),
+                       req.environ.get('PATH_INFO', ''),
+                       urlparse.urlencode(params))
+    return '<%s>; rel="next"' % url
+
+
 def require_content(content_type):
     """Decorator to require a content type in a handler."""
     def decorator(f):
@@ -156,6 +271,52 @@ def resource_provider_url(environ, resource_provider):
     return '%s/resource_providers/%s' % (prefix, resource_provider.uuid)
 
 
+def stream_json(key, items, pairs=False, extra=None):
+    """Generate, in UTF-8 encoded chunks, the JSON document which has the
+    collection made of items at key, along with any members in the dict
+    extra, without holding more than a chunk of it in memory.
+
+    :param key: The name of the collection member of the document.
+    :param items: Iterable of JSON serializable values. If pairs is True,
+                  of (name, value) pairs and the collection is an object.
+    :param pairs: Whether the collection is an object rather than a list.
+    :param extra: Dict of other members of the document.
+    """
+    opener, closer = ('{', '}') if pairs else ('[', ']')
+    buf = ['{']
+    for name, value in sorted((extra or {}).items()):
+        buf.append('%s: %s, ' % (jsonutils.dumps(name),
+                                 jsonutils.dumps(value)))
+    buf.append('%s: %s' % (jsonutils.dumps(key), opener))
+    size = 0
+    separator = ''
+    for item in items:
+        if pairs:
+            chunk = '%s%s: %s' % (separator, jsonutils.dumps(item[0]),
+                                  jsonutils.dumps(item[1]))
+        else:
+            chunk = separator + jsonutils.dumps(item)
+        separator = ', '
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            yield encodeutils.to_utf8(''.join(buf))
+            buf = []
+            size = 0
+    buf.append(closer + '}')
+    yield encodeutils.to_utf8(''.join(buf))
+
+
+def trait_url(environ, trait):
+    """Produce the URL for a trait.
+
+    If SCRIPT_NAME is present, it is the mount point of the placement
+    WSGI app.
+    """
+    prefix = environ.get('SCRIPT_NAME', '')
+    return '%s/traits/%s' % (prefix, trait.name)
+
+
 def wsgi_path_item(environ, name):
     """Extract the value of a named field in a URL.
 
@@ -0,0 +1,566 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""A per-worker, in-memory index of resource provider capacity.
+
+The index holds, for every resource provider, the inventory records and
+current usage of each of its resource classes along with the aggregates
+and traits the provider is associated with. It is used to answer the
+name, uuid, member_of, required and resources filters of
+``GET /resource_providers`` without going to the database.
+
+The index is refreshed incrementally. Every transaction which changes a
+resource provider (most notably the generation increment done when
+inventory or allocations are written) increments the "capacity" row of the
+catalog_versions table and, once it has committed, marks the providers it
+changed dirty along with the version it moved the catalog to. The dirty
+providers are reloaded on the next lookup.
+
+Each lookup also reads the version in the database. When it is ahead of
+the versions this worker knows about another worker has changed something
+this one cannot see, so the lookup is answered by the database instead and
+the index is rebuilt, at most once every
+``[placement]/capacity_index_rebuild_interval`` seconds. The index is also
+rebuilt whenever it is older than ``[placement]/capacity_index_max_age``.
+While a rebuild is happening in another thread lookups report the index as
+unavailable and callers fall back to the database.
+
+When ``[placement]/capacity_filter_engine`` is "numpy" the index also keeps
+a columnar copy of the inventories and usages, NumPy arrays with a row per
+resource provider and a column per resource class, so the resources
+filter is evaluated for every provider at once instead of one at a time.
+Aggregate membership and traits are kept as, for each aggregate and each
+trait, the rows of the providers which have it.
+"""
+
+import collections
+import threading
+import time
+
+from oslo_log import log as logging
+import sqlalchemy as sa
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from placement import conf
+from placement import db
+from placement.db import models
+
+
+CONF = conf.CONF
+LOG = logging.getLogger(__name__)
+
+_INV_TBL = models.Inventory.__table__
+_RP_TBL = models.ResourceProvider.__table__
+_AGG_TBL = models.PlacementAggregate.__table__
+_RP_AGG_TBL = models.ResourceProviderAggregate.__table__
+_USAGE_TBL = models.ProviderUsage.__table__
+_RP_TRAIT_TBL = models.ResourceProviderTrait.__table__
+_CATALOG_TBL = models.CatalogVersion.__table__
+# The name of the catalog_versions row of resource provider changes.
+CATALOG = 'capacity'
+_INDEX = None
+_NUMPY_WARNED = False
+# The number of times this worker has changed a resource provider.
+_WRITES = 0
+
+
+CapacityRecord = collections.namedtuple(
+    'CapacityRecord', ['total', 'reserved', 'min_unit', 'max_unit',
+                       'step_size', 'allocation_ratio', 'used'])
+
+
+def has_capacity(record, amount):
+    """Return True if the inventory described by record can satisfy a
+    request for amount, using the same rules as the database query in
+    `ResourceProviderList._get_all_by_filters_from_db`.
+    """
+    capacity = (record.total - record.reserved) * record.allocation_ratio
+    return (record.used + amount <= capacity and
+            record.min_unit <= amount <= record.max_unit and
+            bool(record.step_size) and amount % record.step_size == 0)
+
+
+def enabled():
+    """Return whether the capacity index is used, so the changes of every
+    worker must be counted in the capacity catalog version.
+    """
+    return CONF.placement.capacity_filter_engine != 'sql'
+
+
+def _get_version(conn):
+    sel = sa.select([_CATALOG_TBL.c.version]).where(
+        _CATALOG_TBL.c.name == CATALOG)
+    return conn.execute(sel).scalar()
+
+
+@db.main_context_manager.reader
+def _get_version_from_db(ctx):
+    return _get_version(ctx.session.connection())
+
+
+@db.main_context_manager.reader
+def _load_from_db(ctx, rp_ids=None):
+    """Load providers, capacity records, aggregate and trait associations.
+
+    :param rp_ids: If not None, only load data for these provider ids.
+    :returns: A tuple of the version of the capacity catalog and four dicts,
+              all keyed by resource provider id: provider rows,
+              {resource class id: `CapacityRecord`}, sets of aggregate uuids
+              and sets of trait ids. The version is read first so the data
+              is never older than it.
+    """
+    conn = ctx.session.connection()
+    version = _get_version(conn)
+
+    rp_sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.uuid, _RP_TBL.c.name,
+                        _RP_TBL.c.generation, _RP_TBL.c.can_host])
+    if rp_ids is not None:
+        rp_sel = rp_sel.where(_RP_TBL.c.id.in_(rp_ids))
+    providers = {}
+    for row in conn.execute(rp_sel):
+        providers[row['id']] = {
+            'id': row['id'],
+            'uuid': row['uuid'],
+            'name': row['name'],
+            'generation': row['generation'],
+            'can_host': row['can_host'] or 0,
+        }
+
+    usage = sa.alias(_USAGE_TBL, name='usage')
+    inv_join = sa.outerjoin(_INV_TBL, usage, sa.and_(
+        _INV_TBL.c.resource_provider_id == usage.c.resource_provider_id,
+        _INV_TBL.c.resource_class_id == usage.c.resource_class_id))
+    inv_sel = sa.select([_INV_TBL.c.resource_provider_id,
+                         _INV_TBL.c.resource_class_id,
+                         _INV_TBL.c.total,
+                         _INV_TBL.c.reserved,
+                         _INV_TBL.c.min_unit,
+                         _INV_TBL.c.max_unit,
+                         _INV_TBL.c.step_size,
+                         _INV_TBL.c.allocation_ratio,
+                         usage.c.used]).select_from(inv_join)
+    if rp_ids is not None:
+        inv_sel = inv_sel.where(_INV_TBL.c.resource_provider_id.in_(rp_ids))
+    inventories = collections.defaultdict(dict)
+    for row in conn.execute(inv_sel):
+        inventories[row['resource_provider_id']][row['resource_class_id']] = (
+            CapacityRecord(total=row['total'],
+                           reserved=row['reserved'],
+                           min_unit=row['min_unit'],
+                           max_unit=row['max_unit'],
+                           step_size=row['step_size'],
+                           allocation_ratio=row['allocation_ratio'],
+                           used=row['used'] or 0))
+
+    agg_join = sa.join(_RP_AGG_TBL, _AGG_TBL,
+                       _RP_AGG_TBL.c.aggregate_id == _AGG_TBL.c.id)
+    agg_sel = sa.select([_RP_AGG_TBL.c.resource_provider_id,
+                         _AGG_TBL.c.uuid]).select_from(agg_join)
+    if rp_ids is not None:
+        agg_sel = agg_sel.where(
+            _RP_AGG_TBL.c.resource_provider_id.in_(rp_ids))
+    aggregates = collections.defaultdict(set)
+    for row in conn.execute(agg_sel):
+        aggregates[row['resource_provider_id']].add(row['uuid'])
+
+    trait_sel = sa.select([_RP_TRAIT_TBL.c.resource_provider_id,
+                           _RP_TRAIT_TBL.c.trait_id])
+    if rp_ids is not None:
+        trait_sel = trait_sel.where(
+            _RP_TRAIT_TBL.c.resource_provider_id.in_(rp_ids))
+    traits = collections.defaultdict(set)
+    for row in conn.execute(trait_sel):
+        traits[row['resource_provider_id']].add(row['trait_id'])
+
+    return (version, providers, dict(inventories), dict(aggregates),
+            dict(traits))
+
+
+class CapacityIndex(object):
+    """Inventory, usage, aggregate membership and traits of every resource
+    provider, keyed by resource provider id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Changes made by this worker as (version, resource provider id),
+        # applied, under the lock, on the next lookup. They have their own
+        # lock so that marking a provider never waits for a rebuild.
+        self._changes_lock = threading.Lock()
+        self._changes = []
+        self._reset()
+
+    def _reset(self):
+        self._providers = {}
+        self._uuids = {}
+        self._inventories = {}
+        self._aggregates = {}
+        self._traits = {}
+        self._dirty = set()
+        # Changes whose version is ahead of the next one expected, waiting
+        # for those in between.
+        self._pending = []
+        self._version = None
+        self._built_at = None
+
+    def clear(self):
+        """Forget everything so the next lookup rebuilds the index."""
+        with self._lock:
+            self._reset()
+
+    def mark_dirty(self, rp_id, version):
+        """Record that the resource provider with id rp_id was changed, in
+        this worker, by a committed transaction which moved the capacity
+        catalog to version, so must be reloaded before the index is next
+        used.
+        """
+        with self._changes_lock:
+            self._changes.append((version, rp_id))
+
+    def _apply_changes(self):
+        with self._changes_lock:
+            changes, self._changes = self._changes, []
+        pending = []
+        for version, rp_id in sorted(
+                self._pending + changes,
+                key=lambda change: (change[0] is not None, change[0])):
+            if (version is None or self._version is None or
+                    version <= self._version):
+                self._dirty.add(rp_id)
+            elif version == self._version + 1:
+                self._dirty.add(rp_id)
+                self._version = version
+            else:
+                pending.append((version, rp_id))
+        self._pending = pending
+
+    def is_stale(self):
+        return (self._built_at is None or
+                time.time() - self._built_at >
+                CONF.placement.capacity_index_max_age)
+
+    def _is_behind(self, db_version):
+        """Return whether the database has seen changes, made by another
+        worker, which the index has not.
+        """
+        return (db_version is not None and self._version is not None and
+                db_version > self._version)
+
+    def _may_rebuild(self):
+        return (time.time() - self._built_at >=
+                CONF.placement.capacity_index_rebuild_interval)
+
+    def _rebuild(self, ctx):
+        # Anything marked dirty before the load starts is covered by it.
+        self._dirty = set()
+        version, providers, inventories, aggregates, traits = (
+            _load_from_db(ctx))
+        self._version = version
+        self._pending = [change for change in self._pending
+                         if version is None or change[0] > version]
+        self._providers = providers
+        self._uuids = {rp['uuid']: rp_id for rp_id, rp in providers.items()}
+        self._inventories = inventories
+        self._aggregates = aggregates
+        self._traits = traits
+        self._built_at = time.time()
+        LOG.debug('Rebuilt capacity index with %d resource providers',
+                  len(providers))
+
+    def _reload(self, ctx):
+        """Reload the dirty resource providers and return their ids."""
+        dirty, self._dirty = self._dirty, set()
+        _version, providers, inventories, aggregates, traits = (
+            _load_from_db(ctx, dirty))
+        for rp_id in dirty:
+            old = self._providers.pop(rp_id, None)
+            if old is not None:
+                self._uuids.pop(old['uuid'], None)
+            self._inventories.pop(rp_id, None)
+            self._aggregates.pop(rp_id, None)
+            self._traits.pop(rp_id, None)
+        for rp_id, rp in providers.items():
+            self._providers[rp_id] = rp
+            self._uuids[rp['uuid']] = rp_id
+        self._inventories.update(inventories)
+        self._aggregates.update(aggregates)
+        self._traits.update(traits)
+        return dirty
+
+    def _match(self, rp_id, name, can_host, member_of, required, forbidden,
+               resources):
+        rp = self._providers[rp_id]
+        if name and rp['name'] != name:
+            return False
+        if rp['can_host'] != can_host:
+            return False
+        if member_of and not member_of & self._aggregates.get(rp_id, set()):
+            return False
+        if required or forbidden:
+            traits = self._traits.get(rp_id, set())
+            if not required <= traits or forbidden & traits:
+                return False
+        if resources:
+            inventory = self._inventories.get(rp_id, {})
+            for rc_id, amount in resources.items():
+                record = inventory.get(rc_id)
+                if record is None or not has_capacity(record, amount):
+                    return False
+        return True
+
+    def get_all_by_filters(self, ctx, filters):
+        """Return a list of resource provider dicts, ordered by id, which
+        match filters, or None if the index cannot currently be used.
+
+        :param filters: As for `ResourceProviderList.get_all_by_filters`
+                        except that the keys of `resources` must be
+                        resource class ids, not names, and `required` and
+                        `forbidden` must be trait ids.
+        """
+        db_version = _get_version_from_db(ctx)
+        stale = self.is_stale() or self._is_behind(db_version)
+        # NOTE(cdent): Rebuilding is as expensive as the query we are
+        # trying to avoid, so if another thread is already doing it we
+        # let the caller go to the database rather than wait.
+        if not self._lock.acquire(not stale):
+            return None
+        try:
+            self._apply_changes()
+            if self.is_stale():
+                self._rebuild(ctx)
+            elif self._is_behind(db_version):
+                # Another worker changed resource providers this one does
+                # not know about.
+                if not self._may_rebuild():
+                    return None
+                self._rebuild(ctx)
+            elif self._dirty:
+                self._reload(ctx)
+            return self._find(filters)
+        finally:
+            self._lock.release()
+
+    def _find(self, filters):
+        name = filters.get('name')
+        uuid = filters.get('uuid')
+        can_host = filters.get('can_host', 0)
+        member_of = set(filters.get('member_of') or [])
+        required = set(filters.get('required') or [])
+        forbidden = set(filters.get('forbidden') or [])
+        resources = filters.get('resources') or {}
+
+        if uuid:
+            candidates = [self._uuids[uuid]] if uuid in self._uuids else []
+        else:
+            candidates = sorted(self._providers)
+        return [self._providers[rp_id] for rp_id in candidates
+                if self._match(rp_id, name, can_host, member_of, required,
+                               forbidden, resources)]
+
+
+class ColumnarCapacityIndex(CapacityIndex):
+    """A `CapacityIndex` which answers the resources, member_of, required
+    and forbidden filters with vectorized operations on NumPy arrays.
+
+    The arrays have a row per resource provider, in order of id, and a
+    column per resource class. A cell with no inventory has ``present``
+    set to False. Reloading dirty providers updates their rows in place;
+    only new resource providers or resource classes cause the arrays to be
+    rebuilt from the per-provider records.
+    """
+
+    _COLUMNS = CapacityRecord._fields
+
+    def _reset(self):
+        super(ColumnarCapacityIndex, self)._reset()
+        self._rows = []
+        self._row_of = {}
+        self._column_of = {}
+        self._arrays = {}
+        self._present = None
+        self._alive = None
+        self._can_host = None
+        self._names = None
+        self._members = {}
+        self._holders = {}
+
+    def _rebuild(self, ctx):
+        super(ColumnarCapacityIndex, self)._rebuild(ctx)
+        self._build_arrays()
+
+    def _reload(self, ctx):
+        dirty = super(ColumnarCapacityIndex, self)._reload(ctx)
+        if any(rp_id in self._providers and
+               (rp_id not in self._row_of or
+                not set(self._inventories.get(rp_id, {})).issubset(
+                    self._column_of))
+               for rp_id in dirty):
+            self._build_arrays()
+            return dirty
+        for rp_id in dirty:
+            self._fill_row(self._row_of.get(rp_id), rp_id)
+        self._build_members()
+        return dirty
+
+    def _build_arrays(self):
+        self._rows = sorted(self._providers)
+        self._row_of = {rp_id: row for row, rp_id in enumerate(self._rows)}
+        rc_ids = set()
+        for inventory in self._inventories.values():
+            rc_ids.update(inventory)
+        self._column_of = {rc_id: col
+                           for col, rc_id in enumerate(sorted(rc_ids))}
+        shape = (len(self._rows), len(self._column_of))
+        self._arrays = {
+            field: numpy.zeros(
+                shape,
+                dtype=float if field == 'allocation_ratio' else numpy.int64)
+            for field in self._COLUMNS}
+        self._present = numpy.zeros(shape, dtype=bool)
+        self._alive = numpy.zeros(len(self._rows), dtype=bool)
+        self._can_host = numpy.zeros(len(self._rows), dtype=numpy.int64)
+        self._names = numpy.empty(len(self._rows), dtype=object)
+        for row, rp_id in enumerate(self._rows):
+            self._fill_row(row, rp_id)
+        self._build_members()
+
+    def _fill_row(self, row, rp_id):
+        if row is None:
+            # A resource provider which was created and deleted between
+            # two lookups never had a row.
+            return
+        rp = self._providers.get(rp_id)
+        self._present[row] = False
+        self._alive[row] = rp is not None
+        if rp is None:
+            return
+        self._can_host[row] = rp['can_host']
+        self._names[row] = rp['name']
+        for rc_id, record in self._inventories.get(rp_id, {}).items():
+            col = self._column_of[rc_id]
+            self._present[row, col] = True
+            for field in self._COLUMNS:
+                self._arrays[field][row, col] = getattr(record, field)
+
+    def _build_members(self):
+        members = collections.defaultdict(list)
+        for rp_id, agg_uuids in self._aggregates.items():
+            for agg_uuid in agg_uuids:
+                members[agg_uuid].append(self._row_of[rp_id])
+        self._members = dict(members)
+        holders = collections.defaultdict(list)
+        for rp_id, trait_ids in self._traits.items():
+            for trait_id in trait_ids:
+                holders[trait_id].append(self._row_of[rp_id])
+        self._holders = dict(holders)
+
+    def _rows_mask(self, rows):
+        mask = numpy.zeros(len(self._rows), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def _resources_mask(self, resources):
+        mask = numpy.ones(len(self._rows), dtype=bool)
+        for rc_id, amount in resources.items():
+            col = self._column_of.get(rc_id)
+            if col is None:
+                mask[:] = False
+                break
+            total, reserved, min_unit, max_unit, step_size, ratio, used = (
+                self._arrays[field][:, col] for field in self._COLUMNS)
+            capacity = (total - reserved) * ratio
+            # Avoid dividing by zero; a step_size of zero never matches.
+            step = numpy.where(step_size > 0, step_size, 1)
+            mask &= (self._present[:, col] &
+                     (used + amount <= capacity) &
+                     (min_unit <= amount) & (amount <= max_unit) &
+                     (step_size > 0) & (amount % step == 0))
+        return mask
+
+    def _find(self, filters):
+        name = filters.get('name')
+        uuid = filters.get('uuid')
+        can_host = filters.get('can_host', 0)
+        member_of = filters.get('member_of')
+        resources = filters.get('resources')
+
+        mask = self._alive & (self._can_host == can_host)
+        if uuid:
+            only = numpy.zeros(len(self._rows), dtype=bool)
+            rp_id = self._uuids.get(uuid)
+            if rp_id is not None:
+                only[self._row_of[rp_id]] = True
+            mask &= only
+        if name:
+            mask &= self._names == name
+        if member_of:
+            members = numpy.zeros(len(self._rows), dtype=bool)
+            for agg_uuid in member_of:
+                members[self._members.get(agg_uuid, [])] = True
+            mask &= members
+        for trait_id in filters.get('required') or []:
+            mask &= self._rows_mask(self._holders.get(trait_id, []))
+        for trait_id in filters.get('forbidden') or []:
+            mask &= ~self._rows_mask(self._holders.get(trait_id, []))
+        if resources:
+            mask &= self._resources_mask(resources)
+        return [self._providers[self._rows[row]]
+                for row in numpy.flatnonzero(mask)]
+
+
+def _index_class():
+    global _NUMPY_WARNED
+    if CONF.placement.capacity_filter_engine != 'numpy':
+        return CapacityIndex
+    if numpy is None:
+        if not _NUMPY_WARNED:
+            LOG.warning('capacity_filter_engine is "numpy" but NumPy is not '
+                        'installed, using the "index" engine instead')
+            _NUMPY_WARNED = True
+        return CapacityIndex
+    return ColumnarCapacityIndex
+
+
+def get_index():
+    """Return the capacity index of this worker, creating it if needed."""
+    global _INDEX
+    index_class = _index_class()
+    if type(_INDEX) is not index_class:
+        _INDEX = index_class()
+    return _INDEX
+
+
+def mark_dirty(rp_id, version=None):
+    """Mark one resource provider as changed in this worker's index, by a
+    committed transaction which moved the capacity catalog to version, or
+    None if the catalog version was not changed.
+    """
+    global _WRITES
+    _WRITES += 1
+    if _INDEX is not None:
+        _INDEX.mark_dirty(rp_id, version)
+
+
+def write_count():
+    """Return a number which changes whenever this worker changes the
+    inventory, usage, aggregates or traits of a resource provider.
+    """
+    return _WRITES
+
+
+def clear():
+    """Empty this worker's index, forcing a rebuild on next use."""
+    if _INDEX is not None:
+        _INDEX.clear()
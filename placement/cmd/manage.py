@@ -0,0 +1,86 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""CLI interface for placement management.
+
+Usage::
+
+    placement-manage --config-file /etc/placement/placement.conf \
+        db purge_aggregates [--batch-size N] [--batch-interval S] \
+        [--max-rows N]
+"""
+
+from __future__ import print_function
+
+import sys
+
+from oslo_config import cfg
+
+from placement.api import auth
+from placement import conf
+from placement import config
+from placement import objects
+
+
+CONF = conf.CONF
+
+
+class DbCommands(object):
+    """Commands which act on the placement database."""
+
+    def purge_aggregates(self):
+        """Delete the placement aggregates which are no longer associated
+        with any resource provider and report how many were deleted.
+        """
+        removed = objects.purge_orphaned_aggregates(
+            auth.get_admin_context(),
+            batch_size=CONF.command.batch_size,
+            batch_interval=CONF.command.batch_interval,
+            max_rows=CONF.command.max_rows)
+        print('Removed %d orphaned placement aggregates.' % removed)
+        return 0
+
+
+def add_command_parsers(subparsers):
+    db_parser = subparsers.add_parser('db')
+    db_subparsers = db_parser.add_subparsers()
+
+    commands = DbCommands()
+    parser = db_subparsers.add_parser(
+        'purge_aggregates', help=commands.purge_aggregates.__doc__)
+    parser.set_defaults(func=commands.purge_aggregates)
+    parser.add_argument(
+        '--batch-size', type=int, default=None,
+        help='The most aggregates deleted per transaction. Defaults to '
+             '[placement]/aggregate_purge_batch_size.')
+    parser.add_argument(
+        '--batch-interval', type=float, default=None,
+        help='The seconds to wait between batches. Defaults to '
+             '[placement]/aggregate_purge_batch_interval.')
+    parser.add_argument(
+        '--max-rows', type=int, default=None,
+        help='Stop once at least this many aggregates have been deleted.')
+
+
+command_opt = cfg.SubCommandOpt('command',
+                                title='Command',
+                                help='Available commands',
+                                handler=add_command_parsers)
+
+
+def main():
+    CONF.register_cli_opt(command_opt)
+    config.parse_args(sys.argv)
+    return CONF.command.func()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,6 +28,12 @@ api_group = cfg.OptGroup('api',
 Options under this group are used to define Nova API.
 """)
 
+placement_group = cfg.OptGroup('placement',
+    title='Placement options',
+    help="""
+Options under this group tune the behaviour of the placement service itself.
+""")
+
 auth_opts = [
     cfg.StrOpt("auth_strategy",
         default="keystone",
@@ -41,6 +47,251 @@ specified as the username.
 """),
 ]
 
+placement_opts = [
+    cfg.StrOpt("capacity_filter_engine",
+        default="sql",
+        choices=("sql", "index", "numpy"),
+        help="""
+The engine used to answer ``GET /resource_providers`` queries which filter on
+name, uuid, member_of or resources.
+
+* sql: Evaluate every query in the database, except for the aggregate
+  memberships of the member_of filter when member_of_index is enabled. The
+  resources filter aggregates usage on every call.
+* index: Answer the queries from a per-worker in-memory capacity index which is
+  refreshed incrementally as resource provider generations change in this
+  worker. Queries fall back to the database whenever the index is stale,
+  including when another worker has changed a resource provider. Every
+  transaction which changes a resource provider also increments a single
+  version row in the database, which serializes such transactions.
+* numpy: As index, but the resources and member_of filters are evaluated for
+  all resource providers at once using NumPy arrays of inventory and usage.
+  NumPy must be installed; if it is not the index engine is used.
+"""),
+    cfg.IntOpt("capacity_index_max_age",
+        default=60,
+        min=1,
+        help="""
+The maximum number of seconds the in-memory capacity index may go without a
+full rebuild from the database. Changes made by other API workers are
+detected on every query, so this only bounds how long an error in the
+incremental refresh could last. Only used when capacity_filter_engine is
+"index" or "numpy".
+"""),
+    cfg.FloatOpt("capacity_index_rebuild_interval",
+        default=1.0,
+        min=0,
+        help="""
+The minimum number of seconds between the rebuilds of the in-memory capacity
+index made because another API worker has changed a resource provider. In
+between, queries are answered by the database. Only used when
+capacity_filter_engine is "index" or "numpy".
+"""),
+    cfg.BoolOpt("member_of_index",
+        default=True,
+        help="""
+Whether the sql capacity filter engine answers the member_of filter of
+``GET /resource_providers`` from a per-worker in-memory index which holds, for
+each aggregate, the set of its resource providers. The database is then asked
+for a list of resource provider ids rather than to join the aggregate tables.
+Memberships of more than a thousand resource providers are still joined in the
+database. Changes made by other API workers are seen once this worker has next
+checked for them (see aggregate_index_check_interval).
+"""),
+    cfg.FloatOpt("aggregate_index_check_interval",
+        default=1.0,
+        min=0,
+        help="""
+The most often, in seconds, a worker checks the version of the aggregate
+associations in the database to find out whether another API worker has
+changed them. When it has, the worker rebuilds its aggregate index. This
+bounds how long a change made through one worker takes to be seen by the
+member_of filter of the others. Setting this to 0 checks on every use of the
+index. Only used when member_of_index is enabled.
+"""),
+    cfg.IntOpt("aggregate_purge_interval",
+        default=0,
+        min=0,
+        help="""
+The number of seconds between runs, in each API worker, of a background task
+which deletes the placement aggregates no longer associated with any resource
+provider. Aggregates are never deleted when the last resource provider leaves
+them, so where aggregates churn the table keeps growing unless they are purged,
+either by this task or by ``placement-manage db purge_aggregates``. Setting
+this to 0 disables the task.
+"""),
+    cfg.IntOpt("aggregate_purge_batch_size",
+        default=500,
+        min=1,
+        help="""
+The most orphaned placement aggregates deleted in one database transaction
+when purging them. Smaller batches hold locks on the aggregate tables for less
+time but take more transactions.
+"""),
+    cfg.FloatOpt("aggregate_purge_batch_interval",
+        default=0.1,
+        min=0,
+        help="""
+The number of seconds to wait between batches when purging orphaned placement
+aggregates, limiting the load the purge puts on the database.
+"""),
+    cfg.FloatOpt("capacity_cache_ttl",
+        default=5.0,
+        min=0,
+        help="""
+The number of seconds a worker may answer ``GET /capacity`` from the summary
+it last computed for the same filters. A summary is forgotten as soon as the
+worker itself changes a resource provider, but changes made through other API
+workers are only seen once it expires. Setting this to 0 computes the summary
+on every request.
+"""),
+    cfg.IntOpt("allocation_write_retries",
+        default=3,
+        min=0,
+        help="""
+The number of times a write of allocations is retried when the generation of
+one of the resource providers involved changes while it is being written.
+Each retry repeats the capacity check, so a request only fails with a 409
+Conflict once capacity has actually run out or the retries are used up.
+Setting this to 0 disables retries.
+"""),
+    cfg.FloatOpt("allocation_write_retry_interval",
+        default=0.05,
+        min=0,
+        help="""
+The base delay, in seconds, before retrying an allocation write after a
+concurrent update. The delay before retry N is chosen at random between zero
+and this value times 2^(N-1) so that competing writers spread out.
+"""),
+    cfg.IntOpt("inventory_bulk_chunk_size",
+        default=100,
+        min=0,
+        help="""
+The most resource providers whose inventories are written in one database
+transaction by ``PUT /inventories``. Larger chunks take fewer transactions but
+hold locks on more resource providers at once. Setting this to 0 writes the
+inventories of every resource provider in the request in a single transaction.
+"""),
+    cfg.BoolOpt("sql_accounting_headers",
+        default=False,
+        help="""
+Whether every response includes the number of SQL statements run for the
+request, the rows the database driver reported for them and the milliseconds
+spent waiting for the database, in the ``placement-sql-statements``,
+``placement-sql-rows`` and ``placement-sql-time-ms`` headers. The same counts
+are always written to the request log. Statements run while a streamed
+response body is generated are not included.
+"""),
+    cfg.StrOpt("metrics_dir",
+        help="""
+A directory shared by every API worker process of this host. When set, each
+worker writes a snapshot of its request metrics to a file in this directory
+every ``metrics_flush_interval`` seconds and ``GET /metrics`` reports the sum
+of the metrics of every worker rather than only those of the worker which
+serves it. Each file is named for the pid of its worker and a random token.
+A file which has not been written for three flush intervals, or three seconds
+if that is longer, is taken to be that of a worker which has exited and is
+removed, so its counts drop out of the sum.
+"""),
+    cfg.FloatOpt("metrics_flush_interval",
+        default=5.0,
+        min=0,
+        help="""
+The minimum number of seconds between writes of the request metrics of a
+worker to ``metrics_dir``. The metrics of other workers reported by
+``GET /metrics`` may be this much out of date. Only used when
+``metrics_dir`` is set.
+"""),
+    cfg.StrOpt("profile_dir",
+        help="""
+A directory to which profiles of requests are written, in files named for the
+request id. Requests are only profiled when this is set: those of admins which
+include a ``placement-profile`` header and a random ``profile_sample_rate``
+fraction of the rest. The name of the file is returned in the
+``placement-profile`` response header.
+"""),
+    cfg.FloatOpt("profile_sample_rate",
+        default=0.0,
+        min=0,
+        max=1,
+        help="""
+The fraction of requests, from 0 to 1, which are profiled without being asked
+to. Only used when ``profile_dir`` is set.
+"""),
+    cfg.StrOpt("profile_mode",
+        default="cprofile",
+        choices=("cprofile", "sampling"),
+        help="""
+How requests are profiled.
+
+* cprofile: Every function call is traced with cProfile, which slows the
+  request considerably, and the profile written as a ``.pstats`` file which
+  may be read with the pstats module or tools such as snakeviz or flameprof.
+* sampling: The stack of the request is sampled every
+  ``profile_sampling_interval`` seconds, which costs the request little, and
+  the samples written as a ``.folded`` file of collapsed stacks, as read by
+  flamegraph.pl and speedscope.
+"""),
+    cfg.FloatOpt("profile_sampling_interval",
+        default=0.001,
+        min=0.0001,
+        help="""
+The number of seconds between samples of the stack of a request. Only used
+when ``profile_mode`` is "sampling".
+"""),
+    cfg.FloatOpt("slow_statement_threshold",
+        default=0.0,
+        min=0,
+        help="""
+SQL statements which take at least this many seconds are logged as warnings
+with the fingerprint of the statement, the number and types of its
+parameters, the function which ran it and the request it was run for. Setting
+this to 0 logs no statements and does not time them.
+"""),
+    cfg.BoolOpt("slow_statement_explain",
+        default=False,
+        help="""
+Whether slow SELECT statements, as set by ``slow_statement_threshold``, are
+run again with EXPLAIN, or EXPLAIN QUERY PLAN on SQLite, so that the plan the
+database chose for them is logged as well. This is done on MySQL, PostgreSQL
+and SQLite.
+"""),
+    cfg.IntOpt("stream_batch_size",
+        default=1000,
+        min=1,
+        help="""
+The number of rows fetched from the database at a time when a large
+collection, such as the list of resource providers or the allocations of a
+resource provider, is streamed to the client. Larger values mean fewer round
+trips to the database but more memory held per request.
+"""),
+    cfg.FloatOpt("resource_class_negative_cache_ttl",
+        default=5.0,
+        min=0,
+        help="""
+The number of seconds a worker remembers that a custom resource class or trait
+name or id does not exist. Repeated lookups of the same unknown resource class
+or trait in that time fail without reloading the resource classes or traits
+from the database. Changes made through any API worker forget these, but only
+once this worker has next checked for them (see
+resource_class_cache_check_interval). Setting this to 0 disables the negative
+cache.
+"""),
+    cfg.FloatOpt("resource_class_cache_check_interval",
+        default=1.0,
+        min=0,
+        help="""
+The most often, in seconds, a worker checks the version of the resource class
+or trait catalog in the database to find out whether another API worker has
+created, renamed or deleted a resource class or trait. When it has, the worker
+forgets all the resource classes or traits it has cached. This bounds how long
+a change made through one worker takes to be seen by the others. Setting this
+to 0 checks on every use of the cache.
+"""),
+]
+
 oslo_db_options.set_defaults(CONF)
 CONF.register_group(api_group)
 CONF.register_opts(auth_opts, group=api_group)
+CONF.register_group(placement_group)
+CONF.register_opts(placement_opts, group=placement_group)
@@ -13,6 +13,8 @@
 
 from oslo_db.sqlalchemy import enginefacade
 
+from placement.db import accounting
+
 # The maximum value a signed INT type may have
 MAX_INT = 0x7FFFFFFF
 
@@ -26,6 +28,7 @@ MAX_INT = 0x7FFFFFFF
 SQL_SP_FLOAT_MAX = 3.40282e+38
 
 main_context_manager = enginefacade.transaction_context()
+main_context_manager.append_on_engine_create(accounting.install)
 
 
 def _context_manager_from_context(context):
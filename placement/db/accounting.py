@@ -0,0 +1,105 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Accounting of the SQL statements run on behalf of a request.
+
+Listeners on the engine of ``placement.db.main_context_manager`` count every
+statement executed, the rows the driver reports for it and the time spent
+waiting for the database. The counts go to the `SqlStats` which `start` made
+current for the thread, if any, and every timed statement is passed to
+`placement.db.slowlog.record`. Statements are only timed when there are
+stats to count them in or slow statements are logged, so otherwise they
+cost nothing more than a check.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+
+from placement.db import slowlog
+
+
+_LOCAL = threading.local()
+
+
+class SqlStats(object):
+    """The SQL statements run for one request."""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return 'SqlStats(statements=%d, rows=%d, seconds=%.6f)' % (
+            self.statements, self.rows, self.seconds)
+
+
+def start():
+    """Make a new `SqlStats` current for this thread and return it."""
+    stats = SqlStats()
+    _LOCAL.stats = stats
+    return stats
+
+
+def stop():
+    """Stop counting statements for this thread."""
+    _LOCAL.stats = None
+
+
+def current():
+    """Return the `SqlStats` current for this thread, or None."""
+    return getattr(_LOCAL, 'stats', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current() is not None or slowlog.enabled():
+        conn.info.setdefault('placement_query_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('placement_query_start')
+    if not starts:
+        return
+    duration = time.time() - starts.pop()
+    stats = current()
+    if stats is not None:
+        stats.seconds += duration
+        stats.statements += 1
+        # Drivers report the rows changed by writes but only some report
+        # the rows returned by queries before they are fetched; others
+        # give -1.
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+    slowlog.record(conn, statement, parameters, executemany, duration)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is None:
+        return
+    starts = conn.info.get('placement_query_start')
+    stats = current()
+    if starts:
+        started = starts.pop()
+        if stats is not None:
+            stats.seconds += time.time() - started
+            stats.statements += 1
+
+
+def install(engine):
+    """Add the accounting listeners to engine."""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
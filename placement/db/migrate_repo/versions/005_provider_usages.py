@@ -0,0 +1,51 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Database migrations for materialized provider usage"""
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    allocations = Table('allocations', meta, autoload=True)
+
+    provider_usages = Table(
+        'provider_usages', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('resource_provider_id', Integer, primary_key=True,
+               nullable=False),
+        Column('resource_class_id', Integer, primary_key=True,
+               nullable=False),
+        Column('used', Integer, nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='latin1'
+    )
+
+    provider_usages.create(checkfirst=True)
+
+    # Backfill the totals from any allocations which already exist.
+    usage = select([allocations.c.resource_provider_id,
+                    allocations.c.resource_class_id,
+                    func.sum(allocations.c.used)]).group_by(
+                        allocations.c.resource_provider_id,
+                        allocations.c.resource_class_id)
+    migrate_engine.execute(provider_usages.insert().from_select(
+        ['resource_provider_id', 'resource_class_id', 'used'], usage))
@@ -0,0 +1,39 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Database migrations for catalog versions"""
+
+from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import Integer
+from sqlalchemy import MetaData
+from sqlalchemy import String
+from sqlalchemy import Table
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    catalog_versions = Table(
+        'catalog_versions', meta,
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('name', String(64), primary_key=True, nullable=False),
+        Column('version', Integer, nullable=False),
+        mysql_engine='InnoDB',
+        mysql_charset='latin1'
+    )
+
+    catalog_versions.create(checkfirst=True)
+
+    migrate_engine.execute(catalog_versions.insert().values(
+        name='resource_classes', version=0))
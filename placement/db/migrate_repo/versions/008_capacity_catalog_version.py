@@ -0,0 +1,33 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Database migration seeding the capacity catalog version"""
+
+from sqlalchemy import MetaData
+from sqlalchemy import select
+from sqlalchemy import Table
+
+
+# The catalog of changes to resource providers, used by the capacity index.
+CATALOGS = ('capacity',)
+
+
+def upgrade(migrate_engine):
+    meta = MetaData()
+    meta.bind = migrate_engine
+
+    catalog_versions = Table('catalog_versions', meta, autoload=True)
+    existing = set(row[0] for row in migrate_engine.execute(
+        select([catalog_versions.c.name])))
+    for name in CATALOGS:
+        if name not in existing:
+            migrate_engine.execute(catalog_versions.insert().values(
+                name=name, version=0))
@@ -16,6 +16,7 @@ from oslo_db.sqlalchemy import models
 from sqlalchemy import Column
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Float
+from sqlalchemy import ForeignKey
 from sqlalchemy import Index
 from sqlalchemy import Integer
 from sqlalchemy import orm
@@ -87,6 +88,17 @@ class Inventory(BASE):
         foreign_keys=resource_provider_id)
 
 
+class CatalogVersion(BASE):
+    """A counter which is incremented every time one of the catalogs
+    cached by every API worker, such as the resource classes, changes.
+    """
+
+    __tablename__ = 'catalog_versions'
+
+    name = Column(String(64), primary_key=True, nullable=False)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class PlacementAggregate(BASE):
     """A grouping of resource providers."""
     __tablename__ = 'placement_aggregates'
@@ -98,6 +110,20 @@ class PlacementAggregate(BASE):
     uuid = Column(String(36), index=True)
 
 
+class ProviderUsage(BASE):
+    """The total amount of one resource class allocated from one provider.
+
+    This is maintained alongside every write to the allocations table so
+    that usage can be read without summing allocations.
+    """
+
+    __tablename__ = 'provider_usages'
+
+    resource_provider_id = Column(Integer, primary_key=True, nullable=False)
+    resource_class_id = Column(Integer, primary_key=True, nullable=False)
+    used = Column(Integer, nullable=False, default=0)
+
+
 class ResourceClass(BASE):
     """Represents the type of resource for an inventory or allocation."""
     __tablename__ = 'resource_classes'
@@ -140,3 +166,32 @@ class ResourceProviderAggregate(BASE):
 
     resource_provider_id = Column(Integer, primary_key=True, nullable=False)
     aggregate_id = Column(Integer, primary_key=True, nullable=False)
+
+
+class ResourceProviderTrait(BASE):
+    """Represents the relationship between traits and resource provider"""
+
+    __tablename__ = "resource_provider_traits"
+    __table_args__ = (
+        Index('resource_provider_traits_resource_provider_trait_idx',
+              'resource_provider_id', 'trait_id'),
+    )
+
+    trait_id = Column(Integer, ForeignKey('traits.id'), primary_key=True,
+                      nullable=False)
+    resource_provider_id = Column(Integer,
+                                  ForeignKey('resource_providers.id'),
+                                  primary_key=True,
+                                  nullable=False)
+
+
+class Trait(BASE):
+    """Represents a trait."""
+
+    __tablename__ = "traits"
+    __table_args__ = (
+        schema.UniqueConstraint('name', name='uniq_traits0name'),
+    )
+
+    id = Column(Integer, primary_key=True, nullable=False, autoincrement=True)
+    name = Column(Unicode(255), nullable=False)
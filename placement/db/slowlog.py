@@ -0,0 +1,150 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Logging of slow SQL statements.
+
+The accounting listeners of `placement.db.accounting` pass every statement
+they time to `record`. One which took longer than
+[placement]/slow_statement_threshold seconds is logged with its
+fingerprint, the shape of its parameters, the function of placement.objects
+which ran it, the id of the request it was run for and, when
+[placement]/slow_statement_explain is true and it is a SELECT, the plan the
+database chose for it.
+
+The fingerprint is the statement with its literals replaced by ``?`` and
+its IN lists collapsed, so that the same query made with different values
+or numbers of values has the same fingerprint, along with a short hash of
+that for searching logs. Queries which repeat a clause for each resource
+class requested, such as those of
+``ResourceProviderList._get_all_by_filters_from_db`` and
+``_check_capacity_exceeded``, have a fingerprint for each number of
+resource classes, so that the shapes which are slow can be told apart.
+"""
+
+import collections
+import hashlib
+import re
+import sys
+
+from oslo_context import context as oslo_context
+from oslo_log import log as logging
+
+from placement import conf
+from placement.i18n import _LW
+
+
+CONF = conf.CONF
+LOG = logging.getLogger(__name__)
+
+_OBJECTS_FILE = 'placement/objects.py'
+_EXPLAIN = {
+    'mysql': 'EXPLAIN ',
+    'postgresql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_IN_LIST = re.compile(r'\bIN \((?:\?(?:, )?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Return the statement with its literals and placeholders replaced by
+    ``?``, its IN lists collapsed and its whitespace normalized.
+    """
+    statement = _SPACE.sub(' ', statement).strip()
+    statement = _STRING.sub('?', statement)
+    statement = _PLACEHOLDER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    return _IN_LIST.sub('IN (?...)', statement)
+
+
+def _parameter_types(parameters):
+    if isinstance(parameters, dict):
+        parameters = parameters.values()
+    return collections.Counter(type(value).__name__ for value in parameters)
+
+
+def parameter_shape(parameters, executemany=False):
+    """Describe the number and types of the parameters of a statement,
+    but not their values.
+    """
+    if executemany:
+        if not parameters:
+            return 'executemany of 0'
+        return 'executemany of %d x %s' % (
+            len(parameters), parameter_shape(parameters[0]))
+    if not parameters:
+        return 'no parameters'
+    types = _parameter_types(parameters)
+    return '%d (%s)' % (sum(types.values()), ', '.join(
+        '%s: %d' % (name, count) for name, count in sorted(types.items())))
+
+
+def _caller():
+    """Return the innermost function of placement.objects on the stack."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.endswith(_OBJECTS_FILE):
+            return '%s:%d' % (code.co_name, frame.f_lineno)
+        frame = frame.f_back
+    return '-'
+
+
+def _explain(conn, statement, parameters):
+    """Return the plan of a SELECT statement, one line per row, or None."""
+    prefix = _EXPLAIN.get(conn.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    # Use a cursor of the DBAPI connection so that the EXPLAIN is neither
+    # timed nor counted itself.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' | '.join(str(col) for col in row)
+                         for row in cursor.fetchall())
+    except Exception as exc:
+        LOG.debug('Unable to explain slow statement: %s', exc)
+        return None
+    finally:
+        cursor.close()
+
+
+def enabled():
+    """Return whether slow statements are logged, so must be timed."""
+    return bool(CONF.placement.slow_statement_threshold)
+
+
+def record(conn, statement, parameters, executemany, duration):
+    """Log statement, which took duration seconds to run on conn, if that
+    is at least [placement]/slow_statement_threshold.
+    """
+    threshold = CONF.placement.slow_statement_threshold
+    if not threshold or duration < threshold:
+        return
+    shape = fingerprint(statement)
+    ctx = oslo_context.get_current()
+    plan = None
+    if CONF.placement.slow_statement_explain and not executemany:
+        plan = _explain(conn, statement, parameters)
+    LOG.warning(_LW('Slow SQL statement took %(duration).3f seconds in '
+                    '%(caller)s for request %(request_id)s: fingerprint '
+                    '%(hash)s parameters %(parameters)s: %(fingerprint)s'
+                    '%(plan)s'),
+                {'duration': duration,
+                 'caller': _caller(),
+                 'request_id': getattr(ctx, 'request_id', None) or '-',
+                 'hash': hashlib.md5(shape.encode('utf-8')).hexdigest()[:12],
+                 'parameters': parameter_shape(parameters, executemany),
+                 'fingerprint': shape,
+                 'plan': '\nPlan:\n%s' % plan if plan else ''})
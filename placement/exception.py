@@ -23,6 +23,12 @@ class NotFound(KwException):
     pass
 
 
+class ResourceProviderNotFound(NotFound):
+    def __init__(self, *args, **kwargs):
+        self.uuids = kwargs.get('uuids', [])
+        super(ResourceProviderNotFound, self).__init__(*args, **kwargs)
+
+
 class ResourceProviderInUse(Exception):
     pass
 
@@ -39,6 +45,24 @@ class ResourceClassCannotDeleteStandard(KwException):
     pass
 
 
+class TraitExists(KwException):
+    pass
+
+
+class TraitNotFound(NotFound):
+    def __init__(self, *args, **kwargs):
+        self.names = kwargs.get('names', [])
+        super(TraitNotFound, self).__init__(*args, **kwargs)
+
+
+class TraitInUse(KwException):
+    pass
+
+
+class TraitCannotDeleteStandard(KwException):
+    pass
+
+
 class ConcurrentUpdateDetected(Exception):
     pass
 
@@ -51,11 +75,19 @@ class InvalidInventory(KwException):
     pass
 
 
+class InvalidAllocationCapacityExceeded(InvalidInventory):
+    pass
+
+
+class InvalidAllocationConstraintsViolated(InvalidInventory):
+    pass
+
+
 class InventoryWithResourceClassNotFound(KwException):
     pass
 
 
-class InventoryInUse(Exception):
+class InventoryInUse(KwException):
     pass
 
 
@@ -10,11 +10,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import abc
+import collections
 import copy
+import itertools
+import random
+import threading
+import time
 # NOTE(cdent): The resource provider objects are designed to never be
 # used over RPC. Remote manipulation is done with the placement HTTP
 # API. The 'remotable' decorators should not be used.
 
+import os_traits
 from oslo_concurrency import lockutils
 from oslo_db import exception as db_exc
 from oslo_log import log as logging
@@ -24,13 +31,17 @@ from oslo_versionedobjects import fields
 import six
 import sqlalchemy as sa
 from sqlalchemy import func
+from sqlalchemy import orm
 from sqlalchemy.orm import contains_eager
 from sqlalchemy import sql
 
+from placement import aggregate_index
+from placement import capacity_index
+from placement import conf
 from placement import db
 from placement import exception
 from placement.db import models
-from placement.i18n import _, _LW
+from placement.i18n import _, _LI, _LW
 
 
 _ALLOC_TBL = models.Allocation.__table__
@@ -39,10 +50,39 @@ _RP_TBL = models.ResourceProvider.__table__
 _RC_TBL = models.ResourceClass.__table__
 _AGG_TBL = models.PlacementAggregate.__table__
 _RP_AGG_TBL = models.ResourceProviderAggregate.__table__
+_USAGE_TBL = models.ProviderUsage.__table__
+_CATALOG_TBL = models.CatalogVersion.__table__
+_TRAIT_TBL = models.Trait.__table__
+_RP_TRAIT_TBL = models.ResourceProviderTrait.__table__
 _RC_CACHE = None
 _LOCKNAME = 'rc_cache'
-
-
+# The name of the catalog_versions row of the resource classes.
+_RC_CATALOG = 'resource_classes'
+_TRAIT_CACHE = None
+_TRAIT_LOCK = 'trait_cache'
+# The name of the catalog_versions row of the traits.
+_TRAIT_CATALOG = 'traits'
+# Whether the standard traits of os_traits have been written to the
+# database by this process.
+_TRAITS_SYNCED = False
+# Counts of allocation writes retried after, and of writes which failed
+# because of, concurrent updates of resource provider generations.
+_ALLOCATION_RETRY_COUNTS = collections.Counter()
+_ALLOCATION_RETRY_LOCK = threading.Lock()
+# Capacity summaries, keyed by the filters they were made with, as tuples of
+# the time they expire, the capacity_index.write_count() when they were made
+# and the CapacityList.
+_CAPACITY_CACHE = {}
+# The most capacity summaries kept in _CAPACITY_CACHE.
+_CAPACITY_CACHE_SIZE = 100
+# The keys, in the info of a database session, of the ids of the resource
+# providers changed by its transaction and of the capacity catalog version
+# the transaction moved to.
+_CHANGED_PROVIDERS = 'placement_changed_providers'
+_CAPACITY_VERSION = 'placement_capacity_version'
+
+
+CONF = conf.CONF
 LOG = logging.getLogger(__name__)
 
 
@@ -94,42 +134,305 @@ def raise_if_custom_resource_class_pre_v1_1(rc):
             raise ValueError
 
 
+def _get_catalog_version(conn, name):
+    """Returns the current version of the catalog with name, or None if
+    it has never been changed.
+    """
+    sel = sa.select([_CATALOG_TBL.c.version]).where(
+        _CATALOG_TBL.c.name == name)
+    return conn.execute(sel).scalar()
+
+
+def _bump_catalog_version(conn, name):
+    """Increments the version of the catalog with name so that every API
+    worker knows to reload its cache of the catalog. Must be called in the
+    transaction which changes the catalog.
+
+    The row of every catalog is made by the database migrations. Should one
+    be missing it is inserted, and if a concurrent transaction inserted it
+    first the update is made again.
+    """
+    upd = _CATALOG_TBL.update().where(_CATALOG_TBL.c.name == name).values(
+        version=_CATALOG_TBL.c.version + 1)
+    if conn.execute(upd).rowcount:
+        return
+    try:
+        conn.execute(_CATALOG_TBL.insert().values(name=name, version=1))
+    except db_exc.DBDuplicateEntry:
+        conn.execute(upd)
+
+
+def _bump_aggregates_version(conn):
+    """Increments the version of the aggregate associations so that every
+    API worker knows to update its aggregate index, and returns the new
+    version. Must be called in the transaction which changes the
+    associations.
+
+    Returns None without touching the catalog when the aggregate index is
+    not in use, since nothing reads its version then.
+    """
+    if not aggregate_index.enabled():
+        return None
+    _bump_catalog_version(conn, aggregate_index.CATALOG)
+    return _get_catalog_version(conn, aggregate_index.CATALOG)
+
+
+def _provider_changed(context, rp_id):
+    """Record that the transaction of context changed the inventory, usage,
+    aggregates or traits of the resource provider with id rp_id. Must be
+    called in that transaction.
+
+    The capacity index of this worker is told once the transaction has
+    committed, so that it never reloads the provider before the change can
+    be read. When the index is in use the capacity catalog version is also
+    incremented, once per transaction, just before it commits, so that
+    other workers know their indexes are out of date.
+    """
+    context.session.info.setdefault(_CHANGED_PROVIDERS, set()).add(rp_id)
+
+
+# The commit and rollback events of a Session also fire for its savepoints,
+# which are ignored: only the outermost transaction really commits.
+
+def _bump_capacity_version(session):
+    rp_ids = session.info.get(_CHANGED_PROVIDERS)
+    if (rp_ids and not session.transaction.nested and
+            capacity_index.enabled()):
+        conn = session.connection()
+        _bump_catalog_version(conn, capacity_index.CATALOG)
+        session.info[_CAPACITY_VERSION] = _get_catalog_version(
+            conn, capacity_index.CATALOG)
+
+
+def _mark_changed_providers(session):
+    if session.transaction.nested:
+        return
+    rp_ids = session.info.pop(_CHANGED_PROVIDERS, None)
+    version = session.info.pop(_CAPACITY_VERSION, None)
+    for rp_id in rp_ids or ():
+        capacity_index.mark_dirty(rp_id, version)
+
+
+def _forget_changed_providers(session, previous_transaction):
+    if previous_transaction.nested:
+        return
+    session.info.pop(_CHANGED_PROVIDERS, None)
+    session.info.pop(_CAPACITY_VERSION, None)
+
+
+sa.event.listen(orm.Session, 'before_commit', _bump_capacity_version)
+sa.event.listen(orm.Session, 'after_commit', _mark_changed_providers)
+sa.event.listen(orm.Session, 'after_soft_rollback',
+                _forget_changed_providers)
+
+
 @db.main_context_manager.reader
-def _refresh_from_db(ctx, cache):
-    """Grabs all custom resource classes from the DB table and populates the
-    supplied cache object's internal integer and string identifier dicts.
+def _refresh_from_db(ctx):
+    """Grabs all custom resource classes from the DB table.
 
-    :param cache: ResourceClassCache object to refresh.
+    :returns: A tuple of resource class ids keyed by name, resource class
+              names keyed by id and the version of the resource class
+              catalog they were read at.
     """
     with db.main_context_manager.reader.connection.using(ctx) as conn:
+        version = _get_catalog_version(conn, _RC_CATALOG)
         sel = sa.select([_RC_TBL.c.id, _RC_TBL.c.name])
         res = conn.execute(sel).fetchall()
-        cache.id_cache = {r[1]: r[0] for r in res}
-        cache.str_cache = {r[0]: r[1] for r in res}
+        return ({r[1]: r[0] for r in res}, {r[0]: r[1] for r in res},
+                version)
 
 
-class ResourceClassCache(object):
-    """A cache of integer and string lookup values for resource classes."""
+@db.main_context_manager.reader
+def _trait_refresh_from_db(ctx):
+    """Grabs all traits from the DB table.
 
-    # List of dict of all standard resource classes, where every list item
-    # have a form {'id': <ID>, 'name': <NAME>}
-    STANDARDS = [{'id': ResourceClass.STANDARD.index(s), 'name': s}
-                 for s in ResourceClass.STANDARD]
+    :returns: A tuple of trait ids keyed by name, trait names keyed by id
+              and the version of the trait catalog they were read at.
+    """
+    with db.main_context_manager.reader.connection.using(ctx) as conn:
+        version = _get_catalog_version(conn, _TRAIT_CATALOG)
+        sel = sa.select([_TRAIT_TBL.c.id, _TRAIT_TBL.c.name])
+        res = conn.execute(sel).fetchall()
+        return ({r[1]: r[0] for r in res}, {r[0]: r[1] for r in res},
+                version)
+
+
+@db.main_context_manager.writer
+def _trait_sync(ctx):
+    """Writes any of the standard traits of os_traits which are not yet in
+    the traits table to it.
+    """
+    conn = ctx.session.connection()
+    sel = sa.select([_TRAIT_TBL.c.name])
+    db_traits = set(r[0] for r in conn.execute(sel))
+    need_sync = set(os_traits.get_traits()) - db_traits
+    if need_sync:
+        conn.execute(_TRAIT_TBL.insert(),
+                     [{'name': six.text_type(name)}
+                      for name in sorted(need_sync)])
+        _bump_catalog_version(conn, _TRAIT_CATALOG)
+
+
+@db.main_context_manager.reader
+def _get_catalog_version_from_db(ctx, name):
+    with db.main_context_manager.reader.connection.using(ctx) as conn:
+        return _get_catalog_version(conn, name)
+
+
+@six.add_metaclass(abc.ABCMeta)
+class _CatalogCache(object):
+    """A cache of one of the catalogs, such as the custom resource classes,
+    which every API worker looks up by name and by id.
+
+    Lookups read an immutable snapshot of the catalog and take no lock. A
+    lookup which misses the snapshot reloads it from the database;
+    concurrent misses wait for a single reload rather than each doing their
+    own. Names and ids which are still missing afterwards are remembered
+    for [placement]/resource_class_negative_cache_ttl seconds, so that
+    repeated lookups of an unknown entry do not reload the table every
+    time.
+
+    Every change to the catalog, by any API worker, increments its version
+    in the database. The cache compares that with the version its snapshot
+    was read at, at most once every
+    [placement]/resource_class_cache_check_interval seconds, and forgets
+    everything it knows when they differ.
+
+    Subclasses name their catalog and lock and say how the catalog is
+    loaded and how a missing entry is reported.
+    """
+
+    # The name of the catalog_versions row of the catalog.
+    CATALOG = None
+    # The name of the lock taken to change the snapshot.
+    LOCKNAME = None
+    # The most unknown names and ids remembered at once.
+    MAX_MISSES = 1000
 
     def __init__(self, ctx):
-        """Initialize the cache of resource class identifiers.
+        """Initialize the cache.
 
         :param ctx: `nova.context.RequestContext` from which we can grab a
                     `SQLAlchemy.Connection` object to use for any DB lookups.
         """
         self.ctx = ctx
-        self.id_cache = {}
-        self.str_cache = {}
+        # The (id_cache, str_cache, catalog version) tuple and the dict of
+        # negative cache expiry times are replaced, never changed, so they
+        # may be read without holding the lock.
+        self._snapshot = ({}, {}, None)
+        self._misses = {}
+        self._next_check = 0
+
+    @property
+    def id_cache(self):
+        return self._snapshot[0]
+
+    @property
+    def str_cache(self):
+        return self._snapshot[1]
+
+    @abc.abstractmethod
+    def _load(self, ctx):
+        """Return a new snapshot of the catalog read from the database."""
+
+    @abc.abstractmethod
+    def _not_found(self, key):
+        """Return the exception which reports that key is unknown."""
 
     def clear(self):
-        with lockutils.lock(_LOCKNAME):
-            self.id_cache = {}
-            self.str_cache = {}
+        # Waiting for the lock means a reload which started before the
+        # catalog changed cannot replace the empty snapshot.
+        with lockutils.lock(self.LOCKNAME):
+            self._snapshot = ({}, {}, None)
+            self._misses = {}
+
+    def check_version(self, ctx):
+        """Forget everything in the cache if the catalog has been changed,
+        by any API worker, since the snapshot was read. The database is
+        asked at most once per
+        [placement]/resource_class_cache_check_interval seconds.
+
+        :param ctx: `nova.context.RequestContext` from which we can grab a
+                    `SQLAlchemy.Connection` object to use for the lookup.
+        """
+        now = time.time()
+        if now < self._next_check:
+            return
+        self._next_check = (
+            now + CONF.placement.resource_class_cache_check_interval)
+        snapshot = self._snapshot
+        if not (snapshot[0] or snapshot[1] or self._misses):
+            # Nothing is known so nothing can be out of date.
+            return
+        if _get_catalog_version_from_db(ctx, self.CATALOG) != snapshot[2]:
+            with lockutils.lock(self.LOCKNAME):
+                if self._snapshot is snapshot:
+                    self._snapshot = ({}, {}, None)
+                    self._misses = {}
+
+    def _refresh(self, snapshot):
+        """Reload the catalog unless another thread has already replaced
+        snapshot while this one waited to, and return the current snapshot.
+        """
+        with lockutils.lock(self.LOCKNAME):
+            if self._snapshot is snapshot:
+                self._snapshot = self._load(self.ctx)
+            return self._snapshot
+
+    def _remember_miss(self, key):
+        now = time.time()
+        ttl = CONF.placement.resource_class_negative_cache_ttl
+        if not ttl:
+            return
+        with lockutils.lock(self.LOCKNAME):
+            misses = dict((k, expires) for k, expires in self._misses.items()
+                          if expires > now)
+            if len(misses) >= self.MAX_MISSES:
+                misses = {}
+            misses[key] = now + ttl
+            self._misses = misses
+
+    def _lookup(self, index, key):
+        """Return the value for key in the index'th dict of the snapshot,
+        reloading the snapshot if it is not there.
+
+        :raises the exception made by `_not_found` if key is unknown.
+        """
+        snapshot = self._snapshot
+        value = snapshot[index].get(key)
+        if value is not None:
+            return value
+        expires = self._misses.get(key)
+        if expires is not None and expires > time.time():
+            raise self._not_found(key)
+        value = self._refresh(snapshot)[index].get(key)
+        if value is not None:
+            return value
+        self._remember_miss(key)
+        raise self._not_found(key)
+
+
+class ResourceClassCache(_CatalogCache):
+    """A cache of integer and string lookup values for resource classes.
+
+    Standard resource classes are answered from `ResourceClass.STANDARD`,
+    custom ones from a snapshot of the resource_classes table as described
+    in `_CatalogCache`.
+    """
+
+    # List of dict of all standard resource classes, where every list item
+    # have a form {'id': <ID>, 'name': <NAME>}
+    STANDARDS = [{'id': ResourceClass.STANDARD.index(s), 'name': s}
+                 for s in ResourceClass.STANDARD]
+
+    CATALOG = _RC_CATALOG
+    LOCKNAME = _LOCKNAME
+
+    def _load(self, ctx):
+        return _refresh_from_db(ctx)
+
+    def _not_found(self, key):
+        return exception.ResourceClassNotFound(resource_class=key)
 
     def id_from_string(self, rc_str):
         """Given a string representation of a resource class -- e.g. "DISK_GB"
@@ -152,14 +455,8 @@ class ResourceClassCache(object):
         if rc_str in ResourceClass.STANDARD:
             return ResourceClass.STANDARD.index(rc_str)
 
-        with lockutils.lock(_LOCKNAME):
-            if rc_str in self.id_cache:
-                return self.id_cache[rc_str]
-            # Otherwise, check the database table
-            _refresh_from_db(self.ctx, self)
-            if rc_str in self.id_cache:
-                return self.id_cache[rc_str]
-            raise exception.ResourceClassNotFound(resource_class=rc_str)
+        # Otherwise, check the cached, or if need be reloaded, database table
+        return self._lookup(0, rc_str)
 
     def string_from_id(self, rc_id):
         """The reverse of the id_from_string() method. Given a supplied numeric
@@ -182,15 +479,70 @@ class ResourceClassCache(object):
         except IndexError:
             pass
 
-        with lockutils.lock(_LOCKNAME):
-            if rc_id in self.str_cache:
-                return self.str_cache[rc_id]
+        # Otherwise, check the cached, or if need be reloaded, database table
+        return self._lookup(1, rc_id)
 
-            # Otherwise, check the database table
-            _refresh_from_db(self.ctx, self)
-            if rc_id in self.str_cache:
-                return self.str_cache[rc_id]
-            raise exception.ResourceClassNotFound(resource_class=rc_id)
+
+class TraitCache(_CatalogCache):
+    """A cache of the ids of traits, standard and custom alike, keyed by
+    name and of their names keyed by id, as described in `_CatalogCache`.
+    """
+
+    CATALOG = _TRAIT_CATALOG
+    LOCKNAME = _TRAIT_LOCK
+
+    def _load(self, ctx):
+        return _trait_refresh_from_db(ctx)
+
+    def _not_found(self, key):
+        return exception.TraitNotFound(names=[key])
+
+    def id_from_name(self, name):
+        """Return the integer id of the trait with name.
+
+        :raises `exception.TraitNotFound` if there is no such trait.
+        """
+        return self._lookup(0, name)
+
+    def name_from_id(self, trait_id):
+        """Return the name of the trait with the integer id trait_id.
+
+        :raises `exception.TraitNotFound` if there is no such trait.
+        """
+        return self._lookup(1, trait_id)
+
+    def ids_from_names(self, names):
+        """Return the set of the ids of the traits with names.
+
+        :raises `exception.TraitNotFound` naming, in its names attribute,
+                every one of names for which there is no trait.
+        """
+        ids = set()
+        missing = []
+        for name in names:
+            try:
+                ids.add(self.id_from_name(name))
+            except exception.TraitNotFound:
+                missing.append(name)
+        if missing:
+            raise exception.TraitNotFound(names=sorted(missing))
+        return ids
+
+
+def _count_allocation_retry(name):
+    with _ALLOCATION_RETRY_LOCK:
+        _ALLOCATION_RETRY_COUNTS[name] += 1
+
+
+def get_allocation_retry_counts():
+    """Returns a dict with the number of times, since this process started,
+    that an allocation write was retried because of a concurrent update
+    ('retries') and that such a conflict was reported to the caller after
+    the retries ran out ('exhausted').
+    """
+    with _ALLOCATION_RETRY_LOCK:
+        return {'retries': _ALLOCATION_RETRY_COUNTS['retries'],
+                'exhausted': _ALLOCATION_RETRY_COUNTS['exhausted']}
 
 
 @db.main_context_manager.reader
@@ -202,9 +554,36 @@ def _ensure_rc_cache(ctx):
                 connection.
     """
     global _RC_CACHE
-    if _RC_CACHE is not None:
-        return
-    _RC_CACHE = ResourceClassCache(ctx)
+    if _RC_CACHE is None:
+        _RC_CACHE = ResourceClassCache(ctx)
+    _RC_CACHE.check_version(ctx)
+
+
+def _ensure_trait_cache(ctx):
+    """Ensures that the standard traits are in the database and that a
+    singleton trait cache has been created in the module's scope.
+
+    This must not be called inside a database transaction since the
+    standard traits are written, once per process, in a transaction of
+    their own.
+
+    :param ctx: `nova.context.RequestContext` that may be used to grab a DB
+                connection.
+    """
+    global _TRAITS_SYNCED
+    global _TRAIT_CACHE
+    if not _TRAITS_SYNCED:
+        with lockutils.lock(_TRAIT_LOCK):
+            if not _TRAITS_SYNCED:
+                try:
+                    _trait_sync(ctx)
+                except db_exc.DBDuplicateEntry:
+                    # Another API worker synced them at the same time.
+                    pass
+                _TRAITS_SYNCED = True
+    if _TRAIT_CACHE is None:
+        _TRAIT_CACHE = TraitCache(ctx)
+    _TRAIT_CACHE.check_version(ctx)
 
 
 def _get_current_inventory_resources(conn, rp):
@@ -220,6 +599,35 @@ def _get_current_inventory_resources(conn, rp):
     return set([r[0] for r in existing_resources])
 
 
+def _adjust_provider_usage(conn, usage_deltas):
+    """Apply changes in allocated amounts to the materialized usage totals
+    in the provider_usages table.
+
+    :param conn: DB connection to use.
+    :param usage_deltas: dict of amounts to add (or, when negative, remove)
+                         keyed by (resource provider id, resource class id).
+    :raises nova.exception.ConcurrentUpdateDetected: if another thread
+            created the same usage record while this one was doing so.
+    """
+    for (rp_id, rc_id), delta in usage_deltas.items():
+        if not delta:
+            continue
+        upd_stmt = _USAGE_TBL.update().where(sa.and_(
+                _USAGE_TBL.c.resource_provider_id == rp_id,
+                _USAGE_TBL.c.resource_class_id == rc_id)).values(
+                        used=_USAGE_TBL.c.used + delta)
+        if conn.execute(upd_stmt).rowcount:
+            continue
+        ins_stmt = _USAGE_TBL.insert().values(
+                resource_provider_id=rp_id,
+                resource_class_id=rc_id,
+                used=delta)
+        try:
+            conn.execute(ins_stmt)
+        except db_exc.DBDuplicateEntry:
+            raise exception.ConcurrentUpdateDetected
+
+
 def _delete_inventory_from_provider(conn, rp, to_delete):
     """Deletes any inventory records from the supplied provider and set() of
     resource class identifiers.
@@ -233,10 +641,10 @@ def _delete_inventory_from_provider(conn, rp, to_delete):
                       delete.
     """
     allocation_query = sa.select(
-        [_ALLOC_TBL.c.resource_class_id.label('resource_class')]).where(
-             sa.and_(_ALLOC_TBL.c.resource_provider_id == rp.id,
-                     _ALLOC_TBL.c.resource_class_id.in_(to_delete))
-         ).group_by(_ALLOC_TBL.c.resource_class_id)
+        [_USAGE_TBL.c.resource_class_id.label('resource_class')]).where(
+             sa.and_(_USAGE_TBL.c.resource_provider_id == rp.id,
+                     _USAGE_TBL.c.resource_class_id.in_(to_delete),
+                     _USAGE_TBL.c.used > 0))
     allocations = conn.execute(allocation_query).fetchall()
     if allocations:
         resource_classes = ', '.join([_RC_CACHE.string_from_id(alloc[0])
@@ -299,10 +707,10 @@ def _update_inventory_for_provider(conn, rp, inv_list, to_update):
                 resource_class=rc_str,
                 resource_provider=rp.uuid)
         allocation_query = sa.select(
-            [func.sum(_ALLOC_TBL.c.used).label('usage')]).\
+            [_USAGE_TBL.c.used.label('usage')]).\
             where(sa.and_(
-                _ALLOC_TBL.c.resource_provider_id == rp.id,
-                _ALLOC_TBL.c.resource_class_id == rc_id))
+                _USAGE_TBL.c.resource_provider_id == rp.id,
+                _USAGE_TBL.c.resource_class_id == rc_id))
         allocations = conn.execute(allocation_query).first()
         if (allocations
             and allocations['usage'] is not None
@@ -364,6 +772,7 @@ def _add_inventory(context, rp, inventory):
         _add_inventory_to_provider(
             conn, rp, inv_list, set([rc_id]))
         rp.generation = _increment_provider_generation(conn, rp)
+        _provider_changed(context, rp.id)
 
 
 @db.main_context_manager.writer
@@ -381,6 +790,7 @@ def _update_inventory(context, rp, inventory):
         exceeded = _update_inventory_for_provider(
             conn, rp, inv_list, set([rc_id]))
         rp.generation = _increment_provider_generation(conn, rp)
+        _provider_changed(context, rp.id)
     return exceeded
 
 
@@ -400,6 +810,7 @@ def _delete_inventory(context, rp, resource_class):
                 'No inventory of class %s found for delete'
                 % resource_class)
         rp.generation = _increment_provider_generation(conn, rp)
+        _provider_changed(context, rp.id)
 
 
 @db.main_context_manager.writer
@@ -457,17 +868,268 @@ def _set_inventory(context, rp, inv_list):
         # to retry the inventory save after reverifying any capacity
         # conditions and re-reading the existing inventory information.
         rp.generation = _increment_provider_generation(conn, rp)
+        _provider_changed(context, rp.id)
 
     return exceeded
 
 
+_INVENTORY_FIELDS = ('total', 'reserved', 'min_unit', 'max_unit',
+                     'step_size', 'allocation_ratio')
+
+
+def _increment_provider_generations(conn, expected):
+    """Increments the generations of many resource providers at once.
+
+    :param conn: DB connection to use.
+    :param expected: dict of the generation each resource provider must
+                     still have, keyed by resource provider id.
+    :returns: The set of ids of the resource providers whose generation
+              changed in the meantime, or which were deleted, and so were
+              not incremented.
+    :raises nova.exception.ConcurrentUpdateDetected: if a generation changed
+            despite the resource providers being locked.
+    """
+    # Lock the resource providers, reading the generations they have now,
+    # so that those changed by another thread can be left out.
+    sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.generation]).where(
+        _RP_TBL.c.id.in_(sorted(expected))).with_for_update()
+    current = dict(conn.execute(sel).fetchall())
+    changed = set(rp_id for rp_id, generation in expected.items()
+                  if current.get(rp_id) != generation)
+    expected = dict((rp_id, generation)
+                    for rp_id, generation in expected.items()
+                    if rp_id not in changed)
+    if expected:
+        upd_stmt = _RP_TBL.update().where(sa.and_(
+            _RP_TBL.c.id.in_(sorted(expected)),
+            _RP_TBL.c.generation == sa.case(
+                expected, value=_RP_TBL.c.id))).values(
+                    generation=_RP_TBL.c.generation + 1)
+        if conn.execute(upd_stmt).rowcount != len(expected):
+            raise exception.ConcurrentUpdateDetected
+    return changed
+
+
+@db.main_context_manager.writer
+def _set_inventories_for_providers(context, inventories):
+    """Replaces the inventories of many resource providers in one
+    transaction, with a fixed number of statements however many resource
+    providers there are.
+
+    :param inventories: dict, keyed by resource provider uuid, of tuples of
+                        the generation of the resource provider the caller
+                        last saw and the `InventoryList` to save. Every
+                        resource class must be known to the resource class
+                        cache.
+    :returns: A tuple of a dict of the generations of the resource providers
+              found, keyed by uuid; a dict, keyed by uuid, of the exceptions
+              explaining why the inventories of some resource providers were
+              not saved; and a list of (uuid, class) tuples that have
+              exceeded their capacity after this inventory update.
+    :raises nova.exception.ConcurrentUpdateDetected: if a generation changed
+            while the resource providers were locked.
+    """
+    conn = context.session.connection()
+    sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.uuid,
+                     _RP_TBL.c.generation]).where(
+        _RP_TBL.c.uuid.in_(list(inventories)))
+    rps = dict((row['uuid'], row) for row in conn.execute(sel))
+    generations = dict((uuid, row['generation']) for uuid, row in rps.items())
+    conflicts = {}
+    wanted = {}
+    for uuid, (generation, inv_list) in inventories.items():
+        if uuid not in rps:
+            conflicts[uuid] = exception.ResourceProviderNotFound(uuids=[uuid])
+        elif rps[uuid]['generation'] != generation:
+            conflicts[uuid] = exception.ConcurrentUpdateDetected()
+        else:
+            wanted[rps[uuid]['id']] = dict(
+                (_RC_CACHE.id_from_string(inv.resource_class), inv)
+                for inv in inv_list.objects)
+    if not wanted:
+        return generations, conflicts, []
+    uuids = dict((rps[uuid]['id'], uuid) for uuid in rps)
+
+    existing = collections.defaultdict(dict)
+    sel = sa.select([_INV_TBL.c.resource_provider_id,
+                     _INV_TBL.c.resource_class_id] +
+                    [_INV_TBL.c[field] for field in _INVENTORY_FIELDS]).where(
+        _INV_TBL.c.resource_provider_id.in_(list(wanted)))
+    for row in conn.execute(sel):
+        existing[row['resource_provider_id']][row['resource_class_id']] = row
+    usages = {}
+    sel = sa.select([_USAGE_TBL.c.resource_provider_id,
+                     _USAGE_TBL.c.resource_class_id, _USAGE_TBL.c.used]).where(
+        sa.and_(_USAGE_TBL.c.resource_provider_id.in_(list(wanted)),
+                _USAGE_TBL.c.used > 0))
+    for rp_id, rc_id, used in conn.execute(sel):
+        usages[(rp_id, rc_id)] = used
+
+    # Work out every change before writing anything so that the inventories
+    # of resource providers which cannot be saved are left out.
+    to_delete = {}
+    to_add = []
+    to_update = []
+    exceeded = []
+    for rp_id, invs in list(wanted.items()):
+        current = existing[rp_id]
+        deleted = set(current) - set(invs)
+        in_use = sorted(rc_id for rc_id in deleted if (rp_id, rc_id) in usages)
+        if in_use:
+            conflicts[uuids[rp_id]] = exception.InventoryInUse(
+                resource_classes=', '.join(
+                    _RC_CACHE.string_from_id(rc_id) for rc_id in in_use),
+                resource_provider=uuids[rp_id])
+            del wanted[rp_id]
+            continue
+        if deleted:
+            to_delete[rp_id] = deleted
+        for rc_id, inv in invs.items():
+            values = dict((field, getattr(inv, field))
+                          for field in _INVENTORY_FIELDS)
+            if rc_id not in current:
+                values.update(resource_provider_id=rp_id,
+                              resource_class_id=rc_id)
+                to_add.append(values)
+                continue
+            if usages.get((rp_id, rc_id), 0) > inv.capacity:
+                exceeded.append((uuids[rp_id], inv.resource_class))
+            # Most providers send the inventory they already have, which
+            # need not be written again.
+            if any(current[rc_id][field] != value
+                   for field, value in values.items()):
+                values.update(b_resource_provider_id=rp_id,
+                              b_resource_class_id=rc_id)
+                to_update.append(values)
+
+    # Incrementing the generations first locks the resource providers, and
+    # finds those changed by another thread since they were read above.
+    changed = _increment_provider_generations(
+        conn, dict((rp_id, rps[uuids[rp_id]]['generation'])
+                   for rp_id in wanted))
+    for rp_id in changed:
+        conflicts[uuids[rp_id]] = exception.ConcurrentUpdateDetected()
+        del wanted[rp_id]
+        to_delete.pop(rp_id, None)
+    if changed:
+        to_add = [values for values in to_add
+                  if values['resource_provider_id'] not in changed]
+        to_update = [values for values in to_update
+                     if values['b_resource_provider_id'] not in changed]
+        exceeded = [(uuid, rc) for uuid, rc in exceeded
+                    if rps[uuid]['id'] not in changed]
+
+    if to_delete:
+        conn.execute(_INV_TBL.delete().where(sa.or_(*[
+            sa.and_(_INV_TBL.c.resource_provider_id == rp_id,
+                    _INV_TBL.c.resource_class_id.in_(sorted(rc_ids)))
+            for rp_id, rc_ids in to_delete.items()])))
+    if to_add:
+        conn.execute(_INV_TBL.insert(), to_add)
+    if to_update:
+        upd_stmt = _INV_TBL.update().where(sa.and_(
+            _INV_TBL.c.resource_provider_id == sa.bindparam(
+                'b_resource_provider_id'),
+            _INV_TBL.c.resource_class_id == sa.bindparam(
+                'b_resource_class_id'))).values(
+                    dict((field, sa.bindparam(field))
+                         for field in _INVENTORY_FIELDS))
+        conn.execute(upd_stmt, to_update)
+
+    for rp_id in wanted:
+        generations[uuids[rp_id]] += 1
+        _provider_changed(context, rp_id)
+    return generations, conflicts, exceeded
+
+
+@db.main_context_manager.writer
+def _set_traits(context, rp, traits):
+    """Given a TraitList object, replaces the traits associated with the
+    resource provider, only writing the associations which change, and
+    increments the generation of the resource provider.
+
+    :param context: Nova RequestContext.
+    :param rp: `ResourceProvider` object upon which to set traits.
+    :param traits: `TraitList` object of the traits rp is to have.
+    :raises nova.exception.ConcurrentUpdateDetected: if another thread updated
+            the same resource provider in between the time when this object
+            was originally read and the call to set the traits.
+    """
+    conn = context.session.connection()
+    sel = sa.select([_RP_TRAIT_TBL.c.trait_id]).where(
+        _RP_TRAIT_TBL.c.resource_provider_id == rp.id)
+    existing_traits = set(r[0] for r in conn.execute(sel))
+    these_traits = set(trait.id for trait in traits)
+
+    to_delete = existing_traits - these_traits
+    to_add = these_traits - existing_traits
+    if to_delete:
+        conn.execute(_RP_TRAIT_TBL.delete().where(sa.and_(
+            _RP_TRAIT_TBL.c.resource_provider_id == rp.id,
+            _RP_TRAIT_TBL.c.trait_id.in_(to_delete))))
+    if to_add:
+        conn.execute(_RP_TRAIT_TBL.insert(),
+                     [{'resource_provider_id': rp.id, 'trait_id': trait_id}
+                      for trait_id in sorted(to_add)])
+    rp.generation = _increment_provider_generation(conn, rp)
+    _provider_changed(context, rp.id)
+
+
+class ProviderIdentityMap(object):
+    """The `ResourceProvider` objects loaded through one request context,
+    keyed by both uuid and id.
+
+    The context of each API request holds one of these as its
+    ``provider_map`` attribute, so a resource provider which is looked up
+    several times while the request is handled is read from the database
+    once and every caller gets the same object. That object is updated in
+    place by writes made through it, such as the generation increment done
+    when inventory is set. Long lived contexts, such as the admin contexts
+    of periodic tasks, have none, so they never hold on to stale resource
+    providers.
+    """
+
+    def __init__(self):
+        self._by_uuid = {}
+        self._by_id = {}
+
+    def get_by_uuid(self, uuid):
+        return self._by_uuid.get(uuid)
+
+    def get_by_id(self, rp_id):
+        return self._by_id.get(rp_id)
+
+    def add(self, resource_provider):
+        """Remember resource_provider and return the object which is now
+        mapped to its uuid, which is an existing one if there was one.
+        """
+        existing = self._by_uuid.get(resource_provider.uuid)
+        if existing is not None and existing.id == resource_provider.id:
+            return existing
+        self._by_uuid[resource_provider.uuid] = resource_provider
+        self._by_id[resource_provider.id] = resource_provider
+        return resource_provider
+
+    def discard(self, resource_provider):
+        self._by_uuid.pop(resource_provider.uuid, None)
+        self._by_id.pop(resource_provider.id, None)
+
+
+def _provider_map(context):
+    """Return the `ProviderIdentityMap` of context, or None if the context
+    does not have one.
+    """
+    return getattr(context, 'provider_map', None)
+
+
 @base.VersionedObjectRegistry.register
 class ResourceProvider(base.VersionedObject):
     # Version 1.0: Initial version
     # Version 1.1: Add destroy()
     # Version 1.2: Add get_aggregates(), set_aggregates()
     # Version 1.3: Turn off remotable
-    VERSION = '1.3'
+    # Version 1.4: Add get_traits(), set_traits()
+    VERSION = '1.4'
 
     fields = {
         'id': fields.IntegerField(read_only=True),
@@ -489,9 +1151,17 @@ class ResourceProvider(base.VersionedObject):
         updates = self.obj_get_changes()
         db_rp = self._create_in_db(self._context, updates)
         self._from_db_object(self._context, self, db_rp)
+        provider_map = _provider_map(self._context)
+        if provider_map is not None:
+            provider_map.add(self)
 
     def destroy(self):
-        self._delete(self._context, self.id)
+        version = self._delete(self._context, self.id)
+        if version is not None:
+            aggregate_index.mark_dirty(self.id, version)
+        provider_map = _provider_map(self._context)
+        if provider_map is not None:
+            provider_map.discard(self)
 
     def save(self):
         updates = self.obj_get_changes()
@@ -503,8 +1173,20 @@ class ResourceProvider(base.VersionedObject):
 
     @classmethod
     def get_by_uuid(cls, context, uuid):
+        """Return the resource provider with uuid, which is only read from
+        the database if it has not already been loaded through context.
+        """
+        provider_map = _provider_map(context)
+        if provider_map is not None:
+            resource_provider = provider_map.get_by_uuid(uuid)
+            if resource_provider is not None:
+                return resource_provider
         db_resource_provider = cls._get_by_uuid_from_db(context, uuid)
-        return cls._from_db_object(context, cls(), db_resource_provider)
+        resource_provider = cls._from_db_object(context, cls(),
+                                                db_resource_provider)
+        if provider_map is not None:
+            resource_provider = provider_map.add(resource_provider)
+        return resource_provider
 
     def add_inventory(self, inventory):
         """Add one new Inventory to the resource provider.
@@ -551,7 +1233,29 @@ class ResourceProvider(base.VersionedObject):
         If an aggregate does not exist, one will be created using the
         provided uuid.
         """
-        self._set_aggregates(self._context, self.id, aggregate_uuids)
+        version = self._set_aggregates(self._context, self.id,
+                                       aggregate_uuids)
+        if version is not None:
+            aggregate_index.mark_dirty(self.id, version)
+
+    def get_traits(self):
+        """Get the traits associated with this resource provider, as a
+        `TraitList`.
+        """
+        return TraitList.get_all_by_resource_provider(self._context, self)
+
+    def set_traits(self, traits):
+        """Replace the traits associated with this resource provider.
+
+        The generation of the resource provider is incremented.
+
+        :param traits: `TraitList` of the traits the resource provider is
+                       to have.
+        :raises `exception.ConcurrentUpdateDetected` if the resource
+                provider has been changed since it was read.
+        """
+        _set_traits(self._context, self, traits)
+        self.obj_reset_changes()
 
     @staticmethod
     @db.main_context_manager.writer
@@ -559,6 +1263,8 @@ class ResourceProvider(base.VersionedObject):
         db_rp = models.ResourceProvider()
         db_rp.update(updates)
         context.session.add(db_rp)
+        context.session.flush()
+        _provider_changed(context, db_rp.id)
         return db_rp
 
     @staticmethod
@@ -569,19 +1275,29 @@ class ResourceProvider(base.VersionedObject):
                 models.Allocation.resource_provider_id == _id).count()
         if rp_allocations:
             raise exception.ResourceProviderInUse()
+        # Delete the, by now empty, usage records of the resource provider
+        context.session.query(models.ProviderUsage).\
+            filter(models.ProviderUsage.resource_provider_id == _id).delete()
         # Delete any inventory associated with the resource provider
         context.session.query(models.Inventory).\
             filter(models.Inventory.resource_provider_id == _id).delete()
         # Delete any aggregate associations for the resource provider
         # The name substitution on the next line is needed to satisfy pep8
         RPA_model = models.ResourceProviderAggregate
-        context.session.query(RPA_model).\
+        num_aggregates = context.session.query(RPA_model).\
                 filter(RPA_model.resource_provider_id == _id).delete()
+        # Delete any trait associations for the resource provider
+        RPT_model = models.ResourceProviderTrait
+        context.session.query(RPT_model).\
+                filter(RPT_model.resource_provider_id == _id).delete()
         # Now delete the RP records
         result = context.session.query(models.ResourceProvider).\
                  filter(models.ResourceProvider.id == _id).delete()
         if not result:
             raise exception.NotFound()
+        _provider_changed(context, _id)
+        if num_aggregates:
+            return _bump_aggregates_version(context.session.connection())
 
     @staticmethod
     @db.main_context_manager.writer
@@ -590,6 +1306,7 @@ class ResourceProvider(base.VersionedObject):
             id=id).first()
         db_rp.update(updates)
         db_rp.save(context.session)
+        _provider_changed(context, id)
 
     @staticmethod
     def _from_db_object(context, resource_provider, db_resource_provider):
@@ -621,65 +1338,150 @@ class ResourceProvider(base.VersionedObject):
         sel = sa.select([_AGG_TBL.c.uuid]).select_from(join_statement)
         return [r[0] for r in conn.execute(sel).fetchall()]
 
+    @staticmethod
+    def _ensure_aggregates(context, agg_uuids):
+        """Create the placement aggregates with agg_uuids which do not yet
+        exist and return the ids of all of them keyed by uuid.
+        """
+        conn = context.session.connection()
+        # Locking the aggregates which already exist keeps
+        # purge_orphaned_aggregates from removing one of them, because it
+        # has no associations yet, before this transaction associates it.
+        sel = sa.select([_AGG_TBL.c.uuid, _AGG_TBL.c.id]).where(
+            _AGG_TBL.c.uuid.in_(agg_uuids)).with_for_update()
+        found = dict(conn.execute(sel).fetchall())
+        missing = sorted(set(agg_uuids) - set(found))
+        if not missing:
+            return found
+        # Another thread may add some of the same aggregates at the same
+        # time. The savepoints keep an integrity error from aborting the
+        # whole transaction, after which the aggregates are added one at a
+        # time so that those which now exist can be skipped.
+        try:
+            with context.session.begin_nested():
+                conn.execute(_AGG_TBL.insert(),
+                             [{'uuid': agg_uuid} for agg_uuid in missing])
+        except db_exc.DBDuplicateEntry:
+            for agg_uuid in missing:
+                try:
+                    with context.session.begin_nested():
+                        conn.execute(_AGG_TBL.insert().values(uuid=agg_uuid))
+                except db_exc.DBDuplicateEntry:
+                    pass
+        sel = sa.select([_AGG_TBL.c.uuid, _AGG_TBL.c.id]).where(
+            _AGG_TBL.c.uuid.in_(missing))
+        found.update(conn.execute(sel).fetchall())
+        return found
+
     @classmethod
     @db.main_context_manager.writer
     def _set_aggregates(cls, context, rp_id, provided_aggregates):
+        """Make the aggregates associated with the resource provider with id
+        rp_id those with the uuids in provided_aggregates, only writing the
+        associations which change.
+
+        :returns: The version the aggregate associations were moved to, or
+                  None if nothing changed.
+        """
         # When aggregate uuids are persisted no validation is done
         # to ensure that they refer to something that has meaning
         # elsewhere. It is assumed that code which makes use of the
         # aggregates, later, will validate their fitness.
-        # TODO(cdent): At the moment we do not delete
-        # a PlacementAggregate that no longer has any associations
-        # with at least one resource provider. We may wish to do that
-        # to avoid bloat if it turns out we're creating a lot of noise.
-        # Not doing now to move things along.
+        # A PlacementAggregate that no longer has any associations with
+        # at least one resource provider is not deleted here. Those are
+        # removed, in batches, by purge_orphaned_aggregates.
+        conn = context.session.connection()
+        join_statement = sa.join(
+            _AGG_TBL, _RP_AGG_TBL, sa.and_(
+                _AGG_TBL.c.id == _RP_AGG_TBL.c.aggregate_id,
+                _RP_AGG_TBL.c.resource_provider_id == rp_id))
+        sel = sa.select([_AGG_TBL.c.uuid, _AGG_TBL.c.id]).select_from(
+            join_statement)
+        existing_aggregates = dict(conn.execute(sel).fetchall())
         provided_aggregates = set(provided_aggregates)
-        existing_aggregates = set(cls._get_aggregates(context, rp_id))
-        to_add = provided_aggregates - existing_aggregates
-        target_aggregates = list(provided_aggregates)
-
-        # Create any aggregates that do not yet exist in
-        # PlacementAggregates. This is different from
-        # the set in existing_aggregates; those are aggregates for
-        # which there are associations for the resource provider
-        # at rp_id. The following loop checks for the existence of any
-        # aggregate with the provided uuid. In this way we only
-        # create a new row in the PlacementAggregate table if the
-        # aggregate uuid has never been seen before. Code further
-        # below will update the associations.
-        for agg_uuid in to_add:
-            found_agg = context.session.query(models.PlacementAggregate.uuid).\
-                filter_by(uuid=agg_uuid).first()
-            if not found_agg:
-                new_aggregate = models.PlacementAggregate(uuid=agg_uuid)
-                try:
-                    context.session.add(new_aggregate)
-                    # Flush each aggregate to explicitly call the INSERT
-                    # statement that could result in an integrity error
-                    # if some other thread has added this agg_uuid. This
-                    # also makes sure that the new aggregates have
-                    # ids when the SELECT below happens.
-                    context.session.flush()
-                except db_exc.DBDuplicateEntry:
-                    # Something else has already added this agg_uuid
-                    pass
+        to_add = provided_aggregates - set(existing_aggregates)
+        to_delete = set(existing_aggregates) - provided_aggregates
+        if not to_add and not to_delete:
+            return None
 
-        # Remove all aggregate associations so we can refresh them
-        # below. This means that all associations are added, but the
-        # aggregates themselves stay around.
-        context.session.query(models.ResourceProviderAggregate).filter_by(
-            resource_provider_id=rp_id).delete()
+        if to_delete:
+            conn.execute(_RP_AGG_TBL.delete().where(sa.and_(
+                _RP_AGG_TBL.c.resource_provider_id == rp_id,
+                _RP_AGG_TBL.c.aggregate_id.in_(
+                    [existing_aggregates[agg_uuid]
+                     for agg_uuid in to_delete]))))
+        if to_add:
+            agg_ids = cls._ensure_aggregates(context, to_add)
+            conn.execute(_RP_AGG_TBL.insert(),
+                         [{'resource_provider_id': rp_id,
+                           'aggregate_id': agg_ids[agg_uuid]}
+                          for agg_uuid in sorted(to_add)])
+        _provider_changed(context, rp_id)
+        return _bump_aggregates_version(conn)
 
-        # Set resource_provider_id, aggregate_id pairs to
-        # ResourceProviderAggregate table.
-        if target_aggregates:
-            select_agg_id = sa.select([rp_id, models.PlacementAggregate.id]).\
-                where(models.PlacementAggregate.uuid.in_(target_aggregates))
-            insert_aggregates = models.ResourceProviderAggregate.__table__.\
-                insert().from_select(['resource_provider_id', 'aggregate_id'],
-                                     select_agg_id)
-            conn = context.session.connection()
-            conn.execute(insert_aggregates)
+
+@db.main_context_manager.writer
+def _purge_orphaned_aggregates_batch(context, batch_size):
+    """Delete up to batch_size placement aggregates which are not associated
+    with any resource provider.
+
+    :returns: A tuple of the number of aggregates found to be orphaned and
+              the number deleted. Fewer are deleted than found if some were
+              associated with a resource provider in the meantime.
+    """
+    conn = context.session.connection()
+    not_associated = ~sa.exists().where(
+        _RP_AGG_TBL.c.aggregate_id == _AGG_TBL.c.id)
+    sel = sa.select([_AGG_TBL.c.id]).where(not_associated).order_by(
+        _AGG_TBL.c.id).limit(batch_size)
+    agg_ids = [r[0] for r in conn.execute(sel)]
+    if not agg_ids:
+        return 0, 0
+    # Lock the aggregates found, waiting for any transaction which is about
+    # to associate one of them, then check again that they are orphaned
+    # when deleting.
+    sel = sa.select([_AGG_TBL.c.id]).where(
+        _AGG_TBL.c.id.in_(agg_ids)).with_for_update()
+    conn.execute(sel).fetchall()
+    res = conn.execute(_AGG_TBL.delete().where(sa.and_(
+        _AGG_TBL.c.id.in_(agg_ids), not_associated)))
+    return len(agg_ids), res.rowcount
+
+
+def purge_orphaned_aggregates(context, batch_size=None, batch_interval=None,
+                              max_rows=None):
+    """Delete the placement aggregates which are no longer associated with
+    any resource provider.
+
+    The aggregates are deleted in batches, each in a transaction of its
+    own, so that the tables are only ever locked briefly, with a pause
+    between batches to limit the load on the database.
+
+    :param batch_size: The most aggregates deleted per transaction. Defaults
+                       to [placement]/aggregate_purge_batch_size.
+    :param batch_interval: The seconds to wait between batches. Defaults to
+                           [placement]/aggregate_purge_batch_interval.
+    :param max_rows: If not None, stop once at least this many aggregates
+                     have been deleted.
+    :returns: The number of aggregates deleted.
+    """
+    if batch_size is None:
+        batch_size = CONF.placement.aggregate_purge_batch_size
+    if batch_interval is None:
+        batch_interval = CONF.placement.aggregate_purge_batch_interval
+    removed = 0
+    while max_rows is None or removed < max_rows:
+        if max_rows is not None:
+            batch_size = min(batch_size, max_rows - removed)
+        found, deleted = _purge_orphaned_aggregates_batch(context, batch_size)
+        removed += deleted
+        if found < batch_size:
+            break
+        if batch_interval:
+            time.sleep(batch_interval)
+    if removed:
+        LOG.info(_LI('Purged %d orphaned placement aggregates'), removed)
+    return removed
 
 
 @base.VersionedObjectRegistry.register
@@ -693,13 +1495,17 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
     }
 
     @staticmethod
-    @db.main_context_manager.reader
-    def _get_all_by_filters_from_db(context, filters):
+    def _get_all_by_filters_query(context, filters, limit=None, marker=None):
+        """Returns the query, to be run in the reader transaction of context,
+        which `_get_all_by_filters_from_db` runs.
+        """
         # Eg. filters can be:
         #  filters = {
         #      'name': <name>,
         #      'uuid': <uuid>,
         #      'member_of': [<aggregate_uuid>, <aggregate_uuid>]
+        #      'required': [<trait_name>, <trait_name>],
+        #      'forbidden': [<trait_name>, <trait_name>],
         #      'resources': {
         #          'VCPU': 1,
         #          'MEMORY_MB': 1024
@@ -715,6 +1521,11 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         uuid = filters.pop('uuid', None)
         can_host = filters.pop('can_host', 0)
         member_of = filters.pop('member_of', [])
+        required = filters.pop('required', [])
+        forbidden = filters.pop('forbidden', [])
+        if required or forbidden:
+            required = _TRAIT_CACHE.ids_from_names(required)
+            forbidden = _TRAIT_CACHE.ids_from_names(forbidden)
 
         resources = filters.pop('resources', {})
         # NOTE(sbauza): We want to key the dict by the resource class IDs
@@ -727,11 +1538,31 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         if uuid:
             query = query.filter(models.ResourceProvider.uuid == uuid)
         query = query.filter(models.ResourceProvider.can_host == can_host)
-
-        # If 'member_of' has values join with the PlacementAggregates to
-        # get those resource providers that are associated with any of the
-        # list of aggregate uuids provided with 'member_of'.
-        if member_of:
+        # Results are always ordered by id, which is what the marker of a
+        # paginated listing refers to.
+        if marker is not None:
+            query = query.filter(models.ResourceProvider.id > marker)
+        query = query.order_by(models.ResourceProvider.id)
+
+        # If 'member_of' has values and the aggregate index knows the
+        # members of the aggregates, only those resource providers are
+        # looked at.
+        members = None
+        if member_of and aggregate_index.enabled():
+            members = aggregate_index.get_index().get_members(
+                context, member_of)
+            if members is not None and len(members) > aggregate_index.MAX_IDS:
+                members = None
+        if members is not None:
+            rp_ids = sorted(members)
+            if rp_ids:
+                query = query.filter(models.ResourceProvider.id.in_(rp_ids))
+            else:
+                query = query.filter(sa.false())
+        # Otherwise join with the PlacementAggregates to get those resource
+        # providers that are associated with any of the list of aggregate
+        # uuids provided with 'member_of'.
+        elif member_of:
             join_statement = sa.join(_AGG_TBL, _RP_AGG_TBL, sa.and_(
                 _AGG_TBL.c.id == _RP_AGG_TBL.c.aggregate_id,
                 _AGG_TBL.c.uuid.in_(member_of)))
@@ -741,10 +1572,29 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
             query = query.filter(models.ResourceProvider.id.in_(
                 rps_in_aggregates))
 
+        # Resource providers with every required trait are those with as
+        # many associations to any of the required traits as there are
+        # required traits.
+        if required:
+            rps_with_traits = sa.select(
+                [_RP_TRAIT_TBL.c.resource_provider_id]).where(
+                    _RP_TRAIT_TBL.c.trait_id.in_(required)).group_by(
+                        _RP_TRAIT_TBL.c.resource_provider_id).having(
+                            func.count(_RP_TRAIT_TBL.c.trait_id) ==
+                            len(required))
+            query = query.filter(models.ResourceProvider.id.in_(
+                rps_with_traits))
+        if forbidden:
+            rps_with_forbidden = sa.select(
+                [_RP_TRAIT_TBL.c.resource_provider_id]).where(
+                    _RP_TRAIT_TBL.c.trait_id.in_(forbidden))
+            query = query.filter(~models.ResourceProvider.id.in_(
+                rps_with_forbidden))
+
         if not resources:
             # Returns quickly the list in case we don't need to check the
             # resource usage
-            return query.all()
+            return query.limit(limit)
 
         # NOTE(sbauza): In case we want to look at the resource criteria, then
         # the SQL generated from this case looks something like:
@@ -753,12 +1603,7 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         # FROM resource_providers AS rp
         # JOIN inventories AS inv
         # ON rp.id = inv.resource_provider_id
-        # LEFT JOIN (
-        #    SELECT resource_provider_id, resource_class_id, SUM(used) AS used
-        #    FROM allocations
-        #    WHERE resource_class_id IN ($RESOURCE_CLASSES)
-        #    GROUP BY resource_provider_id, resource_class_id
-        # ) AS usage
+        # LEFT JOIN provider_usages AS usage
         #     ON inv.resource_provider_id = usage.resource_provider_id
         #     AND inv.resource_class_id = usage.resource_class_id
         # AND (inv.resource_class_id = $X AND (used + $AMOUNT_X <= (
@@ -785,14 +1630,7 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         query = query.join(_INV_TBL, join_clause)
 
         # Now, below is the LEFT JOIN for getting the allocations usage
-        usage = sa.select([_ALLOC_TBL.c.resource_provider_id,
-                           _ALLOC_TBL.c.resource_class_id,
-                           sql.func.sum(_ALLOC_TBL.c.used).label('used')])
-        usage = usage.where(_ALLOC_TBL.c.resource_class_id.in_(
-            resources.keys()))
-        usage = usage.group_by(_ALLOC_TBL.c.resource_provider_id,
-                               _ALLOC_TBL.c.resource_class_id)
-        usage = sa.alias(usage, name='usage')
+        usage = sa.alias(_USAGE_TBL, name='usage')
         query = query.outerjoin(
             usage,
             sa.and_(
@@ -820,10 +1658,52 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
         query = query.having(sql.func.count(
             sa.distinct(_INV_TBL.c.resource_class_id)) == len(resources))
 
-        return query.all()
+        return query.limit(limit)
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_by_filters_from_db(context, filters, limit=None,
+                                    marker=None):
+        return ResourceProviderList._get_all_by_filters_query(
+            context, filters, limit=limit, marker=marker).all()
+
+    @staticmethod
+    def _iter_all_by_filters_from_db(context, filters, limit=None,
+                                     marker=None):
+        with db.main_context_manager.reader.using(context):
+            query = ResourceProviderList._get_all_by_filters_query(
+                context, filters, limit=limit, marker=marker)
+            for db_rp in query.yield_per(CONF.placement.stream_batch_size):
+                yield ResourceProvider._from_db_object(
+                    context, ResourceProvider(), db_rp)
+
+    @staticmethod
+    def _get_all_by_filters_from_index(context, filters, limit=None,
+                                       marker=None):
+        """Answer the same query as `_get_all_by_filters_from_db` from the
+        in-memory capacity index. Returns None when the index is stale and
+        the database must be used instead.
+        """
+        filters = copy.deepcopy(filters) if filters else {}
+        resources = filters.get('resources', {})
+        filters['resources'] = {_RC_CACHE.id_from_string(r_name): amount
+                                for r_name, amount in resources.items()}
+        for key in ('required', 'forbidden'):
+            if filters.get(key):
+                filters[key] = _TRAIT_CACHE.ids_from_names(filters[key])
+        resource_providers = capacity_index.get_index().get_all_by_filters(
+            context, filters)
+        if resource_providers is not None:
+            if marker is not None:
+                resource_providers = [rp for rp in resource_providers
+                                      if rp['id'] > marker]
+            if limit is not None:
+                resource_providers = resource_providers[:limit]
+        return resource_providers
 
     @classmethod
-    def get_all_by_filters(cls, context, filters=None):
+    def get_all_by_filters(cls, context, filters=None, limit=None,
+                           marker=None):
         """Returns a list of `ResourceProvider` objects that have sufficient
         resources in their inventories to satisfy the amounts specified in the
         `filters` parameter.
@@ -833,17 +1713,110 @@ class ResourceProviderList(base.ObjectListBase, base.VersionedObject):
 
         :param context: `nova.context.RequestContext` that may be used to grab
                         a DB connection.
-        :param filters: Can be `name`, `uuid`, `member_of` or `resources` where
-                        `member_of` is a list of aggregate uuids and
-                        `resources` is a dict of amounts keyed by resource
-                        classes.
+        :param filters: Can be `name`, `uuid`, `member_of`, `required`,
+                        `forbidden` or `resources` where `member_of` is a
+                        list of aggregate uuids, `required` and `forbidden`
+                        are lists of the names of traits resource providers
+                        must and must not have and `resources` is a dict of
+                        amounts keyed by resource classes.
         :type filters: dict
+        :param limit: Maximum number of resource providers to return.
+        :param marker: If not None, only return resource providers with an id
+                       greater than this one. Results are ordered by id.
+        :raises `exception.TraitNotFound` naming every trait in `required`
+                or `forbidden` which does not exist.
         """
         _ensure_rc_cache(context)
-        resource_providers = cls._get_all_by_filters_from_db(context, filters)
+        if filters and (filters.get('required') or filters.get('forbidden')):
+            _ensure_trait_cache(context)
+        resource_providers = None
+        if CONF.placement.capacity_filter_engine in ('index', 'numpy'):
+            resource_providers = cls._get_all_by_filters_from_index(
+                context, filters, limit=limit, marker=marker)
+        if resource_providers is None:
+            resource_providers = cls._get_all_by_filters_from_db(
+                context, filters, limit=limit, marker=marker)
         return base.obj_make_list(context, cls(context),
                                   ResourceProvider, resource_providers)
 
+    @classmethod
+    def iter_all_by_filters(cls, context, filters=None, limit=None,
+                            marker=None):
+        """Returns an iterator over the `ResourceProvider` objects which
+        `get_all_by_filters` would return for the same arguments.
+
+        Resource providers are read from the database in batches of
+        [placement]/stream_batch_size rows, in a transaction which stays open
+        until the iterator is exhausted or closed, so that only a few of them
+        are held in memory at once.
+
+        :raises `exception.ResourceClassNotFound` when called, rather than
+                when iterated, if a resource class in the resources filter
+                does not exist.
+        :raises `exception.TraitNotFound` when called if a trait in the
+                required or forbidden filters does not exist.
+        """
+        _ensure_rc_cache(context)
+        filters = filters or {}
+        for rc_name in filters.get('resources', {}):
+            _RC_CACHE.id_from_string(rc_name)
+        traits = filters.get('required', []) + filters.get('forbidden', [])
+        if traits:
+            _ensure_trait_cache(context)
+            _TRAIT_CACHE.ids_from_names(traits)
+        if CONF.placement.capacity_filter_engine in ('index', 'numpy'):
+            resource_providers = cls._get_all_by_filters_from_index(
+                context, filters, limit=limit, marker=marker)
+            if resource_providers is not None:
+                return (ResourceProvider._from_db_object(
+                            context, ResourceProvider(), rp)
+                        for rp in resource_providers)
+        return cls._iter_all_by_filters_from_db(
+            context, filters, limit=limit, marker=marker)
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_by_uuids_from_db(context, uuids):
+        conn = context.session.connection()
+        sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.uuid, _RP_TBL.c.name,
+                         _RP_TBL.c.generation])
+        sel = sel.where(_RP_TBL.c.uuid.in_(uuids))
+        return [dict(r) for r in conn.execute(sel)]
+
+    @classmethod
+    def get_by_uuids(cls, context, uuids):
+        """Returns a ResourceProviderList of the resource providers with the
+        supplied uuids, read with a single query.
+
+        :param uuids: Iterable of resource provider uuids. Duplicates are
+                      ignored.
+        :raises `exception.ResourceProviderNotFound` naming, in its uuids
+                attribute, every supplied uuid for which there is no
+                resource provider.
+        """
+        uuids = set(uuids)
+        provider_map = _provider_map(context)
+        resource_providers = []
+        if provider_map is not None:
+            for uuid in list(uuids):
+                resource_provider = provider_map.get_by_uuid(uuid)
+                if resource_provider is not None:
+                    resource_providers.append(resource_provider)
+                    uuids.discard(uuid)
+        if uuids:
+            for db_rp in cls._get_by_uuids_from_db(context, uuids):
+                resource_provider = ResourceProvider._from_db_object(
+                    context, ResourceProvider(), db_rp)
+                if provider_map is not None:
+                    resource_provider = provider_map.add(resource_provider)
+                resource_providers.append(resource_provider)
+                uuids.discard(resource_provider.uuid)
+        if uuids:
+            raise exception.ResourceProviderNotFound(uuids=sorted(uuids))
+        rp_list = cls(context, objects=resource_providers)
+        rp_list.obj_reset_changes()
+        return rp_list
+
 
 class _HasAResourceProvider(base.VersionedObject):
     """Code shared between Inventory and Allocation
@@ -853,13 +1826,13 @@ class _HasAResourceProvider(base.VersionedObject):
 
     @staticmethod
     def _make_db(updates):
-        try:
-            resource_provider = updates.pop('resource_provider')
-            updates['resource_provider_id'] = resource_provider.id
-        except (KeyError, NotImplementedError):
+        resource_provider = updates.pop('resource_provider', None)
+        if (resource_provider is None or
+                not resource_provider.obj_attr_is_set('id')):
             raise exception.ObjectActionError(
                 action='create',
                 reason='resource_provider required')
+        updates['resource_provider_id'] = resource_provider.id
         try:
             rc_str = updates.pop('resource_class')
         except KeyError:
@@ -897,15 +1870,17 @@ def _create_inventory_in_db(context, updates):
     db_inventory = models.Inventory()
     db_inventory.update(updates)
     context.session.add(db_inventory)
+    _provider_changed(context, updates['resource_provider_id'])
     return db_inventory
 
 
 @db.main_context_manager.writer
 def _update_inventory_in_db(context, id_, updates):
-    result = context.session.query(
-        models.Inventory).filter_by(id=id_).update(updates)
-    if not result:
+    query = context.session.query(models.Inventory).filter_by(id=id_)
+    rp_id = query.with_entities(models.Inventory.resource_provider_id).scalar()
+    if rp_id is None or not query.update(updates):
         raise exception.NotFound()
+    _provider_changed(context, rp_id)
 
 
 @base.VersionedObjectRegistry.register
@@ -1007,6 +1982,97 @@ class InventoryList(base.ObjectListBase, base.VersionedObject):
         return base.obj_make_list(context, cls(context), Inventory,
                                   db_inventory_list)
 
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_by_resource_provider_id(context, rp_id):
+        return context.session.query(models.Inventory).filter(
+            models.Inventory.resource_provider_id == rp_id).all()
+
+    @classmethod
+    def get_all_by_resource_provider(cls, context, resource_provider):
+        """Returns the inventories of an already loaded resource provider,
+        without reading the resource provider again. Every `Inventory` in
+        the list refers to the resource_provider object that is passed in.
+        """
+        inventories = [
+            Inventory._from_db_object(
+                context,
+                Inventory(context, resource_provider=resource_provider),
+                db_inventory)
+            for db_inventory in cls._get_all_by_resource_provider_id(
+                context, resource_provider.id)]
+        inv_list = cls(context, objects=inventories)
+        inv_list.obj_reset_changes()
+        return inv_list
+
+    @staticmethod
+    def set_all_for_providers(context, inventories, chunk_size=None):
+        """Replace the inventories of many resource providers.
+
+        Each resource provider is treated as by
+        `ResourceProvider.set_inventory`, but rather than one transaction
+        per resource provider they are written in transactions of up to
+        chunk_size resource providers, each made of a handful of statements.
+        A resource provider which cannot be written, because it does not
+        exist, its generation has changed or inventory to be deleted is in
+        use, is left out without affecting the others.
+
+        :param inventories: dict, keyed by resource provider uuid, of tuples
+                            of the generation of the resource provider the
+                            caller last saw and the `InventoryList` to save.
+        :param chunk_size: The most resource providers written per
+                           transaction, or 0 for one transaction. Defaults to
+                           [placement]/inventory_bulk_chunk_size.
+        :returns: A tuple of a dict of the generations of the resource
+                  providers found, after the write for those written, keyed
+                  by uuid and a dict, keyed by uuid, of the exceptions
+                  explaining why the inventories of the others were refused.
+        :raises `exception.ResourceClassNotFound` if any resource class in any
+                inventory cannot be found in either the standard classes or
+                the DB.
+        :raises `exception.InvalidInventoryCapacity` if any inventory has no
+                capacity.
+        :raises `exception.ConcurrentUpdateDetected` if, twice in a row, a
+                generation changed while the resource providers of a chunk
+                were locked. Nothing in that chunk, or those after it, was
+                written.
+        """
+        _ensure_rc_cache(context)
+        # Refuse the whole set, before writing anything, if any of it is
+        # invalid whichever resource provider it is for.
+        for uuid, (_generation, inv_list) in inventories.items():
+            for inv in inv_list.objects:
+                _RC_CACHE.id_from_string(inv.resource_class)
+                if inv.capacity <= 0:
+                    raise exception.InvalidInventoryCapacity(
+                        resource_class=inv.resource_class,
+                        resource_provider=uuid)
+
+        if chunk_size is None:
+            chunk_size = CONF.placement.inventory_bulk_chunk_size
+        uuids = sorted(inventories)
+        chunk_size = chunk_size or len(uuids) or 1
+        generations = {}
+        conflicts = {}
+        for start in range(0, len(uuids), chunk_size):
+            chunk = dict((uuid, inventories[uuid])
+                         for uuid in uuids[start:start + chunk_size])
+            try:
+                chunk_generations, chunk_conflicts, exceeded = (
+                    _set_inventories_for_providers(context, chunk))
+            except exception.ConcurrentUpdateDetected:
+                # Nothing in the chunk was written. Trying again reports
+                # the resource providers which changed as conflicts.
+                chunk_generations, chunk_conflicts, exceeded = (
+                    _set_inventories_for_providers(context, chunk))
+            generations.update(chunk_generations)
+            conflicts.update(chunk_conflicts)
+            for uuid, rclass in exceeded:
+                LOG.warning(_LW('Resource provider %(uuid)s is now over-'
+                                'capacity for %(resource)s'),
+                            {'uuid': uuid, 'resource': rclass})
+        return generations, conflicts
+
 
 @base.VersionedObjectRegistry.register
 class Allocation(_HasAResourceProvider):
@@ -1039,15 +2105,25 @@ class Allocation(_HasAResourceProvider):
         # We may be in a nested context manager so must flush so the
         # caller receives an id.
         context.session.flush()
+        _adjust_provider_usage(
+            context.session.connection(),
+            {(db_allocation.resource_provider_id,
+              db_allocation.resource_class_id): db_allocation.used})
+        _provider_changed(context, db_allocation.resource_provider_id)
         return db_allocation
 
     @staticmethod
     @db.main_context_manager.writer
     def _destroy(context, id):
-        result = context.session.query(models.Allocation).filter_by(
-            id=id).delete()
-        if not result:
+        query = context.session.query(models.Allocation).filter_by(id=id)
+        db_allocation = query.first()
+        if not db_allocation or not query.delete():
             raise exception.NotFound()
+        _adjust_provider_usage(
+            context.session.connection(),
+            {(db_allocation.resource_provider_id,
+              db_allocation.resource_class_id): -db_allocation.used})
+        _provider_changed(context, db_allocation.resource_provider_id)
 
     def create(self):
         if 'id' in self:
@@ -1062,87 +2138,107 @@ class Allocation(_HasAResourceProvider):
         self._destroy(self._context, self.id)
 
 
-def _delete_current_allocs(conn, allocs):
-    """Deletes any existing allocations that correspond to the allocations to
-    be written. This is wrapped in a transaction, so if the write subsequently
-    fails, the deletion will also be rolled back.
+# The form in which allocations travel through the allocation write
+# pipeline. resource_class_id is resolved from the resource_class string
+# once, when the allocations enter the pipeline.
+_AllocationRow = collections.namedtuple(
+    '_AllocationRow', ['resource_provider', 'consumer_id', 'resource_class',
+                       'resource_class_id', 'used'])
+
+
+def _make_allocation_rows(allocs):
+    """Returns a list of `_AllocationRow` for the supplied allocations,
+    looking up the id of each distinct resource class once.
+
+    :param allocs: Iterable of `Allocation` objects or of (resource provider,
+                   consumer id, resource class string, amount) tuples.
+    :raises `exception.ResourceClassNotFound` if any resource class cannot be
+            found in either the standard classes or the DB.
     """
+    rc_ids = {}
+    rows = []
     for alloc in allocs:
-        rp_id = alloc.resource_provider.id
-        consumer_id = alloc.consumer_id
-        del_sql = _ALLOC_TBL.delete().where(
-                sa.and_(_ALLOC_TBL.c.resource_provider_id == rp_id,
-                        _ALLOC_TBL.c.consumer_id == consumer_id))
-        conn.execute(del_sql)
-
+        if isinstance(alloc, Allocation):
+            alloc = (alloc.resource_provider, alloc.consumer_id,
+                     alloc.resource_class, alloc.used)
+        rp, consumer_id, rc_str, used = alloc
+        if rc_str not in rc_ids:
+            rc_ids[rc_str] = _RC_CACHE.id_from_string(rc_str)
+        rows.append(_AllocationRow(rp, consumer_id, rc_str, rc_ids[rc_str],
+                                   used))
+    return rows
+
+
+def _current_allocs_where(allocs):
+    """Returns the WHERE clause selecting the existing allocations of each
+    consumer in allocs against the resource providers it is allocating from.
+    """
+    rp_ids_by_consumer = collections.defaultdict(set)
+    for alloc in allocs:
+        rp_ids_by_consumer[alloc.consumer_id].add(alloc.resource_provider.id)
+    return sa.or_(*[
+        sa.and_(_ALLOC_TBL.c.consumer_id == consumer_id,
+                _ALLOC_TBL.c.resource_provider_id.in_(rp_ids))
+        for consumer_id, rp_ids in rp_ids_by_consumer.items()])
 
-def _check_capacity_exceeded(conn, allocs):
-    """Checks to see if the supplied allocation records would result in any of
-    the inventories involved having their capacity exceeded.
 
-    Raises an InvalidAllocationCapacityExceeded exception if any inventory
-    would be exhausted by the allocation. Raises an
-    InvalidAllocationConstraintsViolated exception if any of the `step_size`,
-    `min_unit` or `max_unit` constraints in an inventory will be violated
-    by any one of the allocations.
+def _delete_current_allocs(conn, allocs):
+    """Deletes any existing allocations that correspond to the allocations to
+    be written, removing their amounts from the provider usage totals. This
+    is wrapped in a transaction, so if the write subsequently fails, the
+    deletion will also be rolled back.
 
-    If no inventories would be exceeded or violated by the allocations, the
-    function returns a list of `ResourceProvider` objects that contain the
-    generation at the time of the check.
+    :returns: The set of ids of the resource providers whose usage changed.
+    """
+    current = _get_current_consumer_usage(conn, allocs)
+    if not current:
+        return set()
+    usage_deltas = collections.defaultdict(int)
+    for (_consumer_id, rp_id, rc_id), used in current.items():
+        usage_deltas[(rp_id, rc_id)] -= used
+    conn.execute(_ALLOC_TBL.delete().where(_current_allocs_where(allocs)))
+    _adjust_provider_usage(conn, usage_deltas)
+    return set(rp_id for rp_id, _rc_id in usage_deltas)
+
+
+def _get_capacity_records(conn, allocs):
+    """Returns a dict, keyed by (resource provider uuid, resource class id),
+    of the inventory and current usage records of every inventory involved
+    in the supplied allocations.
 
     :param conn: SQLalchemy Connection object to use
-    :param allocs: List of `Allocation` objects to check
+    :param allocs: List of `_AllocationRow`
     """
+    # The resource providers have already been read, by the caller, into the
+    # `ResourceProvider` objects of the allocations so we look inventories
+    # up by provider id and do not read the resource_providers table again.
     # The SQL generated below looks like this:
     # SELECT
-    #   rp.id,
-    #   rp.uuid,
-    #   rp.generation,
+    #   inv.resource_provider_id,
     #   inv.resource_class_id,
     #   inv.total,
     #   inv.reserved,
     #   inv.allocation_ratio,
-    #   allocs.used
-    # FROM resource_providers AS rp
-    # JOIN inventories AS i1
-    # ON rp.id = i1.resource_provider_id
-    # LEFT JOIN (
-    #    SELECT resource_provider_id, resource_class_id, SUM(used) AS used
-    #    FROM allocations
-    #    WHERE resource_class_id IN ($RESOURCE_CLASSES)
-    #    GROUP BY resource_provider_id, resource_class_id
-    # ) AS allocs
-    # ON inv.resource_provider_id = allocs.resource_provider_id
-    # AND inv.resource_class_id = allocs.resource_class_id
-    # WHERE rp.uuid IN ($RESOURCE_PROVIDERS)
+    #   usage.used
+    # FROM inventories AS inv
+    # LEFT JOIN provider_usages AS usage
+    # ON inv.resource_provider_id = usage.resource_provider_id
+    # AND inv.resource_class_id = usage.resource_class_id
+    # WHERE inv.resource_provider_id IN ($RESOURCE_PROVIDERS)
     # AND inv.resource_class_id IN ($RESOURCE_CLASSES)
-    #
-    # We then take the results of the above and determine if any of the
-    # inventory will have its capacity exceeded.
-    rc_ids = set([_RC_CACHE.id_from_string(a.resource_class)
-                       for a in allocs])
-    provider_uuids = set([a.resource_provider.uuid for a in allocs])
+    rc_ids = set([a.resource_class_id for a in allocs])
+    provider_uuids = dict((a.resource_provider.id, a.resource_provider.uuid)
+                          for a in allocs)
 
-    usage = sa.select([_ALLOC_TBL.c.resource_provider_id,
-                       _ALLOC_TBL.c.resource_class_id,
-                       sql.func.sum(_ALLOC_TBL.c.used).label('used')])
-    usage = usage.where(_ALLOC_TBL.c.resource_class_id.in_(rc_ids))
-    usage = usage.group_by(_ALLOC_TBL.c.resource_provider_id,
-                           _ALLOC_TBL.c.resource_class_id)
-    usage = sa.alias(usage, name='usage')
-
-    inv_join = sql.join(_RP_TBL, _INV_TBL,
-            sql.and_(_RP_TBL.c.id == _INV_TBL.c.resource_provider_id,
-                     _INV_TBL.c.resource_class_id.in_(rc_ids)))
-    primary_join = sql.outerjoin(inv_join, usage,
+    usage = sa.alias(_USAGE_TBL, name='usage')
+
+    primary_join = sql.outerjoin(_INV_TBL, usage,
         sql.and_(
             _INV_TBL.c.resource_provider_id == usage.c.resource_provider_id,
             _INV_TBL.c.resource_class_id == usage.c.resource_class_id)
     )
     cols_in_output = [
-        _RP_TBL.c.id.label('resource_provider_id'),
-        _RP_TBL.c.uuid,
-        _RP_TBL.c.generation,
+        _INV_TBL.c.resource_provider_id,
         _INV_TBL.c.resource_class_id,
         _INV_TBL.c.total,
         _INV_TBL.c.reserved,
@@ -1155,21 +2251,97 @@ def _check_capacity_exceeded(conn, allocs):
 
     sel = sa.select(cols_in_output).select_from(primary_join)
     sel = sel.where(
-            sa.and_(_RP_TBL.c.uuid.in_(provider_uuids),
+            sa.and_(_INV_TBL.c.resource_provider_id.in_(provider_uuids),
                     _INV_TBL.c.resource_class_id.in_(rc_ids)))
     records = conn.execute(sel)
     # Create a map keyed by (rp_uuid, res_class) for the records in the DB
     usage_map = {}
-    provs_with_inv = set()
     for record in records:
+        record = dict(record)
+        record['uuid'] = provider_uuids[record['resource_provider_id']]
         map_key = (record['uuid'], record['resource_class_id'])
         if map_key in usage_map:
             raise KeyError("%s already in usage_map, bad query" % str(map_key))
         usage_map[map_key] = record
-        provs_with_inv.add(record["uuid"])
+    return usage_map
+
+
+def _check_allocation_constraints(alloc, record):
+    """Raises InvalidAllocationConstraintsViolated if the amount of the
+    supplied allocation does not respect the `min_unit`, `max_unit` and
+    `step_size` of the inventory record.
+    """
+    amount_needed = alloc.used
+    min_unit = record['min_unit']
+    max_unit = record['max_unit']
+    step_size = record['step_size']
+    if (amount_needed < min_unit or amount_needed > max_unit or
+            amount_needed % step_size != 0):
+        LOG.warning(
+            _LW("Allocation for %(rc)s on resource provider %(rp)s "
+                "violates min_unit, max_unit, or step_size. "
+                "Requested: %(requested)s, min_unit: %(min_unit)s, "
+                "max_unit: %(max_unit)s, step_size: %(step_size)s"),
+            {'rc': alloc.resource_class,
+             'rp': record['uuid'],
+             'requested': amount_needed,
+             'min_unit': min_unit,
+             'max_unit': max_unit,
+             'step_size': step_size})
+        raise exception.InvalidAllocationConstraintsViolated(
+            resource_class=alloc.resource_class,
+            resource_provider=record['uuid'])
+
+
+def _check_capacity(record, used, amount_needed):
+    """Raises InvalidAllocationCapacityExceeded if amount_needed more of the
+    resource described by the inventory record cannot be allocated on top of
+    the used amount.
+    """
+    rc_str = _RC_CACHE.string_from_id(record['resource_class_id'])
+    capacity = (record['total'] - record['reserved']) * (
+        record['allocation_ratio'])
+    if capacity < (used + amount_needed):
+        LOG.warning(
+            _LW("Over capacity for %(rc)s on resource provider %(rp)s. "
+                "Needed: %(needed)s, Used: %(used)s, Capacity: %(cap)s"),
+            {'rc': rc_str,
+             'rp': record['uuid'],
+             'needed': amount_needed,
+             'used': used,
+             'cap': capacity})
+        raise exception.InvalidAllocationCapacityExceeded(
+            resource_class=rc_str,
+            resource_provider=record['uuid'])
+
+
+def _check_capacity_exceeded(conn, allocs):
+    """Checks to see if the supplied allocation records would result in any of
+    the inventories involved having their capacity exceeded.
+
+    Raises an InvalidAllocationCapacityExceeded exception if any inventory
+    would be exhausted by the allocation. Raises an
+    InvalidAllocationConstraintsViolated exception if any of the `step_size`,
+    `min_unit` or `max_unit` constraints in an inventory will be violated
+    by any one of the allocations.
+
+    The amounts of allocations, possibly for different consumers, against the
+    same inventory are added together before being compared to its capacity.
+
+    If no inventories would be exceeded or violated by the allocations, the
+    function returns a list of `ResourceProvider` objects that contain the
+    generation at the time of the check.
+
+    :param conn: SQLalchemy Connection object to use
+    :param allocs: List of `_AllocationRow` to check
+    """
+    usage_map = _get_capacity_records(conn, allocs)
     # Ensure that all providers have existing inventory
+    provider_uuids = set([a.resource_provider.uuid for a in allocs])
+    provs_with_inv = set([rp_uuid for rp_uuid, _rc_id in usage_map])
     missing_provs = provider_uuids - provs_with_inv
     if missing_provs:
+        rc_ids = set([a.resource_class_id for a in allocs])
         class_str = ', '.join([_RC_CACHE.string_from_id(rc_id)
                                for rc_id in rc_ids])
         provider_str = ', '.join(missing_provs)
@@ -1177,55 +2349,97 @@ def _check_capacity_exceeded(conn, allocs):
                 resource_provider=provider_str)
 
     res_providers = {}
+    amounts_needed = collections.defaultdict(int)
     for alloc in allocs:
-        rc_id = _RC_CACHE.id_from_string(alloc.resource_class)
         rp_uuid = alloc.resource_provider.uuid
-        key = (rp_uuid, rc_id)
-        usage = usage_map[key]
-        amount_needed = alloc.used
-        allocation_ratio = usage['allocation_ratio']
-        min_unit = usage['min_unit']
-        max_unit = usage['max_unit']
-        step_size = usage['step_size']
-
-        # check min_unit, max_unit, step_size
-        if (amount_needed < min_unit or amount_needed > max_unit or
-                amount_needed % step_size != 0):
-            LOG.warning(
-                _LW("Allocation for %(rc)s on resource provider %(rp)s "
-                    "violates min_unit, max_unit, or step_size. "
-                    "Requested: %(requested)s, min_unit: %(min_unit)s, "
-                    "max_unit: %(max_unit)s, step_size: %(step_size)s"),
-                {'rc': alloc.resource_class,
-                 'rp': rp_uuid,
-                 'requested': amount_needed,
-                 'min_unit': min_unit,
-                 'max_unit': max_unit,
-                 'step_size': step_size})
-            raise exception.InvalidAllocationConstraintsViolated(
-                resource_class=alloc.resource_class,
-                resource_provider=rp_uuid)
-
-        # usage["used"] can be returned as None
-        used = usage['used'] or 0
-        capacity = (usage['total'] - usage['reserved']) * allocation_ratio
-        if capacity < (used + amount_needed):
-            LOG.warning(
-                _LW("Over capacity for %(rc)s on resource provider %(rp)s. "
-                    "Needed: %(needed)s, Used: %(used)s, Capacity: %(cap)s"),
-                {'rc': alloc.resource_class,
-                 'rp': rp_uuid,
-                 'needed': amount_needed,
-                 'used': used,
-                 'cap': capacity})
-            raise exception.InvalidAllocationCapacityExceeded(
-                resource_class=alloc.resource_class,
-                resource_provider=rp_uuid)
+        key = (rp_uuid, alloc.resource_class_id)
+        _check_allocation_constraints(alloc, usage_map[key])
+        amounts_needed[key] += alloc.used
         if rp_uuid not in res_providers:
             res_providers[rp_uuid] = alloc.resource_provider
+
+    for key, amount_needed in amounts_needed.items():
+        record = usage_map[key]
+        # record["used"] can be returned as None
+        _check_capacity(record, record['used'] or 0, amount_needed)
     return list(res_providers.values())
 
 
+def _get_current_consumer_usage(conn, allocs):
+    """Returns a dict, keyed by (consumer id, resource provider id, resource
+    class id), of the amounts currently allocated to the consumers of allocs
+    against the resource providers they are allocating from.
+    """
+    sel = sa.select([_ALLOC_TBL.c.consumer_id,
+                     _ALLOC_TBL.c.resource_provider_id,
+                     _ALLOC_TBL.c.resource_class_id,
+                     _ALLOC_TBL.c.used])
+    sel = sel.where(_current_allocs_where(allocs))
+    current = collections.defaultdict(int)
+    for row in conn.execute(sel):
+        key = (row['consumer_id'], row['resource_provider_id'],
+               row['resource_class_id'])
+        current[key] += row['used']
+    return current
+
+
+def _select_allocations_by_consumer(conn, allocs):
+    """Decides, one consumer at a time and in the order in which they first
+    appear in allocs, whether the allocations of each consumer can be made
+    given the allocations of the consumers accepted before it.
+
+    Each consumer's allocations replace its existing allocations against the
+    same resource providers, as they do when written.
+
+    :param conn: SQLalchemy Connection object to use
+    :param allocs: List of `_AllocationRow` to check
+    :returns: A tuple of the list of `_AllocationRow` of the accepted
+              consumers and a dict, keyed by consumer id, of the exception
+              explaining why each other consumer was refused.
+    """
+    usage_map = _get_capacity_records(conn, allocs)
+    used = dict((key, record['used'] or 0)
+                for key, record in usage_map.items())
+    current = _get_current_consumer_usage(conn, allocs)
+    rp_uuids = dict((a.resource_provider.id, a.resource_provider.uuid)
+                    for a in allocs)
+
+    by_consumer = collections.OrderedDict()
+    for alloc in allocs:
+        by_consumer.setdefault(alloc.consumer_id, []).append(alloc)
+
+    accepted = []
+    failures = {}
+    for consumer_id, consumer_allocs in by_consumer.items():
+        consumer_rp_ids = set(a.resource_provider.id for a in consumer_allocs)
+        deltas = collections.defaultdict(int)
+        for (c_id, rp_id, rc_id), amount in current.items():
+            if c_id == consumer_id and rp_id in consumer_rp_ids:
+                deltas[(rp_uuids[rp_id], rc_id)] -= amount
+        needed_keys = set()
+        try:
+            for alloc in consumer_allocs:
+                rp_uuid = alloc.resource_provider.uuid
+                key = (rp_uuid, alloc.resource_class_id)
+                if key not in usage_map:
+                    raise exception.InvalidInventory(
+                        resource_class=alloc.resource_class,
+                        resource_provider=rp_uuid)
+                _check_allocation_constraints(alloc, usage_map[key])
+                deltas[key] += alloc.used
+                needed_keys.add(key)
+            for key in needed_keys:
+                _check_capacity(usage_map[key], used[key], deltas[key])
+        except exception.InvalidInventory as exc:
+            failures[consumer_id] = exc
+            continue
+        for key, delta in deltas.items():
+            if key in used:
+                used[key] += delta
+        accepted.extend(consumer_allocs)
+    return accepted, failures
+
+
 @base.VersionedObjectRegistry.register
 class AllocationList(base.ObjectListBase, base.VersionedObject):
     # Version 1.0: Initial Version
@@ -1247,7 +2461,7 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
     @staticmethod
     @db.main_context_manager.reader
     def _get_allocations_from_db(context, resource_provider_uuid=None,
-                                 consumer_id=None):
+                                 consumer_id=None, limit=None, marker=None):
         query = (context.session.query(models.Allocation)
                  .join(models.Allocation.resource_provider)
                  .options(contains_eager('resource_provider')))
@@ -1257,28 +2471,146 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
         if consumer_id:
             query = query.filter(
                 models.Allocation.consumer_id == consumer_id)
-        return query.all()
+        if limit is None and marker is None:
+            return query.all()
+
+        rp_id = sa.select([_RP_TBL.c.id]).where(
+            _RP_TBL.c.uuid == resource_provider_uuid).as_scalar()
+        consumer_ids = [consumer_id for consumer_id, _key in
+                        AllocationList._get_consumers_from_db(
+                            context, rp_id, limit, marker)]
+        if not consumer_ids:
+            return []
+        query = query.filter(models.Allocation.consumer_id.in_(consumer_ids))
+        return query.order_by(models.Allocation.id).all()
 
     @staticmethod
-    @db.main_context_manager.writer
-    def _set_allocations(context, allocs):
+    @db.main_context_manager.reader
+    def _get_consumers_from_db(context, rp_id, limit, marker):
+        # Pages are made of whole consumers, each keyed by the lowest id
+        # of its allocations against the resource provider:
+        # SELECT consumer_id, MIN(id) AS first_id
+        # FROM allocations
+        # WHERE resource_provider_id = $RP_ID
+        # GROUP BY consumer_id
+        # HAVING MIN(id) > $MARKER
+        # ORDER BY first_id
+        # LIMIT $LIMIT
+        first_id = func.min(_ALLOC_TBL.c.id).label('first_id')
+        consumers = sa.select([_ALLOC_TBL.c.consumer_id, first_id])
+        consumers = consumers.where(
+            _ALLOC_TBL.c.resource_provider_id == rp_id)
+        consumers = consumers.group_by(_ALLOC_TBL.c.consumer_id)
+        if marker is not None:
+            consumers = consumers.having(first_id > marker)
+        consumers = consumers.order_by(first_id)
+        if limit is not None:
+            consumers = consumers.limit(limit)
+        return [(row['consumer_id'], row['first_id']) for row in
+                context.session.connection().execute(consumers)]
+
+    @staticmethod
+    def _iter_by_resource_provider_from_db(context, rp_id, consumer_ids):
+        with db.main_context_manager.reader.using(context):
+            query = context.session.query(
+                models.Allocation.consumer_id,
+                models.Allocation.resource_class_id,
+                models.Allocation.used)
+            query = query.filter(
+                models.Allocation.resource_provider_id == rp_id)
+            if consumer_ids is not None:
+                query = query.filter(
+                    models.Allocation.consumer_id.in_(consumer_ids))
+            query = query.order_by(models.Allocation.consumer_id,
+                                   models.Allocation.id)
+            for consumer_id, rc_id, used in query.yield_per(
+                    CONF.placement.stream_batch_size):
+                yield consumer_id, _RC_CACHE.string_from_id(rc_id), used
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _refresh_generations(context, rps):
+        """Reload the generations of the supplied `ResourceProvider`
+        objects.
+        """
+        rps_by_id = dict((rp.id, rp) for rp in rps)
+        sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.generation]).where(
+            _RP_TBL.c.id.in_(rps_by_id))
+        for rp_id, generation in context.session.connection().execute(sel):
+            rps_by_id[rp_id].generation = generation
+            rps_by_id[rp_id].obj_reset_changes(['generation'])
+
+    @classmethod
+    def _set_allocations(cls, context, allocs, partial=False):
         """Write a set of allocations.
 
         We must check that there is capacity for each allocation.
-        If there is not we roll back the entire set.
-
+        If there is not we roll back the entire set, unless partial is True,
+        in which case only the allocations of those consumers which cannot
+        be satisfied are left out.
+
+        If the generation of a resource provider changes while the
+        allocations are being written the whole write, including the
+        capacity check, is tried again after a short random delay, up to
+        [placement]/allocation_write_retries times.
+
+        :param allocs: Iterable of `Allocation` objects or of (resource
+                       provider, consumer id, resource class string, amount)
+                       tuples.
+        :returns: A dict, keyed by consumer id, of the exceptions explaining
+                  why the allocations of each consumer left out were refused.
         :raises `exception.ResourceClassNotFound` if any resource class in any
                 allocation in allocs cannot be found in either the standard
                 classes or the DB.
+        :raises `exception.ConcurrentUpdateDetected` if the generation of a
+                resource provider changed during every attempt.
         """
         _ensure_rc_cache(context)
-        conn = context.session.connection()
 
         # Short-circuit out if there are any allocations with string
         # resource class names that don't exist this will raise a
         # ResourceClassNotFound exception.
-        for alloc in allocs:
-            _RC_CACHE.id_from_string(alloc.resource_class)
+        allocs = _make_allocation_rows(allocs)
+        if not allocs:
+            return {}
+
+        max_retries = CONF.placement.allocation_write_retries
+        attempt = 0
+        while True:
+            try:
+                return cls._write_allocations(context, allocs, partial)
+            except exception.ConcurrentUpdateDetected:
+                if attempt >= max_retries:
+                    _count_allocation_retry('exhausted')
+                    if max_retries:
+                        LOG.warning(_LW("Giving up writing allocations "
+                                        "after %(attempts)d attempts because "
+                                        "of concurrent updates"),
+                                    {'attempts': attempt + 1})
+                    raise
+            attempt += 1
+            _count_allocation_retry('retries')
+            # Exponential backoff with full jitter so that writers which
+            # collided do not collide again.
+            delay = random.uniform(
+                0, CONF.placement.allocation_write_retry_interval *
+                2 ** (attempt - 1))
+            LOG.debug("Concurrent update while writing allocations, "
+                      "retrying in %(delay).3f seconds (attempt %(attempt)d "
+                      "of %(max)d)",
+                      {'delay': delay, 'attempt': attempt,
+                       'max': max_retries})
+            time.sleep(delay)
+            cls._refresh_generations(
+                context, set(alloc.resource_provider for alloc in allocs))
+
+    @staticmethod
+    @db.main_context_manager.writer
+    def _write_allocations(context, allocs, partial):
+        """Write a list of `_AllocationRow` in a single transaction, as
+        described in `_set_allocations`.
+        """
+        conn = context.session.connection()
 
         # Before writing any allocation records, we check that the submitted
         # allocations do not cause any inventory capacity to be exceeded for
@@ -1289,36 +2621,101 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
         # generation of the resource provider at the time of the check. These
         # objects are used at the end of the allocation transaction as a guard
         # against concurrent updates.
+        failures = {}
         with conn.begin():
+            if partial:
+                allocs, failures = _select_allocations_by_consumer(conn,
+                                                                   allocs)
+                if not allocs:
+                    return failures
             # First delete any existing allocations for that rp/consumer combo.
-            _delete_current_allocs(conn, allocs)
+            changed = _delete_current_allocs(conn, allocs)
             before_gens = _check_capacity_exceeded(conn, allocs)
-            # Now add the allocations that were passed in.
+            # Now add the allocations that were passed in, all with one
+            # executemany.
+            usage_deltas = collections.defaultdict(int)
+            values = []
             for alloc in allocs:
-                rp = alloc.resource_provider
-                rc_id = _RC_CACHE.id_from_string(alloc.resource_class)
-                ins_stmt = _ALLOC_TBL.insert().values(
-                        resource_provider_id=rp.id,
-                        resource_class_id=rc_id,
-                        consumer_id=alloc.consumer_id,
-                        used=alloc.used)
-                conn.execute(ins_stmt)
+                rp_id = alloc.resource_provider.id
+                values.append({
+                    'resource_provider_id': rp_id,
+                    'resource_class_id': alloc.resource_class_id,
+                    'consumer_id': alloc.consumer_id,
+                    'used': alloc.used,
+                })
+                usage_deltas[(rp_id, alloc.resource_class_id)] += alloc.used
+            conn.execute(_ALLOC_TBL.insert(), values)
+            _adjust_provider_usage(conn, usage_deltas)
 
             # Generation checking happens here. If the inventory for
             # this resource provider changed out from under us,
-            # this will raise a ConcurrentUpdateDetected which can be caught
-            # by the caller to choose to try again. It will also rollback the
+            # this will raise a ConcurrentUpdateDetected which is caught
+            # by _set_allocations to try again. It will also rollback the
             # transaction so that these changes always happen atomically.
             for rp in before_gens:
                 rp.generation = _increment_provider_generation(conn, rp)
+                changed.add(rp.id)
+            for rp_id in changed:
+                _provider_changed(context, rp_id)
+        return failures
 
     @classmethod
-    def get_all_by_resource_provider_uuid(cls, context, rp_uuid):
+    def get_all_by_resource_provider_uuid(cls, context, rp_uuid, limit=None,
+                                          marker=None):
+        """Returns the allocations against a resource provider.
+
+        :param limit: If not None, only return the allocations of at most this
+                      many consumers.
+        :param marker: If not None, only return the allocations of consumers
+                       whose first allocation against the resource provider
+                       has an id greater than this one.
+
+        When limit or marker is given consumers are ordered by the id of
+        their first allocation against the resource provider.
+        """
         db_allocation_list = cls._get_allocations_from_db(
-            context, resource_provider_uuid=rp_uuid)
+            context, resource_provider_uuid=rp_uuid, limit=limit,
+            marker=marker)
         return base.obj_make_list(
             context, cls(context), Allocation, db_allocation_list)
 
+    @classmethod
+    def get_consumers_by_resource_provider(cls, context, resource_provider,
+                                           limit=None, marker=None):
+        """Returns a list of (consumer id, key) pairs for the consumers with
+        allocations against a resource provider, ordered by key: the id of the
+        first allocation of the consumer against the resource provider.
+
+        :param resource_provider: `ResourceProvider` the allocations are
+                                  against.
+        :param limit: If not None, return at most this many consumers.
+        :param marker: If not None, only return consumers with a key greater
+                       than this one.
+        """
+        return cls._get_consumers_from_db(
+            context, resource_provider.id, limit, marker)
+
+    @classmethod
+    def iter_by_resource_provider(cls, context, resource_provider,
+                                  consumer_ids=None):
+        """Returns an iterator of (consumer id, resource class string, amount)
+        tuples for the allocations against a resource provider, without
+        building `Allocation` objects. The allocations of each consumer are
+        consecutive.
+
+        Allocations are read from the database in batches of
+        [placement]/stream_batch_size rows, in a transaction which stays open
+        until the iterator is exhausted or closed.
+
+        :param resource_provider: `ResourceProvider` the allocations are
+                                  against.
+        :param consumer_ids: If not None, only return the allocations of these
+                             consumers.
+        """
+        _ensure_rc_cache(context)
+        return cls._iter_by_resource_provider_from_db(
+            context, resource_provider.id, consumer_ids)
+
     @classmethod
     def get_all_by_consumer_id(cls, context, consumer_id):
         db_allocation_list = cls._get_allocations_from_db(
@@ -1326,11 +2723,33 @@ class AllocationList(base.ObjectListBase, base.VersionedObject):
         return base.obj_make_list(
             context, cls(context), Allocation, db_allocation_list)
 
-    def create_all(self):
-        """Create the supplied allocations."""
-        # TODO(jaypipes): Retry the allocation writes on
-        # ConcurrentUpdateDetected
-        self._set_allocations(self._context, self.objects)
+    def create_all(self, partial=False):
+        """Create the supplied allocations.
+
+        The allocations may be for several consumers. They are written in a
+        single transaction which increments the generation of each resource
+        provider involved once.
+
+        :param partial: If True, write the allocations of those consumers
+                        which can be satisfied instead of failing the whole
+                        set when any one of them cannot.
+        :returns: A dict, keyed by consumer id, of the exceptions explaining
+                  why the allocations of consumers were refused. Always empty
+                  unless partial is True.
+        """
+        return self._set_allocations(self._context, self.objects,
+                                     partial=partial)
+
+    @classmethod
+    def create_all_from_tuples(cls, context, allocs, partial=False):
+        """Create allocations without building `Allocation` objects for them.
+
+        Behaves as `create_all` but takes the allocations as an iterable of
+        (resource provider, consumer id, resource class string, amount)
+        tuples, which is much cheaper for callers that only need the
+        allocations written.
+        """
+        return cls._set_allocations(context, allocs, partial=partial)
 
     def delete_all(self):
         self._delete_allocations(self._context, self.objects)
@@ -1387,31 +2806,199 @@ class UsageList(base.ObjectListBase, base.VersionedObject):
     @db.main_context_manager.reader
     def _get_all_by_resource_provider_uuid(context, rp_uuid):
         query = (context.session.query(models.Inventory.resource_class_id,
-                 func.coalesce(func.sum(models.Allocation.used), 0))
+                 func.coalesce(models.ProviderUsage.used, 0))
                  .join(models.ResourceProvider,
                        models.Inventory.resource_provider_id ==
                        models.ResourceProvider.id)
-                 .outerjoin(models.Allocation,
+                 .outerjoin(models.ProviderUsage,
                             sql.and_(models.Inventory.resource_provider_id ==
-                                     models.Allocation.resource_provider_id,
+                                     models.ProviderUsage.resource_provider_id,
                                      models.Inventory.resource_class_id ==
-                                     models.Allocation.resource_class_id))
-                 .filter(models.ResourceProvider.uuid == rp_uuid)
-                 .group_by(models.Inventory.resource_class_id))
+                                     models.ProviderUsage.resource_class_id))
+                 .filter(models.ResourceProvider.uuid == rp_uuid))
         result = [dict(resource_class_id=item[0], usage=item[1])
                   for item in query.all()]
         return result
 
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_version_by_resource_provider_uuid(context, rp_uuid):
+        join = sa.outerjoin(
+            _RP_TBL, _USAGE_TBL,
+            _RP_TBL.c.id == _USAGE_TBL.c.resource_provider_id)
+        sel = sa.select([_RP_TBL.c.id, _RP_TBL.c.generation,
+                         func.coalesce(func.sum(_USAGE_TBL.c.used), 0)])
+        sel = sel.select_from(join).where(_RP_TBL.c.uuid == rp_uuid)
+        sel = sel.group_by(_RP_TBL.c.id, _RP_TBL.c.generation)
+        row = context.session.connection().execute(sel).fetchone()
+        if row is None:
+            raise exception.NotFound(
+                'No resource provider with uuid %s found' % rp_uuid)
+        return row[0], row[1], int(row[2])
+
+    @classmethod
+    def get_version_by_resource_provider_uuid(cls, context, rp_uuid):
+        """Return a (resource provider id, generation, total used) tuple
+        which changes whenever the usages of the resource provider with
+        rp_uuid change.
+
+        Writing allocations increments the generation of the resource
+        provider but deleting them does not. Deleting allocations always
+        reduces the total used, though, so together the two identify the
+        usages without having to load them. The id distinguishes a
+        resource provider from an earlier one with the same uuid.
+        """
+        return cls._get_version_by_resource_provider_uuid(context, rp_uuid)
+
     @classmethod
     def get_all_by_resource_provider_uuid(cls, context, rp_uuid):
         usage_list = cls._get_all_by_resource_provider_uuid(context, rp_uuid)
         return base.obj_make_list(context, cls(context), Usage, usage_list)
 
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_by_resource_provider_id(context, rp_id):
+        query = (context.session.query(models.Inventory.resource_class_id,
+                 func.coalesce(models.ProviderUsage.used, 0))
+                 .outerjoin(models.ProviderUsage,
+                            sql.and_(models.Inventory.resource_provider_id ==
+                                     models.ProviderUsage.resource_provider_id,
+                                     models.Inventory.resource_class_id ==
+                                     models.ProviderUsage.resource_class_id))
+                 .filter(models.Inventory.resource_provider_id == rp_id))
+        return [dict(resource_class_id=item[0], usage=item[1])
+                for item in query.all()]
+
+    @classmethod
+    def get_all_by_resource_provider_id(cls, context, rp_id):
+        """Returns the usages of the resource provider with id rp_id,
+        without joining to the resource_providers table.
+        """
+        usage_list = cls._get_all_by_resource_provider_id(context, rp_id)
+        return base.obj_make_list(context, cls(context), Usage, usage_list)
+
     def __repr__(self):
         strings = [repr(x) for x in self.objects]
         return "UsageList[" + ", ".join(strings) + "]"
 
 
+@base.VersionedObjectRegistry.register
+class Capacity(base.VersionedObject):
+    # Version 1.0: Initial version
+    VERSION = '1.0'
+
+    fields = {
+        'resource_class': ResourceClassField(read_only=True),
+        'total': fields.NonNegativeIntegerField(),
+        'reserved': fields.NonNegativeIntegerField(),
+        'capacity': fields.NonNegativeIntegerField(),
+        'used': fields.NonNegativeIntegerField(),
+    }
+
+    @property
+    def free(self):
+        """The capacity not yet used, negative when more is used than
+        there is capacity for.
+        """
+        return self.capacity - self.used
+
+    @staticmethod
+    def _from_db_object(context, target, source):
+        for field in target.fields:
+            if field != 'resource_class':
+                setattr(target, field, int(source[field]))
+
+        if 'resource_class' not in target:
+            rc_str = _RC_CACHE.string_from_id(source['resource_class_id'])
+            target.resource_class = rc_str
+
+        target._context = context
+        target.obj_reset_changes()
+        return target
+
+
+@base.VersionedObjectRegistry.register
+class CapacityList(base.ObjectListBase, base.VersionedObject):
+    # Version 1.0: Initial version
+    VERSION = '1.0'
+
+    fields = {
+        'objects': fields.ListOfObjectsField('Capacity'),
+    }
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_from_db(context, member_of, rc_ids):
+        join = sa.outerjoin(
+            _INV_TBL, _USAGE_TBL,
+            sa.and_(_INV_TBL.c.resource_provider_id ==
+                    _USAGE_TBL.c.resource_provider_id,
+                    _INV_TBL.c.resource_class_id ==
+                    _USAGE_TBL.c.resource_class_id))
+        sel = sa.select([
+            _INV_TBL.c.resource_class_id,
+            func.sum(_INV_TBL.c.total).label('total'),
+            func.sum(_INV_TBL.c.reserved).label('reserved'),
+            func.sum((_INV_TBL.c.total - _INV_TBL.c.reserved) *
+                     _INV_TBL.c.allocation_ratio).label('capacity'),
+            func.sum(func.coalesce(_USAGE_TBL.c.used, 0)).label('used'),
+        ]).select_from(join)
+        if member_of:
+            agg_join = sa.join(
+                _RP_AGG_TBL, _AGG_TBL,
+                _RP_AGG_TBL.c.aggregate_id == _AGG_TBL.c.id)
+            members = sa.select(
+                [_RP_AGG_TBL.c.resource_provider_id]).select_from(
+                    agg_join).where(_AGG_TBL.c.uuid.in_(member_of))
+            sel = sel.where(_INV_TBL.c.resource_provider_id.in_(members))
+        if rc_ids:
+            sel = sel.where(_INV_TBL.c.resource_class_id.in_(rc_ids))
+        sel = sel.group_by(_INV_TBL.c.resource_class_id)
+        sel = sel.order_by(_INV_TBL.c.resource_class_id)
+        return context.session.connection().execute(sel).fetchall()
+
+    @classmethod
+    def get_all(cls, context, member_of=None, resource_classes=None):
+        """Returns the total, reserved, capacity and used amounts of each
+        resource class, summed across every resource provider.
+
+        The summary is computed with one grouped query and kept by this
+        worker for up to [placement]/capacity_cache_ttl seconds, or until
+        this worker next changes a resource provider.
+
+        :param member_of: If not empty, only count the resource providers
+                          associated with any of these aggregate uuids.
+        :param resource_classes: If not empty, only summarize these resource
+                                 classes.
+        :raises `exception.ResourceClassNotFound` if any of resource_classes
+                cannot be found in either the standard classes or the DB.
+        """
+        _ensure_rc_cache(context)
+        rc_ids = sorted(set(_RC_CACHE.id_from_string(rc_name)
+                            for rc_name in resource_classes or []))
+        key = (tuple(sorted(set(member_of or []))), tuple(rc_ids))
+        ttl = CONF.placement.capacity_cache_ttl
+        now = time.time()
+        write_count = capacity_index.write_count()
+        cached = _CAPACITY_CACHE.get(key)
+        if (cached is not None and cached[0] > now and
+                cached[1] == write_count):
+            return cached[2]
+
+        capacities = cls._get_all_from_db(context, key[0], rc_ids)
+        cap_list = base.obj_make_list(context, cls(context), Capacity,
+                                      capacities)
+        if ttl:
+            if len(_CAPACITY_CACHE) >= _CAPACITY_CACHE_SIZE:
+                _CAPACITY_CACHE.clear()
+            _CAPACITY_CACHE[key] = (now + ttl, write_count, cap_list)
+        return cap_list
+
+    def __repr__(self):
+        strings = [repr(x) for x in self.objects]
+        return "CapacityList[" + ", ".join(strings) + "]"
+
+
 @base.VersionedObjectRegistry.register
 class ResourceClassObject(base.VersionedObject):
     # Version 1.0: Initial version
@@ -1498,6 +3085,9 @@ class ResourceClassObject(base.VersionedObject):
             try:
                 rc = self._create_in_db(self._context, updates)
                 self._from_db_object(self._context, self, rc)
+                # Forget that the new resource class did not exist.
+                _ensure_rc_cache(self._context)
+                _RC_CACHE.clear()
                 break
             except db_exc.DBDuplicateEntry as e:
                 if 'id' in e.columns:
@@ -1525,6 +3115,8 @@ class ResourceClassObject(base.VersionedObject):
         rc.update(updates)
         rc.id = next_id
         context.session.add(rc)
+        context.session.flush()
+        _bump_catalog_version(context.session.connection(), _RC_CATALOG)
         return rc
 
     def destroy(self):
@@ -1555,6 +3147,7 @@ class ResourceClassObject(base.VersionedObject):
                 models.ResourceClass.id == _id).delete()
         if not res:
             raise exception.NotFound()
+        _bump_catalog_version(context.session.connection(), _RC_CATALOG)
 
     def save(self):
         if 'id' not in self:
@@ -1580,6 +3173,7 @@ class ResourceClassObject(base.VersionedObject):
             db_rc.save(context.session)
         except db_exc.DBDuplicateEntry:
             raise exception.ResourceClassExists(resource_class=name)
+        _bump_catalog_version(context.session.connection(), _RC_CATALOG)
 
 
 @base.VersionedObjectRegistry.register
@@ -1605,6 +3199,194 @@ class ResourceClassList(base.ObjectListBase, base.VersionedObject):
         return base.obj_make_list(context, cls(context),
                                   ResourceClassObject, resource_classes)
 
+    @staticmethod
+    def _iter_all_from_db(context):
+        with db.main_context_manager.reader.using(context):
+            query = context.session.query(models.ResourceClass).order_by(
+                models.ResourceClass.id)
+            for db_rc in query.yield_per(CONF.placement.stream_batch_size):
+                yield db_rc
+
+    @classmethod
+    def iter_all(cls, context):
+        """Returns an iterator over the `ResourceClassObject` objects which
+        `get_all` would return, reading custom resource classes from the
+        database in batches of [placement]/stream_batch_size rows.
+        """
+        _ensure_rc_cache(context)
+        resource_classes = itertools.chain(_RC_CACHE.STANDARDS,
+                                           cls._iter_all_from_db(context))
+        return (ResourceClassObject._from_db_object(
+                    context, ResourceClassObject(), rc)
+                for rc in resource_classes)
+
     def __repr__(self):
         strings = [repr(x) for x in self.objects]
         return "ResourceClassList[" + ", ".join(strings) + "]"
+
+
+@base.VersionedObjectRegistry.register
+class Trait(base.VersionedObject):
+    # Version 1.0: Initial version
+    VERSION = '1.0'
+
+    CUSTOM_NAMESPACE = 'CUSTOM_'
+    """All non-standard traits must begin with this string."""
+
+    fields = {
+        'id': fields.IntegerField(read_only=True),
+        'name': fields.StringField(nullable=False),
+    }
+
+    @staticmethod
+    def _from_db_object(context, trait, db_trait):
+        for key in trait.fields:
+            setattr(trait, key, db_trait[key])
+        trait._context = context
+        trait.obj_reset_changes()
+        return trait
+
+    @staticmethod
+    @db.main_context_manager.writer
+    def _create_in_db(context, updates):
+        trait = models.Trait()
+        trait.update(updates)
+        context.session.add(trait)
+        try:
+            context.session.flush()
+        except db_exc.DBDuplicateEntry:
+            raise exception.TraitExists(name=updates['name'])
+        _bump_catalog_version(context.session.connection(), _TRAIT_CATALOG)
+        return trait
+
+    def create(self):
+        if 'id' in self:
+            raise exception.ObjectActionError(action='create',
+                                              reason='already created')
+        if 'name' not in self:
+            raise exception.ObjectActionError(action='create',
+                                              reason='name is required')
+
+        _ensure_trait_cache(self._context)
+        updates = self.obj_get_changes()
+        db_trait = self._create_in_db(self._context, updates)
+        self._from_db_object(self._context, self, db_trait)
+        # Forget that the new trait did not exist.
+        _TRAIT_CACHE.clear()
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_by_name_from_db(context, name):
+        result = context.session.query(models.Trait).filter_by(
+            name=name).first()
+        if not result:
+            raise exception.TraitNotFound(names=[name])
+        return result
+
+    @classmethod
+    def get_by_name(cls, context, name):
+        """Return the Trait with the given name.
+
+        :raises: TraitNotFound if there is no such trait.
+        """
+        _ensure_trait_cache(context)
+        db_trait = cls._get_by_name_from_db(context, six.text_type(name))
+        return cls._from_db_object(context, cls(), db_trait)
+
+    @staticmethod
+    @db.main_context_manager.writer
+    def _destroy_in_db(context, _id, name):
+        num = context.session.query(models.ResourceProviderTrait).filter(
+            models.ResourceProviderTrait.trait_id == _id).count()
+        if num:
+            raise exception.TraitInUse(name=name)
+
+        res = context.session.query(models.Trait).filter_by(
+            name=name).delete()
+        if not res:
+            raise exception.TraitNotFound(names=[name])
+        _bump_catalog_version(context.session.connection(), _TRAIT_CATALOG)
+
+    def destroy(self):
+        if 'name' not in self:
+            raise exception.ObjectActionError(action='destroy',
+                                              reason='name is required')
+
+        if not self.name.startswith(self.CUSTOM_NAMESPACE):
+            raise exception.TraitCannotDeleteStandard(name=self.name)
+
+        if 'id' not in self:
+            raise exception.ObjectActionError(action='destroy',
+                                              reason='ID attribute not found')
+
+        self._destroy_in_db(self._context, self.id, self.name)
+        _ensure_trait_cache(self._context)
+        _TRAIT_CACHE.clear()
+
+
+@base.VersionedObjectRegistry.register
+class TraitList(base.ObjectListBase, base.VersionedObject):
+    # Version 1.0: Initial version
+    VERSION = '1.0'
+
+    fields = {
+        'objects': fields.ListOfObjectsField('Trait')
+    }
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_from_db(context, filters):
+        if not filters:
+            filters = {}
+
+        query = context.session.query(models.Trait)
+        if 'name_in' in filters:
+            query = query.filter(models.Trait.name.in_(
+                [six.text_type(n) for n in filters['name_in']]
+            ))
+        if 'prefix' in filters:
+            query = query.filter(models.Trait.name.startswith(
+                six.text_type(filters['prefix']), autoescape=True))
+        if 'associated' in filters:
+            associated = sa.select([_RP_TRAIT_TBL.c.trait_id])
+            if filters['associated']:
+                query = query.filter(models.Trait.id.in_(associated))
+            else:
+                query = query.filter(~models.Trait.id.in_(associated))
+        return query.order_by(models.Trait.name).all()
+
+    @classmethod
+    def get_all(cls, context, filters=None):
+        """Returns a TraitList of the traits matching filters, ordered by
+        name.
+
+        :param filters: Can be `name_in`, a list of names the traits must
+                        have one of, `prefix`, which the names must start
+                        with, or `associated`, whether the traits must or
+                        must not be associated with any resource provider.
+        """
+        _ensure_trait_cache(context)
+        db_traits = cls._get_all_from_db(context, filters)
+        return base.obj_make_list(context, cls(context), Trait, db_traits)
+
+    @staticmethod
+    @db.main_context_manager.reader
+    def _get_all_by_resource_provider_id(context, rp_id):
+        return context.session.query(models.Trait).join(
+            models.ResourceProviderTrait,
+            models.Trait.id == models.ResourceProviderTrait.trait_id).filter(
+                models.ResourceProviderTrait.resource_provider_id == rp_id
+            ).order_by(models.Trait.name).all()
+
+    @classmethod
+    def get_all_by_resource_provider(cls, context, resource_provider):
+        """Returns a TraitList of the traits associated with
+        resource_provider, ordered by name.
+        """
+        db_traits = cls._get_all_by_resource_provider_id(
+            context, resource_provider.id)
+        return base.obj_make_list(context, cls(context), Trait, db_traits)
+
+    def __repr__(self):
+        strings = [repr(x) for x in self.objects]
+        return "TraitList[" + ", ".join(strings) + "]"
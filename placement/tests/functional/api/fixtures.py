@@ -11,13 +11,19 @@
 #    under the License.
 
 import os
+import shutil
+import tempfile
 
 from gabbi import fixture
 from oslo_middleware import cors
+from oslo_serialization import jsonutils
 from oslo_utils import uuidutils
 
 from placement.api import auth
 from placement.api import deploy
+from placement.api import metrics
+from placement import aggregate_index
+from placement import capacity_index
 from placement import conf
 from placement import config
 from placement import objects
@@ -63,6 +69,15 @@ class APIFixture(fixture.GabbiFixture):
 
         self.main_db_fixture = fixtures.Database('main')
         self.main_db_fixture.reset()
+        # The database has been replaced so anything this process has
+        # indexed from a previous one is no longer valid.
+        capacity_index.clear()
+        aggregate_index.clear()
+        # The standard traits, and any trait ids cached, belong to the
+        # previous database.
+        objects._TRAITS_SYNCED = False
+        objects._TRAIT_CACHE = None
+        objects._CAPACITY_CACHE.clear()
 
         os.environ['RP_UUID'] = uuidutils.generate_uuid()
         os.environ['RP_NAME'] = uuidutils.generate_uuid()
@@ -135,6 +150,130 @@ class AllocationFixture(APIFixture):
         os.environ['ALT_RP_NAME'] = uuidutils.generate_uuid()
 
 
+class CapacityIndexFixture(AllocationFixture):
+    """An AllocationFixture which answers resource provider queries from
+    the in-memory capacity index.
+    """
+
+    def start_fixture(self):
+        super(CapacityIndexFixture, self).start_fixture()
+        self.conf.set_override('capacity_filter_engine', 'index',
+                               group='placement')
+
+
+class CapacityCrossCheckFixture(AllocationFixture):
+    """An AllocationFixture which answers resource provider queries from
+    the NumPy columnar capacity index and checks every answer against the
+    one the database gives for the same query.
+    """
+
+    def start_fixture(self):
+        super(CapacityCrossCheckFixture, self).start_fixture()
+        self.conf.set_override('capacity_filter_engine', 'numpy',
+                               group='placement')
+        rp_list = objects.ResourceProviderList
+        self.from_index = rp_list._get_all_by_filters_from_index
+        from_index = self.from_index
+
+        def cross_check(context, filters, limit=None, marker=None):
+            indexed = from_index(context, filters, limit=limit, marker=marker)
+            if indexed is not None:
+                from_db = rp_list._get_all_by_filters_from_db(
+                    context, filters, limit=limit, marker=marker)
+                expected = [rp.id for rp in from_db]
+                found = [rp['id'] for rp in indexed]
+                if found != expected:
+                    raise AssertionError(
+                        'Capacity index found %s for %s, database found %s' %
+                        (found, filters, expected))
+            return indexed
+
+        rp_list._get_all_by_filters_from_index = staticmethod(cross_check)
+
+    def stop_fixture(self):
+        objects.ResourceProviderList._get_all_by_filters_from_index = (
+            staticmethod(self.from_index))
+        super(CapacityCrossCheckFixture, self).stop_fixture()
+
+
+class SqlAccountingFixture(AllocationFixture):
+    """An AllocationFixture which reports the SQL statements run for each
+    request in response headers.
+    """
+
+    def start_fixture(self):
+        super(SqlAccountingFixture, self).start_fixture()
+        self.conf.set_override('sql_accounting_headers', True,
+                               group='placement')
+
+
+class SlowStatementFixture(AllocationFixture):
+    """An AllocationFixture which logs every SQL statement as slow, along
+    with the plan of those which are SELECTs.
+    """
+
+    def start_fixture(self):
+        super(SlowStatementFixture, self).start_fixture()
+        self.conf.set_override('slow_statement_threshold', 0.000001,
+                               group='placement')
+        self.conf.set_override('slow_statement_explain', True,
+                               group='placement')
+
+
+class MetricsFixture(APIFixture):
+    """An APIFixture which starts with empty request metrics and shares
+    them through a metrics directory with a pretend second worker process.
+    """
+
+    def start_fixture(self):
+        super(MetricsFixture, self).start_fixture()
+        metrics.get_registry().reset()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.conf.set_override('metrics_dir', self.metrics_dir,
+                               group='placement')
+        self.conf.set_override('metrics_flush_interval', 0,
+                               group='placement')
+        other_worker = {
+            'latency': {'GET /traits': [1] + [0] * len(metrics.BUCKETS) +
+                        [0.001]},
+            'status': {'GET /traits 200': 1},
+            'bytes': {'GET /traits': 100},
+            'microversion': {'1.6': 1},
+            'allocation_retries': {'retries': 2, 'exhausted': 1},
+        }
+        with open(os.path.join(self.metrics_dir,
+                               'placement-metrics-0-fixture.json'), 'w') as f:
+            f.write(jsonutils.dumps(other_worker))
+        # A worker which exited long ago, whose metrics are not reported.
+        exited_worker = os.path.join(self.metrics_dir,
+                                     'placement-metrics-1-fixture.json')
+        with open(exited_worker, 'w') as f:
+            f.write(jsonutils.dumps({'status': {'GET /traits 200': 100}}))
+        os.utime(exited_worker, (0, 0))
+
+    def stop_fixture(self):
+        shutil.rmtree(self.metrics_dir)
+        super(MetricsFixture, self).stop_fixture()
+
+
+class ProfileFixture(APIFixture):
+    """An APIFixture which profiles requests asked for with the
+    placement-profile header into a temporary directory, made available
+    to tests as PROFILE_DIR.
+    """
+
+    def start_fixture(self):
+        super(ProfileFixture, self).start_fixture()
+        self.profile_dir = tempfile.mkdtemp()
+        os.environ['PROFILE_DIR'] = self.profile_dir
+        self.conf.set_override('profile_dir', self.profile_dir,
+                               group='placement')
+
+    def stop_fixture(self):
+        shutil.rmtree(self.profile_dir)
+        super(ProfileFixture, self).stop_fixture()
+
+
 class CORSFixture(APIFixture):
     """An APIFixture that turns on CORS."""
 
@@ -0,0 +1,319 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Query count and wall time gates for the hot paths of placement.objects.
+
+Each hot path is measured at several sizes of the data it works on: the
+SQL statements run by one call and the median seconds taken by several.
+The measurements are compared with the baselines stored in
+hot_path_baselines.json. Running more statements than the baseline at any
+size fails the test, so that a path which runs a fixed number of
+statements cannot quietly come to run one per provider, allocation or
+resource class.
+
+Wall time depends on the machine, so it is only checked when
+OS_HOT_PATH_WALL_TIME is true, against the baseline multiplied by
+OS_HOT_PATH_TOLERANCE (3 by default).
+
+The baselines are for an in-memory SQLite database. After a change which
+is meant to alter them, measure and store new baselines with::
+
+    python -m placement.tests.functional.test_hot_paths
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import re
+import time
+
+import fixtures
+import sqlalchemy as sa
+import testtools
+
+from placement import aggregate_index
+from placement.api import auth
+from placement import capacity_index
+from placement import conf
+from placement import config
+from placement import db
+from placement.db import accounting
+from placement import objects
+from placement.tests import fixtures as placement_fixtures
+
+
+CONF = conf.CONF
+
+BASELINES_FILE = os.path.join(os.path.dirname(__file__),
+                              'hot_path_baselines.json')
+SIZES = (1, 10, 100)
+# The times each path is called after an unmeasured first call.
+REPEAT = 5
+_TRUE_VALUES = ('True', 'true', '1', 'yes')
+_WRITE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+@db.main_context_manager.writer
+def _check_capacity(context, allocs):
+    objects._check_capacity_exceeded(context.session.connection(), allocs)
+
+
+class HotPathDatabase(fixtures.Fixture):
+    """An empty in-memory database, with none of the module level caches
+    of placement.objects left over from any other.
+    """
+
+    def setUp(self):
+        super(HotPathDatabase, self).setUp()
+        CONF.set_override('connection', 'sqlite://', group='database')
+        config.parse_args([], default_config_files=[])
+        self.addCleanup(CONF.reset)
+        self.database = placement_fixtures.Database('main')
+        self.useFixture(self.database)
+        self.reset()
+
+    def reset(self):
+        self.database.reset()
+        objects._RC_CACHE = None
+        objects._TRAIT_CACHE = None
+        objects._TRAITS_SYNCED = False
+        objects._CAPACITY_CACHE.clear()
+        capacity_index.clear()
+        aggregate_index.clear()
+
+
+class HotPaths(object):
+    """Make the data each hot path works on, at a given size, and return a
+    function which calls the path once.
+    """
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def _providers(self, count, resource_class='VCPU', total=8):
+        rps = []
+        for index in range(count):
+            rp = objects.ResourceProvider(
+                self.ctx, name='rp-%d' % index,
+                uuid='00000000-0000-0000-0000-%012d' % index)
+            rp.create()
+            rp.set_inventory(objects.InventoryList(objects=[
+                self._inventory(rp, resource_class, total)]))
+            rps.append(rp)
+        return rps
+
+    def _inventory(self, rp, resource_class, total):
+        return objects.Inventory(
+            self.ctx, resource_provider=rp, resource_class=resource_class,
+            total=total, reserved=0, min_unit=1, max_unit=total, step_size=1,
+            allocation_ratio=1.0)
+
+    def _custom_classes(self, count):
+        names = ['CUSTOM_HOT_PATH_%d' % index for index in range(count)]
+        for name in names:
+            objects.ResourceClassObject(self.ctx, name=name).create()
+        return names
+
+    def capacity_check(self, size):
+        """_check_capacity_exceeded for allocations against size
+        providers.
+        """
+        rps = self._providers(size)
+        objects._ensure_rc_cache(self.ctx)
+        allocs = objects._make_allocation_rows(
+            [(rp, '11111111-1111-1111-1111-111111111111', 'VCPU', 1)
+             for rp in rps])
+        return lambda: _check_capacity(self.ctx, allocs)
+
+    def filter_providers(self, size):
+        """_get_all_by_filters_from_db with a resources filter among size
+        providers.
+        """
+        self._providers(size)
+        filters = {'resources': {'VCPU': 2}}
+        return lambda: objects.ResourceProviderList.\
+            _get_all_by_filters_from_db(self.ctx, filters)
+
+    def set_inventory(self, size):
+        """_set_inventory replacing the size resource classes of the
+        inventory of a provider.
+        """
+        names = self._custom_classes(size)
+        rp = self._providers(1)[0]
+        inv_lists = [
+            objects.InventoryList(objects=[
+                self._inventory(rp, name, total) for name in names])
+            for total in (10, 20)]
+        rp.set_inventory(inv_lists[1])
+        calls = []
+
+        def set_inventory():
+            calls.append(None)
+            objects._set_inventory(self.ctx, rp, inv_lists[len(calls) % 2])
+        return set_inventory
+
+    def usages(self, size):
+        """UsageList.get_all_by_resource_provider_uuid of a provider with
+        size consumers.
+        """
+        rp = self._providers(1, total=size)[0]
+        objects.AllocationList.create_all_from_tuples(self.ctx, [
+            (rp, '11111111-1111-1111-1111-%012d' % index, 'VCPU', 1)
+            for index in range(size)])
+        return lambda: objects.UsageList.get_all_by_resource_provider_uuid(
+            self.ctx, rp.uuid)
+
+    def rc_cache(self, size):
+        """ResourceClassCache lookups, by name and by id, of size custom
+        resource classes.
+        """
+        names = self._custom_classes(size)
+
+        def lookup():
+            objects._ensure_rc_cache(self.ctx)
+            cache = objects._RC_CACHE
+            for name in names:
+                cache.string_from_id(cache.id_from_string(name))
+        return lookup
+
+
+PATHS = ('capacity_check', 'filter_providers', 'set_inventory', 'usages',
+         'rc_cache')
+
+
+def measure(call):
+    """Return the most statements run by any of REPEAT calls of call, after
+    a first call which may fill caches, and their median seconds.
+    """
+    call()
+    statements = 0
+    timings = []
+    for _x in range(REPEAT):
+        stats = accounting.start()
+        start = time.time()
+        try:
+            call()
+        finally:
+            accounting.stop()
+        timings.append(time.time() - start)
+        statements = max(statements, stats.statements)
+    timings.sort()
+    return statements, timings[len(timings) // 2]
+
+
+def load_baselines():
+    with open(BASELINES_FILE) as baselines:
+        return json.load(baselines)
+
+
+class TestHotPaths(testtools.TestCase):
+
+    def setUp(self):
+        super(TestHotPaths, self).setUp()
+        self.useFixture(placement_fixtures.OutputStreamCapture())
+        self.useFixture(placement_fixtures.StandardLogging())
+        self.database = self.useFixture(HotPathDatabase())
+        self.baselines = load_baselines()
+        self.check_time = (os.environ.get('OS_HOT_PATH_WALL_TIME')
+                           in _TRUE_VALUES)
+        self.tolerance = float(os.environ.get('OS_HOT_PATH_TOLERANCE', 3))
+
+    def _check(self, path):
+        for size in SIZES:
+            self.database.reset()
+            hot_paths = HotPaths(auth.get_admin_context())
+            statements, seconds = measure(getattr(hot_paths, path)(size))
+            baseline = self.baselines[path][str(size)]
+            self.assertLessEqual(
+                statements, baseline['statements'],
+                '%s ran %d SQL statements at size %d, more than the '
+                'baseline of %d' % (path, statements, size,
+                                    baseline['statements']))
+            if self.check_time:
+                self.assertLessEqual(
+                    seconds, baseline['seconds'] * self.tolerance,
+                    '%s took %.6f seconds at size %d, more than %s times '
+                    'the baseline of %.6f' % (path, seconds, size,
+                                              self.tolerance,
+                                              baseline['seconds']))
+
+    def test_capacity_check(self):
+        self._check('capacity_check')
+
+    def test_filter_providers(self):
+        self._check('filter_providers')
+
+    def test_set_inventory(self):
+        self._check('set_inventory')
+
+    def test_usages(self):
+        self._check('usages')
+
+    def test_rc_cache(self):
+        self._check('rc_cache')
+
+    def test_set_same_aggregates(self):
+        """Setting the aggregates a provider already has writes nothing and
+        runs as many statements whatever their number.
+        """
+        counts = set()
+        for size in SIZES:
+            self.database.reset()
+            ctx = auth.get_admin_context()
+            rp = objects.ResourceProvider(
+                ctx, name='rp', uuid='00000000-0000-0000-0000-000000000000')
+            rp.create()
+            agg_uuids = ['11111111-1111-1111-1111-%012d' % index
+                         for index in range(size)]
+            rp.set_aggregates(agg_uuids)
+
+            statements = []
+
+            def record(conn, cursor, statement, parameters, context,
+                       executemany):
+                statements.append(statement)
+            engine = db.get_engine()
+            sa.event.listen(engine, 'before_cursor_execute', record)
+            try:
+                rp.set_aggregates(list(reversed(agg_uuids)))
+            finally:
+                sa.event.remove(engine, 'before_cursor_execute', record)
+            writes = [statement for statement in statements
+                      if _WRITE.match(statement)]
+            self.assertEqual([], writes,
+                             'setting %d unchanged aggregates wrote' % size)
+            counts.add(len(statements))
+        self.assertEqual(1, len(counts),
+                         'statements run at sizes %s: %s' % (SIZES, counts))
+
+
+def main():
+    """Measure every hot path and store the results as the baselines."""
+    baselines = {}
+    with HotPathDatabase() as database:
+        for path in PATHS:
+            baselines[path] = {}
+            for size in SIZES:
+                database.reset()
+                hot_paths = HotPaths(auth.get_admin_context())
+                statements, seconds = measure(getattr(hot_paths, path)(size))
+                baselines[path][str(size)] = {
+                    'statements': statements, 'seconds': round(seconds, 6)}
+                print('%-18s %5d %5d statements %10.6f seconds' % (
+                    path, size, statements, seconds))
+    with open(BASELINES_FILE, 'w') as baselines_file:
+        json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+        baselines_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Functional tests of placement.objects against an in-memory database."""
+
+import threading
+
+import fixtures
+import sqlalchemy as sa
+import testtools
+
+from placement.api import auth
+from placement import conf
+from placement import db
+from placement.db import models
+from placement import exception
+from placement import objects
+from placement.tests import fixtures as placement_fixtures
+from placement.tests.functional import test_hot_paths
+
+
+CONF = conf.CONF
+
+_AGG_TBL = models.PlacementAggregate.__table__
+
+
+@db.main_context_manager.writer
+def _bump_catalog_version(context, name):
+    """Change the version of a catalog as another API worker would."""
+    objects._bump_catalog_version(context.session.connection(), name)
+
+
+@db.main_context_manager.reader
+def _aggregate_uuids(context):
+    sel = sa.select([_AGG_TBL.c.uuid])
+    return set(r[0] for r in context.session.connection().execute(sel))
+
+
+class ObjectsTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(ObjectsTestCase, self).setUp()
+        self.useFixture(placement_fixtures.OutputStreamCapture())
+        self.useFixture(placement_fixtures.StandardLogging())
+        self.useFixture(test_hot_paths.HotPathDatabase())
+        self.ctx = auth.get_admin_context()
+
+    def _provider(self, index, inventory=None):
+        rp = objects.ResourceProvider(
+            self.ctx, name='rp-%d' % index,
+            uuid='00000000-0000-0000-0000-%012d' % index)
+        rp.create()
+        if inventory is not None:
+            rp.set_inventory(objects.InventoryList(objects=[
+                objects.Inventory(
+                    self.ctx, resource_provider=rp, resource_class=rc,
+                    total=total, reserved=0, min_unit=1, max_unit=total,
+                    step_size=1, allocation_ratio=1.0)
+                for rc, total in sorted(inventory.items())]))
+        return rp
+
+
+class TestPurgeOrphanedAggregates(ObjectsTestCase):
+
+    def setUp(self):
+        super(TestPurgeOrphanedAggregates, self).setUp()
+        self.kept = set()
+        self.orphaned = set()
+        for index in range(5):
+            rp = self._provider(index)
+            agg_uuids = ['11111111-1111-1111-1111-%012d' % (index * 2 + n)
+                         for n in range(2)]
+            rp.set_aggregates(agg_uuids)
+            if index < 2:
+                self.kept.update(agg_uuids)
+            else:
+                rp.set_aggregates([])
+                self.orphaned.update(agg_uuids)
+
+    def test_purge_in_batches(self):
+        self.assertEqual(
+            len(self.orphaned),
+            objects.purge_orphaned_aggregates(
+                self.ctx, batch_size=2, batch_interval=0))
+        self.assertEqual(self.kept, _aggregate_uuids(self.ctx))
+        self.assertEqual(
+            0, objects.purge_orphaned_aggregates(
+                self.ctx, batch_size=2, batch_interval=0))
+        self.assertEqual(self.kept, _aggregate_uuids(self.ctx))
+
+    def test_purge_max_rows(self):
+        self.assertEqual(
+            3, objects.purge_orphaned_aggregates(
+                self.ctx, batch_size=2, batch_interval=0, max_rows=3))
+        self.assertEqual(len(self.kept) + len(self.orphaned) - 3,
+                         len(_aggregate_uuids(self.ctx)))
+        self.assertTrue(self.kept <= _aggregate_uuids(self.ctx))
+
+
+class TestAllocationWriteRetries(ObjectsTestCase):
+
+    def setUp(self):
+        super(TestAllocationWriteRetries, self).setUp()
+        CONF.set_override('allocation_write_retries', 2, group='placement')
+        CONF.set_override('allocation_write_retry_interval', 0,
+                          group='placement')
+        self.rp = self._provider(0, {'VCPU': 8})
+        self.write_allocations = objects.AllocationList._write_allocations
+        self.attempts = 0
+
+    def _conflict(self, times):
+        """Make the first times writes of allocations fail as though the
+        generation of a resource provider had changed.
+        """
+        self.attempts = 0
+
+        def fake_write_allocations(context, allocs, partial):
+            self.attempts += 1
+            if self.attempts <= times:
+                raise exception.ConcurrentUpdateDetected()
+            return self.write_allocations(context, allocs, partial)
+        self.useFixture(fixtures.MonkeyPatch(
+            'placement.objects.AllocationList._write_allocations',
+            staticmethod(fake_write_allocations)))
+
+    def _allocate(self):
+        return objects.AllocationList.create_all_from_tuples(
+            self.ctx,
+            [(self.rp, '11111111-1111-1111-1111-111111111111', 'VCPU', 2)])
+
+    def _usage(self):
+        usages = objects.UsageList.get_all_by_resource_provider_uuid(
+            self.ctx, self.rp.uuid)
+        return {usage.resource_class: usage.usage for usage in usages}
+
+    def _assert_counts_changed(self, before, retries, exhausted):
+        after = objects.get_allocation_retry_counts()
+        self.assertEqual(retries, after['retries'] - before['retries'])
+        self.assertEqual(exhausted,
+                         after['exhausted'] - before['exhausted'])
+
+    def test_succeeds_within_retries(self):
+        for times in range(3):
+            self._conflict(times)
+            before = objects.get_allocation_retry_counts()
+            self._allocate()
+            self.assertEqual(times + 1, self.attempts)
+            self._assert_counts_changed(before, times, 0)
+        self.assertEqual({'VCPU': 2}, self._usage())
+
+    def test_gives_up_after_retries(self):
+        self._conflict(3)
+        before = objects.get_allocation_retry_counts()
+        self.assertRaises(exception.ConcurrentUpdateDetected, self._allocate)
+        self.assertEqual(3, self.attempts)
+        self._assert_counts_changed(before, 2, 1)
+        self.assertEqual({'VCPU': 0}, self._usage())
+
+    def test_no_retries(self):
+        CONF.set_override('allocation_write_retries', 0, group='placement')
+        self._conflict(1)
+        before = objects.get_allocation_retry_counts()
+        self.assertRaises(exception.ConcurrentUpdateDetected, self._allocate)
+        self.assertEqual(1, self.attempts)
+        self._assert_counts_changed(before, 0, 1)
+
+
+class FakeTime(object):
+    """A clock for placement.objects which only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestResourceClassCache(ObjectsTestCase):
+
+    def setUp(self):
+        super(TestResourceClassCache, self).setUp()
+        CONF.set_override('resource_class_negative_cache_ttl', 5,
+                          group='placement')
+        objects.ResourceClassObject(self.ctx, name='CUSTOM_KNOWN').create()
+        self.clock = FakeTime()
+        self.useFixture(fixtures.MonkeyPatch('placement.objects.time',
+                                             self.clock))
+        self.reloads = 0
+        refresh_from_db = objects._refresh_from_db
+
+        def counting_refresh_from_db(ctx):
+            self.reloads += 1
+            return refresh_from_db(ctx)
+        self.useFixture(fixtures.MonkeyPatch(
+            'placement.objects._refresh_from_db', counting_refresh_from_db))
+        self.cache = objects.ResourceClassCache(self.ctx)
+
+    def _assert_unknown(self):
+        self.assertRaises(exception.ResourceClassNotFound,
+                          self.cache.id_from_string, 'CUSTOM_UNKNOWN')
+
+    def _worker_lookup(self):
+        """Look up a custom resource class in the cache of this worker,
+        after checking the version of the resource class catalog if it is
+        time to.
+        """
+        objects._ensure_rc_cache(self.ctx)
+        return objects._RC_CACHE.id_from_string('CUSTOM_KNOWN')
+
+    def _use_worker_cache(self):
+        CONF.set_override('resource_class_cache_check_interval', 1,
+                          group='placement')
+        # Start with a cache of this worker which has yet to be used.
+        self.useFixture(fixtures.MonkeyPatch('placement.objects._RC_CACHE',
+                                             None))
+
+    def test_negative_cache(self):
+        for _x in range(3):
+            self._assert_unknown()
+        self.assertEqual(1, self.reloads)
+        self.clock.sleep(4)
+        self._assert_unknown()
+        self.assertEqual(1, self.reloads)
+        self.clock.sleep(2)
+        self._assert_unknown()
+        self.assertEqual(2, self.reloads)
+        # A known class is still found without reloading.
+        self.assertIsNotNone(self.cache.id_from_string('CUSTOM_KNOWN'))
+        self.assertEqual(2, self.reloads)
+
+    def test_negative_cache_disabled(self):
+        CONF.set_override('resource_class_negative_cache_ttl', 0,
+                          group='placement')
+        for _x in range(3):
+            self._assert_unknown()
+        self.assertEqual(3, self.reloads)
+
+    def test_concurrent_misses_reload_once(self):
+        snapshot = ({'CUSTOM_KNOWN': 10000}, {10000: 'CUSTOM_KNOWN'}, 1)
+        release = threading.Event()
+
+        def slow_refresh_from_db(ctx):
+            self.reloads += 1
+            release.wait(10)
+            return snapshot
+        self.useFixture(fixtures.MonkeyPatch(
+            'placement.objects._refresh_from_db', slow_refresh_from_db))
+
+        found = []
+        threads = [threading.Thread(target=lambda: found.append(
+            self.cache.id_from_string('CUSTOM_KNOWN'))) for _x in range(5)]
+        for thread in threads:
+            thread.start()
+        # Every thread has missed the empty snapshot and waits for the lock
+        # held by the one reloading it.
+        for _x in range(100):
+            if self.reloads:
+                break
+            release.wait(0.01)
+        release.wait(0.1)
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual([10000] * 5, found)
+        self.assertEqual(1, self.reloads)
+
+    def test_reload_when_version_changes(self):
+        self._use_worker_cache()
+        rc_id = self._worker_lookup()
+        self.assertEqual(1, self.reloads)
+        for _x in range(3):
+            self.clock.sleep(1)
+            self.assertEqual(rc_id, self._worker_lookup())
+        self.assertEqual(1, self.reloads)
+
+        _bump_catalog_version(self.ctx, objects._RC_CATALOG)
+        self.clock.sleep(1)
+        self.assertEqual(rc_id, self._worker_lookup())
+        self.assertEqual(2, self.reloads)
+        self.clock.sleep(1)
+        self.assertEqual(rc_id, self._worker_lookup())
+        self.assertEqual(2, self.reloads)
+
+    def test_version_checked_once_per_interval(self):
+        self._use_worker_cache()
+        self._worker_lookup()
+        _bump_catalog_version(self.ctx, objects._RC_CATALOG)
+        self.clock.sleep(0.5)
+        self._worker_lookup()
+        self.assertEqual(1, self.reloads)
+        self.clock.sleep(0.5)
+        self._worker_lookup()
+        self.assertEqual(2, self.reloads)
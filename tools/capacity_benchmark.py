@@ -0,0 +1,202 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Compare the capacity filter engines as the number of providers grows.
+
+A database is filled with resource providers which each have VCPU,
+MEMORY_MB and DISK_GB inventory, some usage and membership of one of a
+few aggregates. For each provider count the same resources and member_of
+queries are answered by every value of [placement]/capacity_filter_engine
+and the median time per query is reported, along with the time taken by
+the index engines to build their index on first use and the median time
+spent in the engine itself, before resource provider objects are made
+from its results. The engines are also checked to agree on every answer.
+
+Usage::
+
+    python tools/capacity_benchmark.py --sizes 100,1000,10000
+
+By default a temporary SQLite file is used. Pass --connection to use
+another database; it will be synced to the current schema and written to.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from oslo_utils import uuidutils
+import sqlalchemy as sa
+
+from placement.api import auth
+from placement import capacity_index
+from placement import conf
+from placement import config
+from placement import db
+from placement.db import migration
+from placement.db import models
+from placement import objects
+
+
+CONF = conf.CONF
+
+ENGINES = ('sql', 'index', 'numpy')
+AGGREGATES = [uuidutils.generate_uuid() for _x in range(8)]
+INVENTORY = {
+    'VCPU': dict(total=64, reserved=0, max_unit=64, allocation_ratio=16.0),
+    'MEMORY_MB': dict(total=262144, reserved=4096, max_unit=262144,
+                      allocation_ratio=1.5),
+    'DISK_GB': dict(total=4096, reserved=0, max_unit=4096,
+                    allocation_ratio=1.0),
+}
+QUERIES = [
+    {'resources': {'VCPU': 4, 'MEMORY_MB': 8192, 'DISK_GB': 80}},
+    {'resources': {'VCPU': 256, 'MEMORY_MB': 131072}},
+    {'member_of': AGGREGATES[:2], 'resources': {'VCPU': 2}},
+]
+
+
+def _rc_id(rc_name):
+    return objects.ResourceClass.STANDARD.index(rc_name)
+
+
+@db.main_context_manager.writer
+def _add_providers(ctx, count):
+    """Add count resource providers, with inventory, usage and aggregates,
+    to the database.
+    """
+    conn = ctx.session.connection()
+    agg_tbl = models.PlacementAggregate.__table__
+    if not conn.execute(sa.select([sa.func.count()]).select_from(
+            agg_tbl)).scalar():
+        conn.execute(agg_tbl.insert(), [{'uuid': u} for u in AGGREGATES])
+    agg_ids = [r[0] for r in conn.execute(sa.select([agg_tbl.c.id]))]
+
+    rp_tbl = models.ResourceProvider.__table__
+    conn.execute(rp_tbl.insert(), [
+        {'uuid': uuidutils.generate_uuid(), 'name': uuidutils.generate_uuid(),
+         'generation': 1, 'can_host': 0} for _x in range(count)])
+    rp_ids = [r[0] for r in conn.execute(
+        sa.select([rp_tbl.c.id]).order_by(rp_tbl.c.id.desc()).limit(count))]
+
+    inventories = []
+    usages = []
+    members = []
+    for rp_id in rp_ids:
+        for rc_name, inv in INVENTORY.items():
+            inventories.append(dict(
+                inv, resource_provider_id=rp_id,
+                resource_class_id=_rc_id(rc_name), min_unit=1, step_size=1))
+            capacity = (inv['total'] - inv['reserved']) * inv[
+                'allocation_ratio']
+            usages.append({'resource_provider_id': rp_id,
+                           'resource_class_id': _rc_id(rc_name),
+                           'used': int(capacity * random.random())})
+        members.append({'resource_provider_id': rp_id,
+                        'aggregate_id': random.choice(agg_ids)})
+    conn.execute(models.Inventory.__table__.insert(), inventories)
+    conn.execute(models.ProviderUsage.__table__.insert(), usages)
+    conn.execute(models.ResourceProviderAggregate.__table__.insert(),
+                 members)
+
+
+def _median(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2]
+
+
+def _time_engine(ctx, engine, repeat):
+    """Return the seconds taken by the first query, which builds the index
+    for the index engines, the median seconds per query after that, the
+    median seconds per query spent in the engine and the ids found by each
+    query.
+    """
+    CONF.set_override('capacity_filter_engine', engine, group='placement')
+    capacity_index.clear()
+    rp_list = objects.ResourceProviderList
+
+    start = time.time()
+    rp_list.get_all_by_filters(ctx, QUERIES[0])
+    first = time.time() - start
+
+    if engine == 'sql':
+        from_engine = rp_list._get_all_by_filters_from_db
+    else:
+        from_engine = rp_list._get_all_by_filters_from_index
+
+    timings = []
+    engine_timings = []
+    found = []
+    for filters in QUERIES:
+        for _x in range(repeat):
+            start = time.time()
+            rps = rp_list.get_all_by_filters(ctx, filters)
+            timings.append(time.time() - start)
+            start = time.time()
+            from_engine(ctx, filters)
+            engine_timings.append(time.time() - start)
+        found.append([rp.id for rp in rps])
+    return first, _median(timings), _median(engine_timings), found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        help='Comma separated resource provider counts')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Times each query is repeated per engine')
+    parser.add_argument('--connection',
+                        help='Database connection URL, defaults to a '
+                             'temporary SQLite file')
+    args = parser.parse_args()
+
+    db_file = None
+    connection = args.connection
+    if connection is None:
+        fd, db_file = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        connection = 'sqlite:///%s' % db_file
+    config.parse_args([], default_config_files=[])
+    CONF.set_override('connection', connection, group='database')
+    # The benchmark measures the engines, not how quickly they notice
+    # changes, so the index is never considered stale.
+    CONF.set_override('capacity_index_max_age', 3600, group='placement')
+    migration.db_sync()
+    ctx = auth.get_admin_context()
+
+    print('%10s %8s %12s %12s %12s' % ('providers', 'engine', 'first (ms)',
+                                       'query (ms)', 'engine (ms)'))
+    total = 0
+    try:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            _add_providers(ctx, size - total)
+            total = size
+            answers = {}
+            for engine in ENGINES:
+                first, median, in_engine, answers[engine] = _time_engine(
+                    ctx, engine, args.repeat)
+                print('%10d %8s %12.2f %12.2f %12.2f' % (
+                    size, engine, first * 1000, median * 1000,
+                    in_engine * 1000))
+            for engine in ENGINES[1:]:
+                if answers[engine] != answers['sql']:
+                    raise SystemExit('%s engine disagrees with sql engine at '
+                                     '%d providers' % (engine, size))
+    finally:
+        if db_file:
+            os.unlink(db_file)
+
+
+if __name__ == '__main__':
+    main()